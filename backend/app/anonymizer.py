@@ -1,49 +1,94 @@
 import re
 import os
-import unicodedata
-from typing import List
+from typing import Dict, List, Optional, Pattern, Tuple
+from app.metrics import span
+from app.text import fold, trie_regex
 
 class Anonymizer:
     def __init__(self, names_file_path: str = None):
         self.names_to_replace = []
+        self._pattern: Optional[Pattern] = None
+        self._replacements: Dict[str, str] = {}
+        self._fold_cache: Dict[str, str] = {}
         if names_file_path and os.path.exists(names_file_path):
             self.load_names_from_file(names_file_path)
-    
+
     def load_names_from_file(self, file_path: str):
         try:
             with open(file_path, 'r', encoding='utf-8') as file:
                 self.names_to_replace = [name.strip() for name in file.readlines() if name.strip()]
         except Exception:
             self.names_to_replace = []
-    
-    def _remove_diacritics(self, text):
-        """Remove diacritics from text"""
-        return ''.join(c for c in unicodedata.normalize('NFKD', text)
-                       if not unicodedata.combining(c))
-    
+
+        self._build_matcher()
+
+    def _fold_char(self, char: str) -> str:
+        folded = self._fold_cache.get(char)
+        if folded is None:
+            folded = fold(char)
+            self._fold_cache[char] = folded
+        return folded
+
+    def _build_matcher(self):
+        """Compile all names into a single trie-shaped regex over folded text.
+
+        Each folded name maps to the placeholder of its first occurrence in the
+        names list (see app.text.trie_regex).
+        """
+        self._replacements = {}
+        for i, name in enumerate(self.names_to_replace):
+            folded = fold(name)
+            if folded and folded not in self._replacements:
+                self._replacements[folded] = f"[PERSON_{i+1}]"
+
+        if not self._replacements:
+            self._pattern = None
+            return
+
+        self._pattern = re.compile(trie_regex(self._replacements))
+
+    def _fold_with_offsets(self, text: str) -> Tuple[str, List[int]]:
+        """Fold text and return, for every folded char, its index in the original."""
+        folded_chars = []
+        offsets = []
+        for index, char in enumerate(text):
+            folded = char if char.isascii() and not char.isupper() else self._fold_char(char)
+            for folded_char in folded:
+                folded_chars.append(folded_char)
+                offsets.append(index)
+        return ''.join(folded_chars), offsets
+
+    def find_names(self, text: str) -> List[Tuple[int, int, str]]:
+        """Return (start, end, placeholder) spans of names in the original text."""
+        if self._pattern is None or not text:
+            return []
+
+        folded, offsets = self._fold_with_offsets(text)
+        spans = []
+        for match in self._pattern.finditer(folded):
+            start = offsets[match.start()]
+            end = offsets[match.end() - 1] + 1
+            # Keep combining marks that trail the last matched letter
+            while end < len(text) and not self._fold_char(text[end]):
+                end += 1
+            spans.append((start, end, self._replacements[match.group()]))
+        return spans
+
     def anonymize_text(self, text: str) -> str:
         """Anonymize text by replacing names with placeholders."""
         if not self.names_to_replace or not text:
             return text
-        
-        result = text
-        
-        # Process each name in the list
-        for i, name in enumerate(self.names_to_replace):
-            # Skip empty names
-            if not name:
-                continue
-            
-            # Create the replacement
-            replacement = f"[PERSON_{i+1}]"
-            
-            # Create pattern for case insensitive surname matching
-            pattern = re.compile(re.escape(name), re.IGNORECASE)
-            
-            # Replace all occurrences
-            result = pattern.sub(replacement, result)
-            
-        return result
-    
+
+        result = []
+        position = 0
+        for start, end, replacement in self.find_names(text):
+            result.append(text[position:start])
+            result.append(replacement)
+            position = end
+        result.append(text[position:])
+
+        return ''.join(result)
+
     def anonymize_texts(self, texts: List[str]) -> List[str]:
-        return [self.anonymize_text(text) for text in texts] 
\ No newline at end of file
+        with span("anonymize"):
+            return [self.anonymize_text(text) for text in texts]
@@ -0,0 +1,149 @@
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Optional, Union
+from app.metrics import CACHE_LOOKUPS, registry
+
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(os.path.dirname(__file__), '..', 'cache'))
+
+def _lookups(name: str):
+    """Hits and misses of a cache, summed over the worker processes (see app.metrics)."""
+    return int(registry.value(CACHE_LOOKUPS, cache=name, result="hit")), int(registry.value(CACHE_LOOKUPS, cache=name, result="miss"))
+
+class DiskCache:
+    """Size-bounded LRU cache of compressed text values stored in SQLite.
+
+    Entries older than ttl seconds (if set) are treated as missing.
+    """
+
+    def __init__(self, path: str, max_bytes: int, ttl: Optional[float] = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries(last_access)")
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                row = None
+
+            if row is None:
+                CACHE_LOOKUPS.inc(cache=self.name, result="miss")
+                return None
+
+            self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            CACHE_LOOKUPS.inc(cache=self.name, result="hit")
+
+        return zlib.decompress(row[0]).decode('utf-8')
+
+    def set(self, key: str, value: str):
+        blob = zlib.compress(value.encode('utf-8'))
+        if len(blob) > self.max_bytes:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now, now),
+            )
+            self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries until the store fits in max_bytes."""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        hits, misses = _lookups(self.name)
+
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "entries": entries,
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+            "ttl_s": self.ttl,
+        }
+
+class RedisCache:
+    """DiskCache counterpart stored in a Redis-compatible server, shared by all workers and replicas.
+
+    Values are zlib-compressed like DiskCache's. The server's maxmemory policy
+    (allkeys-lru) bounds the total size; max_bytes only rejects single values.
+    """
+
+    def __init__(self, client, namespace: str, max_bytes: int, ttl: Optional[float] = None):
+        self.client = client
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.name = namespace.rpartition(":")[2]
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def get(self, key: str) -> Optional[str]:
+        blob = self.client.get(self._key(key))
+        if blob is None:
+            CACHE_LOOKUPS.inc(cache=self.name, result="miss")
+            return None
+        CACHE_LOOKUPS.inc(cache=self.name, result="hit")
+        return zlib.decompress(blob).decode('utf-8')
+
+    def set(self, key: str, value: str):
+        blob = zlib.compress(value.encode('utf-8'))
+        if len(blob) > self.max_bytes:
+            return
+        self.client.set(self._key(key), blob, px=int(self.ttl * 1000) if self.ttl else None)
+
+    def clear(self):
+        for key in self.client.scan_iter(match=f"{self.namespace}:*", count=1000):
+            self.client.delete(key)
+
+    def stats(self) -> Dict[str, float]:
+        entries = sum(1 for _ in self.client.scan_iter(match=f"{self.namespace}:*", count=1000))
+        hits, misses = _lookups(self.name)
+
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "entries": entries,
+            "size_bytes": None,
+            "max_bytes": self.max_bytes,
+            "ttl_s": self.ttl,
+        }
+
+# Either backend; see app.state.open_cache
+Cache = Union[DiskCache, RedisCache]
@@ -0,0 +1,266 @@
+import os
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from app.cache import CACHE_DIR
+from app.chunking import DATE_EARLIEST, date_order
+from app.validation import FieldSchema, ValidatedRecord
+
+# Per-patient cases built up document by document. A local SQLite file; with
+# replicas on several hosts it must sit on a volume they share
+CASE_DB_PATH = os.getenv("CASE_DB_PATH", os.path.join(CACHE_DIR, "cases.sqlite3"))
+
+# How a new value is merged into a parameter that already has one:
+# "replace"  - the newer document describes the current state (measurements, ECOG, TNM, text)
+# "earliest" - diagnosis, start and operation dates record when something first
+#              happened; an earlier value replaces the current one, a later one
+#              is reported as a conflict and not applied
+# "latest"   - end and assessment dates; the other way round
+# "union"    - multiple-choice and multiple-code parameters collect the values of all documents
+# Which dates are which is shared with the chunk merge (chunking.date_order)
+MERGE_REPLACE, MERGE_EARLIEST, MERGE_LATEST, MERGE_UNION = "replace", "earliest", "latest", "union"
+
+class CaseParameter(NamedTuple):
+    """The current value of one parameter of a case, with where it came from."""
+    parameter: str
+    value: str
+    normalized: object
+    type: str
+    valid: bool
+    error: Optional[str]
+    # [{"document": seq, "line_reference": "12"}]; several for merged ("union") values
+    sources: List[dict]
+
+    @property
+    def has_value(self) -> bool:
+        return self.valid and self.normalized is not None
+
+class CaseDocument(NamedTuple):
+    """A document to add to a case, with its extraction result."""
+    name: str
+    digest: str
+    text: str
+    anonymized_text: str
+    records: List[ValidatedRecord]
+
+def text_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def merge_policy(name: str, schema: FieldSchema) -> str:
+    if schema.multiple:
+        return MERGE_UNION
+    if schema.type in ("date", "year"):
+        return MERGE_EARLIEST if date_order(name) == DATE_EARLIEST else MERGE_LATEST
+    return MERGE_REPLACE
+
+def merge_parameter(current: Optional[CaseParameter], record: ValidatedRecord, document: int, policy: str) -> Tuple[CaseParameter, Optional[str]]:
+    """Merge one extracted record into the case value; returns the new value and the change.
+
+    Changes are "added" (first value), "updated" (replaced or extended) and
+    "conflict" (a later date for a MERGE_EARLIEST parameter, an earlier one
+    for MERGE_LATEST; not applied);
+    None when nothing changed. Empty and invalid answers never overwrite a value.
+    """
+    source = {"document": document, "line_reference": record.line_reference}
+    new = CaseParameter(record.parameter, record.value, record.normalized, record.type, record.valid, record.error, [source])
+    if current is None:
+        return new, "added" if new.has_value else None
+    if not new.has_value:
+        # An invalid value is replaced by a valid (empty) answer, but not the other way round
+        return (new, None) if record.valid and not current.valid else (current, None)
+    if not current.has_value:
+        return new, "added"
+    if current.normalized == record.normalized:
+        return current, None
+
+    if policy in (MERGE_EARLIEST, MERGE_LATEST):
+        # Normalized dates are ISO strings (years are ints), so they compare in date order
+        earlier = record.normalized < current.normalized
+        return (new, "updated") if earlier == (policy == MERGE_EARLIEST) else (current, "conflict")
+    if policy == MERGE_UNION:
+        values = list(current.normalized) + [value for value in record.normalized if value not in current.normalized]
+        if values == list(current.normalized):
+            return current, None
+        return current._replace(value=", ".join(map(str, values)), normalized=values, sources=current.sources + [source]), "updated"
+    return new, "updated"
+
+def merge_records(
+    parameters: Dict[int, CaseParameter],
+    records: List[ValidatedRecord],
+    document: int,
+    schemas: List[FieldSchema],
+) -> Tuple[Dict[int, CaseParameter], List[dict]]:
+    """Merge a document's records (one per parameter, in parameter order) into a case."""
+    merged = dict(parameters)
+    diff = []
+    for index, record in enumerate(records):
+        current = merged.get(index)
+        value, change = merge_parameter(current, record, document, merge_policy(record.parameter, schemas[index]))
+        merged[index] = value
+        if change is not None:
+            diff.append({
+                "index": index,
+                "parameter": record.parameter,
+                "change": change,
+                "old": current.value if current is not None and current.has_value else None,
+                "new": record.value,
+                "document": document,
+                "line_reference": record.line_reference,
+            })
+    return merged, diff
+
+class CaseStore:
+    """SQLite-backed cases: documents (text, anonymized text) and current parameter values.
+
+    Updates read and write the parameters inside one IMMEDIATE transaction,
+    so concurrent updates of a case from several worker processes serialize
+    instead of losing each other's merges.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # Connected lazily, and again after a fork: connections must not cross processes
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cases ("
+                "id TEXT PRIMARY KEY, analysis_type TEXT NOT NULL, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS case_documents ("
+                "case_id TEXT NOT NULL, seq INTEGER NOT NULL, name TEXT, digest TEXT NOT NULL, "
+                "text TEXT NOT NULL, anonymized_text TEXT NOT NULL, model TEXT, added_at REAL NOT NULL, "
+                "PRIMARY KEY (case_id, seq))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS case_documents_digest ON case_documents(case_id, digest)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS case_parameters ("
+                "case_id TEXT NOT NULL, idx INTEGER NOT NULL, parameter TEXT NOT NULL, value TEXT NOT NULL, "
+                "normalized TEXT, type TEXT NOT NULL, valid INTEGER NOT NULL, error TEXT, sources TEXT NOT NULL, "
+                "updated_at REAL NOT NULL, PRIMARY KEY (case_id, idx))"
+            )
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def get(self, case_id: str) -> Optional[dict]:
+        """The case with its document list (without texts) and current parameters in order."""
+        with self._lock:
+            case = self.conn.execute("SELECT * FROM cases WHERE id = ?", (case_id,)).fetchone()
+            if case is None:
+                return None
+            documents = self.conn.execute(
+                "SELECT seq, name, digest, model, added_at FROM case_documents WHERE case_id = ? ORDER BY seq", (case_id,)
+            ).fetchall()
+            parameters = self._parameters(case_id)
+        return {
+            **dict(case),
+            "documents": [dict(document) for document in documents],
+            "parameters": [{"index": index, **parameter._asdict()} for index, parameter in sorted(parameters.items())],
+        }
+
+    def documents(self, case_id: str, digests: List[str]) -> Dict[str, int]:
+        """Sequence numbers of the case documents with the given text digests."""
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT digest, seq FROM case_documents WHERE case_id = ? AND digest IN ({', '.join('?' * len(digests))})",
+                (case_id, *digests),
+            ).fetchall() if digests else []
+        return {digest: seq for digest, seq in rows}
+
+    def analysis_type(self, case_id: str) -> Optional[str]:
+        with self._lock:
+            row = self.conn.execute("SELECT analysis_type FROM cases WHERE id = ?", (case_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def delete(self, case_id: str) -> bool:
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self.conn.execute("DELETE FROM cases WHERE id = ?", (case_id,))
+                self.conn.execute("DELETE FROM case_documents WHERE case_id = ?", (case_id,))
+                self.conn.execute("DELETE FROM case_parameters WHERE case_id = ?", (case_id,))
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return cursor.rowcount > 0
+
+    def _parameters(self, case_id: str) -> Dict[int, CaseParameter]:
+        rows = self.conn.execute("SELECT * FROM case_parameters WHERE case_id = ?", (case_id,)).fetchall()
+        return {
+            row["idx"]: CaseParameter(
+                row["parameter"], row["value"], json.loads(row["normalized"]) if row["normalized"] is not None else None,
+                row["type"], bool(row["valid"]), row["error"], json.loads(row["sources"]),
+            )
+            for row in rows
+        }
+
+    def add_documents(
+        self,
+        case_id: str,
+        analysis_type: str,
+        model: str,
+        documents: List[CaseDocument],
+        merge: Callable[[Dict[int, CaseParameter], List[ValidatedRecord], int], Tuple[Dict[int, CaseParameter], List[dict]]],
+    ) -> Tuple[List[Optional[int]], List[dict]]:
+        """Append documents to a case (created if missing) and merge their records, in order.
+
+        Documents whose digest the case already has are skipped. Returns the
+        sequence numbers given to the documents (None for skipped ones) and the diff.
+        """
+        now = time.time()
+        seqs: List[Optional[int]] = []
+        diff: List[dict] = []
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                case = self.conn.execute("SELECT analysis_type FROM cases WHERE id = ?", (case_id,)).fetchone()
+                if case is None:
+                    self.conn.execute("INSERT INTO cases (id, analysis_type, created_at, updated_at) VALUES (?, ?, ?, ?)", (case_id, analysis_type, now, now))
+                elif case[0] != analysis_type:
+                    raise ValueError(f"Case {case_id} uses the {case[0]} analysis type, not {analysis_type}")
+
+                parameters = self._parameters(case_id)
+                before = dict(parameters)
+                seq = self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM case_documents WHERE case_id = ?", (case_id,)).fetchone()[0]
+                for document in documents:
+                    if self.conn.execute("SELECT 1 FROM case_documents WHERE case_id = ? AND digest = ?", (case_id, document.digest)).fetchone():
+                        seqs.append(None)
+                        continue
+                    seq += 1
+                    self.conn.execute(
+                        "INSERT INTO case_documents (case_id, seq, name, digest, text, anonymized_text, model, added_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (case_id, seq, document.name, document.digest, document.text, document.anonymized_text, model, now),
+                    )
+                    parameters, changes = merge(parameters, document.records, seq)
+                    diff.extend(changes)
+                    seqs.append(seq)
+
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO case_parameters (case_id, idx, parameter, value, normalized, type, valid, error, sources, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (case_id, index, parameter.parameter, parameter.value,
+                         json.dumps(parameter.normalized, ensure_ascii=False) if parameter.normalized is not None else None,
+                         parameter.type, int(parameter.valid), parameter.error, json.dumps(parameter.sources, ensure_ascii=False), now)
+                        for index, parameter in parameters.items() if before.get(index) != parameter
+                    ],
+                )
+                self.conn.execute("UPDATE cases SET updated_at = ? WHERE id = ?", (now, case_id))
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return seqs, diff
@@ -0,0 +1,168 @@
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+from app.prompt import ParameterSpec
+from app.response_parser import ResponseRow, parse_response_rows
+from app.text import fold
+
+_DATE_PATTERNS = [
+    re.compile(r'\b(\d{1,2})\.\s*(\d{1,2})\.\s*(\d{4})\b'),
+    re.compile(r'\b(\d{4})-(\d{1,2})-(\d{1,2})\b'),
+    re.compile(r'\b(\d{1,2})[/.](\d{4})\b'),
+    re.compile(r'\b(\d{4})\b'),
+]
+
+def split_numbered_text(numbered_text: str, max_tokens: int, count_tokens: Callable[[str], int]) -> List[str]:
+    """Split line-numbered text into windows of at most max_tokens.
+
+    Windows break only on line boundaries, so every line keeps the global
+    number it was given. A single line longer than the budget is split into
+    pieces that all carry its line number.
+    """
+    windows: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+
+    for line in numbered_text.split('\n'):
+        line_tokens = count_tokens(line) + 1
+        pieces = [line] if line_tokens <= max_tokens else _split_long_line(line, max_tokens, count_tokens)
+
+        for piece in pieces:
+            piece_tokens = line_tokens if len(pieces) == 1 else count_tokens(piece) + 1
+            if current and current_tokens + piece_tokens > max_tokens:
+                windows.append('\n'.join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += piece_tokens
+
+    if current:
+        windows.append('\n'.join(current))
+    return windows
+
+def _split_long_line(line: str, max_tokens: int, count_tokens: Callable[[str], int]) -> List[str]:
+    number, _, content = line.partition(': ')
+    prefix = f"{number}: "
+    # Characters per token is roughly constant within a line
+    chars_per_piece = max(1, int(len(content) * max_tokens / max(count_tokens(line), 1) * 0.9))
+    return [prefix + content[i:i + chars_per_piece] for i in range(0, len(content), chars_per_piece)]
+
+def parse_date(value: str) -> Optional[Tuple[int, int, int]]:
+    """Parse the first d.m.yyyy / yyyy-mm-dd / m/yyyy / yyyy date in value."""
+    for index, pattern in enumerate(_DATE_PATTERNS):
+        match = pattern.search(value)
+        if not match:
+            continue
+        groups = [int(group) for group in match.groups()]
+        if index == 0:
+            return groups[2], groups[1], groups[0]
+        if index == 1:
+            return groups[0], groups[1], groups[2]
+        if index == 2:
+            return groups[1], groups[0], 0
+        return groups[0], 0, 0
+    return None
+
+def _first_line(line_reference: str) -> int:
+    match = re.search(r'\d+', line_reference)
+    return int(match.group()) if match else 0
+
+# Which date of several is the answer. Diagnosis, start, operation and
+# enrolment dates record when something first happened: the earliest wins.
+# End, assessment, relapse and measurement dates describe the current state:
+# the latest wins. Shared with the case merge (cases.merge_policy)
+DATE_EARLIEST, DATE_LATEST = "earliest", "latest"
+_LATEST_DATE_TERMS = ("ukonceni", "hodnoceni", "relaps", "progrese", "vyrazeni", "mereni", "posledni")
+
+def date_order(name: str) -> str:
+    """DATE_LATEST or DATE_EARLIEST for a date (or year) parameter, by its name."""
+    # Extended names are "Category-Field"; only the field says what the date is
+    field = fold(name.rpartition("-")[2])
+    return DATE_LATEST if any(term in field for term in _LATEST_DATE_TERMS) else DATE_EARLIEST
+
+# Joins the different values found for a numeric parameter; such a value fails
+# validation (see validation.validate_value), so the parameter is asked again
+CONFLICT_SEPARATOR = " | "
+
+def pick_value(spec: ParameterSpec, candidates: List[ResponseRow]) -> Optional[ResponseRow]:
+    """Resolve conflicting values for one parameter, by its schema (see validation.derive_schema).
+
+    Dates: the earliest or latest parseable date wins (see date_order).
+    Choices: the option listed first in the value format wins, so "ANO" beats
+    "NE" and both beat "údaj není k dispozici"; values matching no option lose.
+    Numbers: equal values agree; different ones are flagged as a conflict,
+    joined with CONFLICT_SEPARATOR.
+    Everything else: the most specific (longest) value wins.
+    Ties go to the earliest line reference.
+    """
+    # app.validation imports this module
+    from app.validation import derive_schema, validate_value
+
+    if not candidates:
+        return None
+
+    schema = derive_schema(spec)
+    if schema.type in ("date", "year"):
+        dated = [(parse_date(row.value), row) for row in candidates]
+        dated = [(date, row) for date, row in dated if date]
+        if dated:
+            if date_order(spec.name) == DATE_EARLIEST:
+                return min(dated, key=lambda item: (item[0], _first_line(item[1].line_reference)))[1]
+            return max(dated, key=lambda item: (item[0], -_first_line(item[1].line_reference)))[1]
+
+    elif schema.type == "choice" and not schema.multiple:
+        def option_rank(row: ResponseRow) -> int:
+            valid, normalized, _ = validate_value(schema, row.value, {})
+            return schema.options.index(normalized) if valid and normalized is not None else len(schema.options)
+
+        return min(candidates, key=lambda row: (option_rank(row), _first_line(row.line_reference)))
+
+    elif schema.type in ("number", "integer", "ecog"):
+        numbers = [(validate_value(schema, row.value, {}), row) for row in candidates]
+        numbers = sorted(((normalized, row) for (valid, normalized, _), row in numbers if valid and normalized is not None),
+                         key=lambda item: _first_line(item[1].line_reference))
+        if numbers:
+            distinct = {}
+            for normalized, row in numbers:
+                distinct.setdefault(normalized, row)
+            if len(distinct) == 1:
+                return numbers[0][1]
+            rows = list(distinct.values())
+            return ResponseRow(spec.name, CONFLICT_SEPARATOR.join(row.value for row in rows), ", ".join(row.line_reference for row in rows))
+
+    return max(candidates, key=lambda row: (len(row.value), -_first_line(row.line_reference)))
+
+def group_rows_by_parameter(rows: List[ResponseRow], parameters: List[ParameterSpec]) -> Dict[int, List[ResponseRow]]:
+    """Assign rows to parameter positions.
+
+    Repeated names (e.g. two "Specifikace" rows) are matched to the parameter
+    list in order of occurrence.
+    """
+    positions: Dict[str, List[int]] = {}
+    for index, spec in enumerate(parameters):
+        positions.setdefault(spec.name, []).append(index)
+
+    grouped: Dict[int, List[ResponseRow]] = {}
+    seen: Dict[str, int] = {}
+    for row in rows:
+        indexes = positions.get(row.parameter)
+        if not indexes:
+            continue
+        occurrence = seen.get(row.parameter, 0)
+        seen[row.parameter] = occurrence + 1
+        grouped.setdefault(indexes[min(occurrence, len(indexes) - 1)], []).append(row)
+    return grouped
+
+def merge_chunk_responses(responses: List[str], parameters: List[ParameterSpec]) -> List[ResponseRow]:
+    """Merge per-window completions into one row per parameter, in parameter order."""
+    names = [spec.name for spec in parameters]
+    candidates: Dict[int, List[ResponseRow]] = {}
+
+    for response in responses:
+        grouped = group_rows_by_parameter(parse_response_rows(response, names), parameters)
+        for index, rows in grouped.items():
+            candidates.setdefault(index, []).extend(row for row in rows if row.found)
+
+    merged = []
+    for index, spec in enumerate(parameters):
+        row = pick_value(spec, candidates.get(index, []))
+        merged.append(ResponseRow(spec.name, row.value, row.line_reference) if row else ResponseRow(spec.name, "", "0"))
+    return merged
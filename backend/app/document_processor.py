@@ -1,85 +1,400 @@
 import os
+import hashlib
+import subprocess
 import tempfile
-from typing import List
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, BinaryIO, Callable, Dict, List, Optional, Tuple
 from fastapi import UploadFile
-import docx
-from pdf2image import convert_from_path
-import pytesseract
-from PIL import Image
-import openpyxl
+from app.cache import Cache
+from app.executor import run_blocking, run_cpu
+from app.metrics import ERRORS, observe_stage, span
+from app.state import open_cache
 
-async def process_documents(files: List[UploadFile]) -> List[str]:
+# Format libraries (python-docx, pdf2image, pytesseract, Pillow, openpyxl) are
+# imported inside the functions that use them, so startup does not pay for them
+if TYPE_CHECKING:
+    from docx.table import Table
+
+# OCR settings
+OCR_DPI = int(os.getenv("OCR_DPI", "200"))
+OCR_PSM = int(os.getenv("OCR_PSM", "3"))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+OCR_CHUNK_PAGES = int(os.getenv("OCR_CHUNK_PAGES", str(max(OCR_WORKERS, 1))))
+# Pages whose embedded text layer has at least this many characters skip OCR
+TEXT_LAYER_MIN_CHARS = int(os.getenv("TEXT_LAYER_MIN_CHARS", "50"))
+
+# Spreadsheet caps; extraction stops (and says so in the text) once either is hit
+XLSX_MAX_ROWS = int(os.getenv("XLSX_MAX_ROWS", "20000"))
+XLSX_MAX_CELLS = int(os.getenv("XLSX_MAX_CELLS", "500000"))
+TRUNCATION_MARKER = "[TRUNCATED"
+
+# Upload size limits per format, in MB
+FILE_SIZE_LIMITS_MB = {
+    ".txt": float(os.getenv("MAX_TXT_MB", "10")),
+    ".pdf": float(os.getenv("MAX_PDF_MB", "100")),
+    ".docx": float(os.getenv("MAX_DOCX_MB", "25")),
+    ".xlsx": float(os.getenv("MAX_XLSX_MB", "50")),
+    ".jpg": float(os.getenv("MAX_IMAGE_MB", "25")),
+    ".jpeg": float(os.getenv("MAX_IMAGE_MB", "25")),
+    ".png": float(os.getenv("MAX_IMAGE_MB", "25")),
+}
+
+# Bump whenever extraction output changes so stale cache entries are ignored
+EXTRACTOR_VERSION = "3"
+EXTRACTION_CACHE_ENABLED = os.getenv("EXTRACTION_CACHE_ENABLED", "true").lower() == "true"
+EXTRACTION_CACHE_MAX_MB = int(os.getenv("EXTRACTION_CACHE_MAX_MB", "512"))
+
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+# Receives (event, data) progress notifications, possibly from a worker thread
+ProgressCallback = Callable[[str, dict], None]
+
+_ocr_pool: Optional[ProcessPoolExecutor] = None
+_extraction_cache: Optional[Cache] = None
+
+def get_extraction_cache() -> Optional[Cache]:
+    """Return the shared extraction cache (see app.state), or None if it is disabled."""
+    global _extraction_cache
+    if EXTRACTION_CACHE_ENABLED and _extraction_cache is None:
+        _extraction_cache = open_cache("extraction", EXTRACTION_CACHE_MAX_MB * 1024 * 1024)
+    return _extraction_cache
+
+def extraction_cache_key(digest: str, file_extension: str) -> str:
+    """Key a document by its sha256 digest, the extractor version and OCR settings."""
+    settings = f"v{EXTRACTOR_VERSION}:dpi{OCR_DPI}:psm{OCR_PSM}:tl{TEXT_LAYER_MIN_CHARS}:xl{XLSX_MAX_ROWS}/{XLSX_MAX_CELLS}"
+    return f"{digest}:{file_extension}:{settings}"
+
+def spool_upload(source: BinaryIO, suffix: str) -> Tuple[str, str]:
+    """Copy an upload to a named temporary file in chunks, hashing it on the way.
+
+    Returns (path, sha256 hex digest); the caller removes the file.
+    """
+    digest = hashlib.sha256()
+    source.seek(0)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+        while True:
+            chunk = source.read(SPOOL_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            temp_file.write(chunk)
+    return temp_file.name, digest.hexdigest()
+
+def read_text_upload(source: BinaryIO) -> str:
+    source.seek(0)
+    return source.read().decode('utf-8')
+
+def upload_size(source: BinaryIO) -> int:
+    source.seek(0, os.SEEK_END)
+    size = source.tell()
+    source.seek(0)
+    return size
+
+def check_size_limit(size: int, file_extension: str) -> Optional[str]:
+    """Return an extraction error string if the upload exceeds its format's limit."""
+    limit_mb = FILE_SIZE_LIMITS_MB.get(file_extension)
+    if limit_mb is not None and size > limit_mb * 1024 * 1024:
+        file_type = file_extension.lstrip('.').upper()
+        return f"Error extracting text from {file_type}: file is {size / 1024 / 1024:.1f} MB, the limit is {limit_mb:g} MB"
+    return None
+
+async def process_documents(files: List[UploadFile], progress: Optional[ProgressCallback] = None) -> List[str]:
     results = []
     
-    for file in files:
-        file_content = await file.read()
+    for index, file in enumerate(files):
         file_extension = os.path.splitext(file.filename)[1].lower()
+        cached = False
+        size_error = check_size_limit(upload_size(file.file), file_extension)
         
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_extension) as temp_file:
-            temp_file.write(file_content)
-            temp_file_path = temp_file.name
-        
-        try:
-            if file_extension == '.pdf':
-                text = extract_text_from_pdf(temp_file_path)
-            elif file_extension == '.docx':
-                text = extract_text_from_docx(temp_file_path)
-            elif file_extension in ['.jpg', '.jpeg', '.png']:
-                text = extract_text_from_image(temp_file_path)
-            elif file_extension == '.xlsx':
-                text = extract_text_from_xlsx(temp_file_path)
-            elif file_extension == '.txt':
-                text = file_content.decode('utf-8')
-            else:
-                text = f"Unsupported file format: {file_extension}"
-            
-            results.append(text)
-        
-        finally:
-            if os.path.exists(temp_file_path):
+        if size_error:
+            text = size_error
+        elif file_extension == '.txt':
+            text = await run_blocking(read_text_upload, file.file)
+        else:
+            with span("upload_spool"):
+                temp_file_path, digest = await run_blocking(spool_upload, file.file, file_extension)
+            try:
+                cache = get_extraction_cache()
+                cache_key = extraction_cache_key(digest, file_extension)
+                text = await run_blocking(cache.get, cache_key) if cache else None
+                cached = text is not None
+                
+                if not cached:
+                    stage = f"extract_{file_extension.lstrip('.')}" if file_extension in FILE_SIZE_LIMITS_MB else "extract_other"
+                    with span(stage):
+                        if file_extension == '.pdf':
+                            # Drives the OCR process pool and reports progress from its thread
+                            text = await run_blocking(extract_text, temp_file_path, file_extension, progress)
+                        else:
+                            text = await run_cpu(extract_text, temp_file_path, file_extension)
+                    
+                    if cache and not is_extraction_error(text):
+                        await run_blocking(cache.set, cache_key, text)
+            finally:
                 os.unlink(temp_file_path)
         
-        await file.seek(0)
+        if is_extraction_error(text):
+            ERRORS.inc(stage="extraction")
+        results.append(text)
+        if progress:
+            progress("document", {
+                "index": index,
+                "filename": file.filename,
+                "characters": len(text),
+                "cached": cached,
+                "error": is_extraction_error(text),
+                "truncated": TRUNCATION_MARKER in text,
+            })
+        
+        file.file.seek(0)
     
     return results
 
-def extract_text_from_pdf(file_path: str) -> str:
+def extract_text(file_path: str, file_extension: str, progress: Optional[ProgressCallback] = None) -> str:
+    if file_extension == '.pdf':
+        return extract_text_from_pdf(file_path, progress)
+    elif file_extension == '.docx':
+        return extract_text_from_docx(file_path)
+    elif file_extension in ['.jpg', '.jpeg', '.png']:
+        return extract_text_from_image(file_path)
+    elif file_extension == '.xlsx':
+        return extract_text_from_xlsx(file_path)
+    else:
+        return f"Unsupported file format: {file_extension}"
+
+def is_extraction_error(text: str) -> bool:
+    return text.startswith("Error extracting text from") or text.startswith("Unsupported file format")
+
+def get_ocr_pool() -> ProcessPoolExecutor:
+    """Return the shared process pool used for page-level OCR."""
+    global _ocr_pool
+    if _ocr_pool is None:
+        _ocr_pool = ProcessPoolExecutor(max_workers=max(OCR_WORKERS, 1))
+    return _ocr_pool
+
+def shutdown_ocr_pool():
+    global _ocr_pool
+    if _ocr_pool is not None:
+        _ocr_pool.shutdown(wait=False, cancel_futures=True)
+        _ocr_pool = None
+
+def ocr_config() -> str:
+    return f"--psm {OCR_PSM}"
+
+def ocr_image_file(image_path: str, config: str) -> str:
+    """OCR a single rendered page. Runs inside the OCR process pool."""
+    import pytesseract
+    from PIL import Image
+    
+    with Image.open(image_path) as image:
+        return pytesseract.image_to_string(image, config=config)
+
+def timed_ocr_image_file(image_path: str, config: str) -> Tuple[str, float]:
+    """ocr_image_file plus its duration, measured inside the pool process."""
+    started = time.perf_counter()
+    text = ocr_image_file(image_path, config)
+    return text, time.perf_counter() - started
+
+def extract_text_layer(file_path: str) -> List[str]:
+    """Return the embedded text layer of a PDF, one entry per page.
+
+    Uses poppler's pdftotext; returns an empty list if it is unavailable.
+    """
     try:
-        images = convert_from_path(file_path)
-        text_content = [pytesseract.image_to_string(image) for image in images]
-        return "\n\n".join(text_content)
+        result = subprocess.run(
+            ["pdftotext", "-layout", "-enc", "UTF-8", file_path, "-"],
+            capture_output=True,
+            timeout=120,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return []
+    
+    if result.returncode != 0:
+        return []
+    
+    pages = result.stdout.decode("utf-8", errors="replace").split("\f")
+    # pdftotext terminates every page with a form feed
+    if pages and not pages[-1].strip():
+        pages = pages[:-1]
+    return pages
+
+def extract_text_from_pdf(file_path: str, progress: Optional[ProgressCallback] = None) -> str:
+    """Extract text from a PDF page by page.
+
+    Pages with a usable text layer are taken as-is. The remaining pages are
+    rendered lazily in chunks of OCR_CHUNK_PAGES to a temp directory and
+    OCR'd across the process pool, so memory stays bounded by the chunk size.
+    """
+    from pdf2image import pdfinfo_from_path
+    
+    try:
+        page_count = int(pdfinfo_from_path(file_path)["Pages"])
+        with span("pdf_text_layer"):
+            text_layer = extract_text_layer(file_path)
+        
+        page_texts: Dict[int, str] = {}
+        if len(text_layer) == page_count:
+            for page, text in enumerate(text_layer, start=1):
+                if len(text.strip()) >= TEXT_LAYER_MIN_CHARS:
+                    page_texts[page] = text
+        
+        pages_to_ocr = [page for page in range(1, page_count + 1) if page not in page_texts]
+        if pages_to_ocr:
+            page_texts.update(ocr_pdf_pages(file_path, pages_to_ocr, progress))
+        
+        return "\n\n".join(page_texts[page] for page in range(1, page_count + 1))
     except Exception as e:
         return f"Error extracting text from PDF: {str(e)}"
 
+def ocr_pdf_pages(file_path: str, pages: List[int], progress: Optional[ProgressCallback] = None) -> Dict[int, str]:
+    """Render and OCR the given 1-based pages, returning text keyed by page."""
+    from pdf2image import convert_from_path
+    
+    pool = get_ocr_pool()
+    config = ocr_config()
+    results: Dict[int, str] = {}
+    
+    with tempfile.TemporaryDirectory(prefix="ocr_") as output_dir:
+        pending = []
+        
+        for chunk in _page_runs(pages, OCR_CHUNK_PAGES):
+            with span("pdf_render"):
+                image_paths = convert_from_path(
+                    file_path,
+                    dpi=OCR_DPI,
+                    first_page=chunk[0],
+                    last_page=chunk[-1],
+                    output_folder=output_dir,
+                    fmt="png",
+                    paths_only=True,
+                )
+            
+            # Wait for the previous chunk while this one is queued, so at most
+            # two chunks of rendered pages exist on disk at any time.
+            _collect_ocr_results(pending, results, len(pages), progress)
+            pending = [
+                (page, image_path, pool.submit(timed_ocr_image_file, image_path, config))
+                for page, image_path in zip(chunk, sorted(image_paths))
+            ]
+        
+        _collect_ocr_results(pending, results, len(pages), progress)
+    
+    return results
+
+def _collect_ocr_results(pending: list, results: Dict[int, str], total: int, progress: Optional[ProgressCallback]):
+    for page, image_path, future in pending:
+        try:
+            results[page], seconds = future.result()
+            observe_stage("ocr_page", seconds)
+        finally:
+            if os.path.exists(image_path):
+                os.unlink(image_path)
+        
+        if progress:
+            progress("ocr_page", {"page": page, "completed": len(results), "total": total})
+
+def _page_runs(pages: List[int], chunk_size: int) -> List[List[int]]:
+    """Split sorted page numbers into contiguous runs of at most chunk_size."""
+    runs: List[List[int]] = []
+    for page in pages:
+        if runs and page == runs[-1][-1] + 1 and len(runs[-1]) < max(chunk_size, 1):
+            runs[-1].append(page)
+        else:
+            runs.append([page])
+    return runs
+
 def extract_text_from_docx(file_path: str) -> str:
+    """Paragraphs and tables of the document body, in document order."""
     try:
+        import docx
+        
         doc = docx.Document(file_path)
-        return "\n".join([paragraph.text for paragraph in doc.paragraphs])
+        return "\n".join(_docx_block_lines(doc.element.body, doc))
     except Exception as e:
         return f"Error extracting text from DOCX: {str(e)}"
 
+def _docx_block_lines(element, parent) -> List[str]:
+    """Text lines of the paragraphs and tables directly inside a body or table cell."""
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
+    
+    lines = []
+    for child in element.iterchildren():
+        tag = child.tag.rsplit('}', 1)[-1]
+        if tag == 'p':
+            lines.append(Paragraph(child, parent).text)
+        elif tag == 'tbl':
+            lines.extend(_docx_table_lines(Table(child, parent)))
+    return lines
+
+def _docx_table_lines(table: "Table") -> List[str]:
+    """One line per table row, cells separated by " | " (merged cells once)."""
+    lines = []
+    for row in table.rows:
+        cells, seen = [], set()
+        for cell in row.cells:
+            if id(cell._tc) in seen:
+                continue
+            seen.add(id(cell._tc))
+            cells.append(" ".join(line.strip() for line in _docx_block_lines(cell._tc, cell) if line.strip()))
+        while cells and not cells[-1]:
+            cells.pop()
+        if cells:
+            lines.append(" | ".join(cells))
+    return lines
+
 def extract_text_from_image(file_path: str) -> str:
     try:
-        image = Image.open(file_path)
-        return pytesseract.image_to_string(image)
+        import pytesseract
+        from PIL import Image
+        
+        with Image.open(file_path) as image:
+            return pytesseract.image_to_string(image, config=ocr_config())
     except Exception as e:
         return f"Error extracting text from image: {str(e)}"
 
 def extract_text_from_xlsx(file_path: str) -> str:
+    """Stream the workbook row by row (read-only mode) up to XLSX_MAX_ROWS / XLSX_MAX_CELLS.
+
+    Empty rows and trailing empty cells are skipped. When a cap is reached a
+    TRUNCATION_MARKER line is appended and the remaining rows are not read.
+    """
+    try:
+        import openpyxl
+        
+        workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    except Exception as e:
+        return f"Error extracting text from XLSX: {str(e)}"
+    
     try:
-        workbook = openpyxl.load_workbook(file_path, data_only=True)
         text_content = []
+        rows, cells = 0, 0
         
-        for sheet_name in workbook.sheetnames:
-            sheet = workbook[sheet_name]
-            sheet_text = [f"Sheet: {sheet_name}"]
+        for sheet in workbook.worksheets:
+            sheet_text = [f"Sheet: {sheet.title}"]
+            text_content.append(sheet_text)
             
             for row in sheet.iter_rows(values_only=True):
                 row_text = [str(cell) if cell is not None else "" for cell in row]
+                while row_text and not row_text[-1]:
+                    row_text.pop()
+                if not row_text:
+                    continue
+                
+                if rows >= XLSX_MAX_ROWS or cells + len(row_text) > XLSX_MAX_CELLS:
+                    sheet_text.append(
+                        f"{TRUNCATION_MARKER}: limit of {XLSX_MAX_ROWS} rows / {XLSX_MAX_CELLS} cells reached "
+                        f"in sheet {sheet.title}; the remaining rows were not extracted]"
+                    )
+                    return "\n\n".join("\n".join(lines) for lines in text_content)
+                
+                rows += 1
+                cells += len(row_text)
                 sheet_text.append(",".join(row_text))
-            
-            text_content.append("\n".join(sheet_text))
         
-        return "\n\n".join(text_content)
+        return "\n\n".join("\n".join(lines) for lines in text_content)
     except Exception as e:
-        return f"Error extracting text from XLSX: {str(e)}"
\ No newline at end of file
+        return f"Error extracting text from XLSX: {str(e)}"
+    finally:
+        workbook.close()
\ No newline at end of file
@@ -0,0 +1,101 @@
+import os
+import asyncio
+import contextvars
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+from app.metrics import collect_spans, replay_spans
+
+# CPU-bound stages (document parsing, anonymization, tokenization) run on this pool.
+# "process" sidesteps the GIL; "thread" avoids pickling arguments and results.
+CPU_EXECUTOR = os.getenv("CPU_EXECUTOR", "thread").lower()
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", str(os.cpu_count() or 1)))
+# Work that mostly waits (spooling uploads, PDF extraction driving the OCR
+# process pool, anything reporting progress through callbacks) uses threads
+BLOCKING_WORKERS = int(os.getenv("BLOCKING_WORKERS", "16"))
+
+T = TypeVar("T")
+
+class StageExecutor:
+    """Lazily created thread or process pool that reports its queue depth.
+
+    Functions sent to a process pool must be picklable (module-level functions
+    or functools.partial of them, with picklable arguments). The metrics spans
+    they record are sent back with the result and replayed in the caller.
+    """
+
+    def __init__(self, name: str, kind: str, workers: int):
+        self.name = name
+        self.kind = kind if kind in ("thread", "process") else "thread"
+        self.workers = max(workers, 1)
+        self.in_flight = 0
+        self.completed = 0
+        self._executor: Optional[Executor] = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+        return self._executor
+
+    async def run(self, func: Callable[..., T], *args) -> T:
+        """Run func(*args) on the pool without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        # Only touched from the event loop thread, so no lock is needed
+        self.in_flight += 1
+        if self.kind == "thread":
+            # Carry the request context (e.g. metrics spans) into the worker thread
+            func, args = contextvars.copy_context().run, (func, *args)
+        else:
+            # A worker process has no request context: its spans come back with the result
+            func, args = _run_with_spans, (func, *args)
+        try:
+            result = await loop.run_in_executor(self._get_executor(), func, *args)
+            if self.kind == "process":
+                result, spans = result
+                replay_spans(spans)
+            return result
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+
+    @property
+    def depth(self) -> int:
+        """Calls waiting for a free worker."""
+        return max(self.in_flight - self.workers, 0)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "running": min(self.in_flight, self.workers),
+            "queue_depth": self.depth,
+            "completed": self.completed,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+def _run_with_spans(func: Callable[..., T], *args) -> Tuple[T, List[Tuple[str, float]]]:
+    with collect_spans() as spans:
+        result = func(*args)
+    return result, spans
+
+cpu_executor = StageExecutor("cpu", CPU_EXECUTOR, CPU_WORKERS)
+blocking_executor = StageExecutor("blocking", "thread", BLOCKING_WORKERS)
+
+async def run_cpu(func: Callable[..., T], *args) -> T:
+    return await cpu_executor.run(func, *args)
+
+async def run_blocking(func: Callable[..., T], *args) -> T:
+    return await blocking_executor.run(func, *args)
+
+def executor_stats() -> Dict[str, dict]:
+    return {"cpu": cpu_executor.stats(), "blocking": blocking_executor.stats()}
+
+def shutdown_executors():
+    cpu_executor.shutdown()
+    blocking_executor.shutdown()
@@ -0,0 +1,405 @@
+import os
+import asyncio
+import json
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from functools import partial
+from typing import Awaitable, Callable, Dict, List, Optional
+from fastapi import UploadFile
+from app.cache import CACHE_DIR
+from app.executor import run_blocking
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Maximum number of queued (not yet running) jobs before new ones are rejected
+JOB_QUEUE_MAX = int(os.getenv("JOB_QUEUE_MAX", "100"))
+# Job uploads; must be a shared volume when replicas on several hosts share the job store
+JOBS_DIR = os.getenv("JOBS_DIR", os.path.join(CACHE_DIR, "jobs"))
+# A running job whose worker has not reported for this long is queued again
+JOB_LEASE_S = float(os.getenv("JOB_LEASE_S", "30"))
+# How often idle workers look for jobs submitted through other processes
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+
+# handler(files, text_input, model, analysis_type, use_cache, cascade) -> result dict;
+# a result with an "error" fails the job. cascade None: the handler's default
+JobHandler = Callable[[List[UploadFile], Optional[str], str, str, bool, Optional[bool]], Awaitable[dict]]
+
+class QueueFullError(Exception):
+    pass
+
+class JobStore:
+    """SQLite-backed job records, so queued and finished jobs survive restarts.
+
+    The database file can be shared by several worker processes; jobs are
+    handed out with claim_next, which is atomic across processes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # Connected lazily, and again after a fork: connections must not cross processes
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT NOT NULL, model TEXT NOT NULL, "
+                "analysis_type TEXT NOT NULL, text_input TEXT, files TEXT NOT NULL, "
+                "result TEXT, error TEXT, timings TEXT, created_at REAL NOT NULL, "
+                "started_at REAL, finished_at REAL, use_cache INTEGER NOT NULL DEFAULT 1, "
+                "owner TEXT, heartbeat_at REAL, cascade INTEGER)"
+            )
+            # Workers starting together would otherwise all add the missing columns
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+                for column, definition in (("use_cache", "INTEGER NOT NULL DEFAULT 1"), ("owner", "TEXT"), ("heartbeat_at", "REAL"), ("cascade", "INTEGER")):
+                    if column not in columns:
+                        conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, created_at)")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def create(self, job_id: str, model: str, analysis_type: str, text_input: Optional[str], files: List[dict], use_cache: bool = True, cascade: Optional[bool] = None):
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO jobs (id, status, model, analysis_type, text_input, files, use_cache, cascade, created_at) "
+                "VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, model, analysis_type, text_input, json.dumps(files), int(use_cache), None if cascade is None else int(cascade), time.time()),
+            )
+
+    def update(self, job_id: str, **fields):
+        for key in ("result", "timings"):
+            if key in fields and fields[key] is not None:
+                fields[key] = json.dumps(fields[key], ensure_ascii=False)
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self._lock:
+            self.conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        job = dict(row)
+        job["files"] = json.loads(job["files"])
+        for key in ("result", "timings"):
+            job[key] = json.loads(job[key]) if job[key] else None
+        return job
+
+    def claim_next(self, owner: str) -> Optional[str]:
+        """Mark the oldest queued job as running for owner and return its ID."""
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE takes the write lock up front, so two processes cannot claim the same job
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1").fetchone()
+                if row is not None:
+                    self.conn.execute(
+                        "UPDATE jobs SET status = 'running', owner = ?, started_at = ?, heartbeat_at = ? WHERE id = ?",
+                        (owner, now, now, row[0]),
+                    )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return row[0] if row is not None else None
+
+    def heartbeat(self, job_ids: List[str]):
+        with self._lock:
+            self.conn.executemany("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", [(time.time(), job_id) for job_id in job_ids])
+
+    def requeue(self, job_id: str):
+        self.update(job_id, status="queued", owner=None, started_at=None, heartbeat_at=None)
+
+    def requeue_stale(self, lease_s: float) -> int:
+        """Queue running jobs whose worker stopped reporting again; returns how many."""
+        with self._lock:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET status = 'queued', owner = NULL, started_at = NULL, heartbeat_at = NULL "
+                "WHERE status = 'running' AND COALESCE(heartbeat_at, 0) < ?",
+                (time.time() - lease_s,),
+            )
+        return cursor.rowcount
+
+    def count_queued(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+    def count_by_status(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+# Hash fields hold JSON-encoded values, so the scripts write '"running"' rather than 'running'
+# Moves the oldest queued job to running; KEYS: queued zset, running zset; ARGV: prefix, JSON owner, now
+_REDIS_CLAIM_SCRIPT = """
+local ids = redis.call('ZRANGE', KEYS[1], 0, 0)
+if #ids == 0 then return false end
+local id = ids[1]
+redis.call('ZREM', KEYS[1], id)
+redis.call('ZADD', KEYS[2], ARGV[3], id)
+redis.call('HSET', ARGV[1] .. id, 'status', '"running"', 'owner', ARGV[2], 'started_at', ARGV[3], 'heartbeat_at', ARGV[3])
+return id
+"""
+
+# Requeues running jobs with an old heartbeat; KEYS: queued zset, running zset; ARGV: prefix, cutoff
+_REDIS_REQUEUE_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[2])
+for _, id in ipairs(ids) do
+    redis.call('ZREM', KEYS[2], id)
+    local created = redis.call('HGET', ARGV[1] .. id, 'created_at')
+    if created then
+        redis.call('ZADD', KEYS[1], created, id)
+        redis.call('HSET', ARGV[1] .. id, 'status', '"queued"')
+        redis.call('HDEL', ARGV[1] .. id, 'owner', 'started_at', 'heartbeat_at')
+    end
+end
+return #ids
+"""
+
+class RedisJobStore:
+    """JobStore with the same interface in a Redis-compatible server, for replicas on several hosts.
+
+    Each job is a hash of JSON-encoded fields; sorted sets index the queued
+    jobs (by creation time) and the running ones (by last heartbeat).
+    """
+
+    FIELDS = ("id", "status", "model", "analysis_type", "text_input", "files", "result", "error", "timings",
+              "created_at", "started_at", "finished_at", "use_cache", "owner", "heartbeat_at", "cascade")
+
+    def __init__(self, client, prefix: str):
+        self.client = client
+        self.prefix = f"{prefix}:jobs:"
+        self.queued_key = f"{prefix}:jobs-queued"
+        self.running_key = f"{prefix}:jobs-running"
+        self._claim = client.register_script(_REDIS_CLAIM_SCRIPT)
+        self._requeue_stale = client.register_script(_REDIS_REQUEUE_SCRIPT)
+
+    def create(self, job_id: str, model: str, analysis_type: str, text_input: Optional[str], files: List[dict], use_cache: bool = True, cascade: Optional[bool] = None):
+        now = time.time()
+        job = {"id": job_id, "status": "queued", "model": model, "analysis_type": analysis_type, "text_input": text_input,
+               "files": files, "use_cache": int(use_cache), "cascade": None if cascade is None else int(cascade), "created_at": now}
+        pipeline = self.client.pipeline()
+        pipeline.hset(self.prefix + job_id, mapping={key: json.dumps(value, ensure_ascii=False) for key, value in job.items()})
+        pipeline.zadd(self.queued_key, {job_id: now})
+        pipeline.execute()
+
+    def update(self, job_id: str, **fields):
+        pipeline = self.client.pipeline()
+        pipeline.hset(self.prefix + job_id, mapping={key: json.dumps(value, ensure_ascii=False) for key, value in fields.items()})
+        status = fields.get("status")
+        if status is not None:
+            pipeline.zrem(self.running_key, job_id)
+            pipeline.zrem(self.queued_key, job_id)
+            if status == "queued":
+                created_at = self.client.hget(self.prefix + job_id, "created_at")
+                pipeline.zadd(self.queued_key, {job_id: json.loads(created_at) if created_at else time.time()})
+            elif status == "running":
+                pipeline.zadd(self.running_key, {job_id: time.time()})
+        pipeline.execute()
+
+    def get(self, job_id: str) -> Optional[dict]:
+        raw = self.client.hgetall(self.prefix + job_id)
+        if not raw:
+            return None
+        values = {key.decode(): json.loads(value) for key, value in raw.items()}
+        return {key: values.get(key) for key in self.FIELDS}
+
+    def claim_next(self, owner: str) -> Optional[str]:
+        job_id = self._claim(keys=[self.queued_key, self.running_key], args=[self.prefix, json.dumps(owner), repr(time.time())])
+        return job_id.decode() if job_id is not None else None
+
+    def heartbeat(self, job_ids: List[str]):
+        if not job_ids:
+            return
+        now = time.time()
+        pipeline = self.client.pipeline()
+        for job_id in job_ids:
+            pipeline.zadd(self.running_key, {job_id: now}, xx=True)
+            pipeline.hset(self.prefix + job_id, "heartbeat_at", json.dumps(now))
+        pipeline.execute()
+
+    def requeue(self, job_id: str):
+        self.update(job_id, status="queued", owner=None, started_at=None, heartbeat_at=None)
+
+    def requeue_stale(self, lease_s: float) -> int:
+        return int(self._requeue_stale(keys=[self.queued_key, self.running_key], args=[self.prefix, time.time() - lease_s]))
+
+    def count_queued(self) -> int:
+        return self.client.zcard(self.queued_key)
+
+    def count_by_status(self) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for key in self.client.scan_iter(match=self.prefix + "*", count=1000):
+            status = self.client.hget(key, "status")
+            if status is not None:
+                status = json.loads(status)
+                counts[status] = counts.get(status, 0) + 1
+        return counts
+
+def _store_files(job_dir: str, files: List[UploadFile]) -> List[dict]:
+    """Copy the uploads into the job directory, where any worker process can read them."""
+    os.makedirs(job_dir, exist_ok=True)
+    stored_files = []
+    for index, file in enumerate(files):
+        path = os.path.join(job_dir, f"{index}{os.path.splitext(file.filename)[1].lower()}")
+        with open(path, "wb") as output:
+            shutil.copyfileobj(file.file, output)
+        stored_files.append({"filename": file.filename, "path": path})
+    return stored_files
+
+def _open_files(items: List[dict]) -> List[UploadFile]:
+    return [UploadFile(filename=item["filename"], file=open(item["path"], "rb")) for item in items]
+
+class JobQueue:
+    """Bounded pool of job workers in this process, fed from a shared JobStore.
+
+    Every process polls the same store, so a job submitted to one worker
+    process (or replica) may run in another. Running jobs send heartbeats;
+    jobs of a worker that died are queued again after JOB_LEASE_S.
+    """
+
+    def __init__(self, store, handler: JobHandler, workers: int = JOB_WORKERS, max_queued: int = JOB_QUEUE_MAX):
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self.max_queued = max_queued
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._stopping = False
+        self.running = 0
+
+    async def start(self):
+        # Set here rather than in __init__: the queue may be created before a fork
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        await run_blocking(self.store.requeue_stale, JOB_LEASE_S)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(max(self.workers, 1))]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+
+    async def stop(self, timeout: float = 0):
+        """Stop taking jobs, give running ones up to timeout seconds, then queue them again."""
+        self._stopping = True
+        if self._wakeup is not None:
+            self._wakeup.set()
+        running = list(self._running.values())
+        if running and timeout > 0:
+            await asyncio.wait(running, timeout=timeout)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    @property
+    def depth(self) -> int:
+        return self.store.count_queued()
+
+    async def submit(self, files: List[UploadFile], text_input: Optional[str], model: str, analysis_type: str, use_cache: bool = True, cascade: Optional[bool] = None) -> str:
+        depth = await run_blocking(self.store.count_queued)
+        if depth >= self.max_queued:
+            raise QueueFullError(f"Job queue is full ({depth} jobs waiting). Please retry later.")
+
+        job_id = uuid.uuid4().hex
+        stored_files = await run_blocking(_store_files, os.path.join(JOBS_DIR, job_id), files)
+        await run_blocking(self.store.create, job_id, model, analysis_type, text_input, stored_files, use_cache, cascade)
+        self._wakeup.set()
+        return job_id
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await run_blocking(self.store.get, job_id)
+
+    async def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "queue_depth": await run_blocking(self.store.count_queued),
+            "max_queued": self.max_queued,
+            "jobs": await run_blocking(self.store.count_by_status),
+        }
+
+    async def _worker(self):
+        while not self._stopping:
+            job_id = await run_blocking(self.store.claim_next, self.owner)
+            if job_id is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            task = asyncio.create_task(self._run(job_id))
+            self._running[job_id] = task
+            try:
+                # Shielded so stop() can let the job finish while this worker is cancelled
+                await asyncio.shield(task)
+            except asyncio.CancelledError:
+                if not task.done():
+                    task.cancel()
+                    await asyncio.gather(task, return_exceptions=True)
+                raise
+            finally:
+                self._running.pop(job_id, None)
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(JOB_LEASE_S / 3)
+            # A transient store error must not end the heartbeats: the leases of
+            # the running jobs would expire and other workers would run them again
+            try:
+                await run_blocking(self.store.heartbeat, list(self._running))
+                await run_blocking(self.store.requeue_stale, JOB_LEASE_S)
+            except Exception as e:
+                print(f"Error in job heartbeat: {str(e)}")
+
+    async def _run(self, job_id: str):
+        job = await run_blocking(self.store.get, job_id)
+        if job is None:
+            return
+
+        started_at = job["started_at"] or time.time()
+        self.running += 1
+        files = await run_blocking(_open_files, job["files"])
+
+        try:
+            cascade = None if job.get("cascade") is None else bool(job["cascade"])
+            result = await self.handler(files, job["text_input"], job["model"], job["analysis_type"], bool(job["use_cache"]), cascade)
+            timings = {"queued_s": started_at - job["created_at"], **result.pop("timings", {})}
+            # A handler reporting an error (e.g. the LLM failed) fails the job but keeps its result
+            status, error = ("failed", result["error"]) if result.get("error") else ("completed", None)
+            await run_blocking(partial(self.store.update, job_id, status=status, result=result, error=error, timings=timings, finished_at=time.time()))
+        except asyncio.CancelledError:
+            # Interrupted by shutdown: another worker (or the next start) runs it again.
+            # Shielded so a second cancellation cannot drop the requeue
+            await asyncio.shield(run_blocking(self.store.requeue, job_id))
+            raise
+        except Exception as e:
+            timings = {"queued_s": started_at - job["created_at"], "total_s": time.time() - started_at}
+            await run_blocking(partial(self.store.update, job_id, status="failed", error=str(e), timings=timings, finished_at=time.time()))
+        finally:
+            self.running -= 1
+            for file in files:
+                file.file.close()
+
+        # Only reached when the job finished; a cancelled job keeps its files for the next run
+        await run_blocking(partial(shutil.rmtree, os.path.join(JOBS_DIR, job_id), ignore_errors=True))
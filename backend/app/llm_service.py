@@ -1,76 +1,765 @@
 import os
-from typing import List
-import requests
+import asyncio
+import random
+import hashlib
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import AsyncIterator, Dict, List, Optional
 from dotenv import load_dotenv
 import aiohttp
 import json
-import tiktoken
-from app.prompt import create_prompt
+from app.cache import Cache
+from app.executor import run_blocking, run_cpu
+from app.metrics import ERRORS, LLM_COMPLETIONS, LLM_REQUEST_DURATION, estimate_cost, observe_stage, record_llm_usage, span
+from app.chunking import merge_chunk_responses, split_numbered_text
+from app.prompt import ANALYSIS_TYPES, ParameterSpec, PromptParts, PromptShard, is_sharded, number_lines, prompt_registry, render_prompt
+from app.relevance import RELEVANCE_ENABLED, RELEVANCE_MIN_TOKENS, Selection, full_text, select_lines
+from app.rules import RULES_ENABLED, extract_rules
+from app.state import get_state, open_cache
+from app.response_parser import ResponseRow, format_response_rows, parse_response_rows
+from app.tokens import (
+    TokenBudget, TokenCountCache, context_length, count_tokens, document_counts, effective_encoding,
+    encoding_name, prompt_budget, static_counts
+)
+from app.validation import ValidatedRecord, validate_rows
 
 load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 LOCAL_LLM_URL = os.getenv("LOCAL_LLM_URL")
-MAX_CONTEXT_LENGTH = 128000
+CHUNKED_EXTRACTION_ENABLED = os.getenv("CHUNKED_EXTRACTION_ENABLED", "true").lower() == "true"
+# Windows smaller than this are not worth sending
+MIN_CHUNK_TOKENS = 1000
 USE_LOCAL_LLM = False if OPENAI_API_KEY else True
 DEFAULT_MODEL = "gpt-4o-mini"
 
-def fetch_available_models():
-    if not OPENAI_API_KEY:
-        return ["gpt-4o-mini"]
+OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
+OPENAI_MODELS_URL = "https://api.openai.com/v1/models"
+SYSTEM_MESSAGE = "You are a medical parameter extraction assistant that analyzes medical documents and extracts specified parameters."
+
+# Shared HTTP client settings
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "32"))
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "300"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1.0"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "30.0"))
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Provider requests per minute across all workers and replicas sharing the
+# state backend (see app.state); 0 disables. Burst defaults to 1/10 of a minute.
+LLM_RATE_LIMIT_RPM = float(os.getenv("LLM_RATE_LIMIT_RPM", "0"))
+LLM_RATE_LIMIT_BURST = float(os.getenv("LLM_RATE_LIMIT_BURST", "0")) or max(1.0, LLM_RATE_LIMIT_RPM / 10)
+# Deterministic sampling makes cached completions equivalent to fresh ones
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0"))
+
+# Model discovery runs in the background; until it finishes only DEFAULT_MODEL is offered
+MODELS_REFRESH_TTL = float(os.getenv("MODELS_REFRESH_TTL", "3600"))
+MODELS_FETCH_TIMEOUT = float(os.getenv("MODELS_FETCH_TIMEOUT", "5"))
+SUPPORTED_MODEL_PREFIXES = ("gpt-4", "gpt-3.5")
+
+# Completion cache
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_MAX_MB = int(os.getenv("LLM_CACHE_MAX_MB", "256"))
+LLM_CACHE_TTL_HOURS = float(os.getenv("LLM_CACHE_TTL_HOURS", "168"))
+# Bump to invalidate cached completions after changing how prompts are answered
+LLM_CACHE_VERSION = "1"
+
+# Structured (JSON schema) output for providers that support it; the rows are
+# converted back to CSV so the rest of the pipeline sees the same format
+STRUCTURED_OUTPUT_ENABLED = os.getenv("STRUCTURED_OUTPUT_ENABLED", "true").lower() == "true"
+STRUCTURED_OUTPUT_MODELS = ("gpt-4o", "gpt-4.1")
+LOCAL_LLM_STRUCTURED_OUTPUT = os.getenv("LOCAL_LLM_STRUCTURED_OUTPUT", "false").lower() == "true"
+# How many times parameters that fail validation are asked for again
+VALIDATION_RETRIES = int(os.getenv("VALIDATION_RETRIES", "1"))
+
+# Model cascade: the request's model extracts every parameter, then the ones
+# left empty, invalid or without a line reference are asked again, with only
+# their evidence lines, to CASCADE_MODEL. Replaces the validation retries.
+CASCADE_ENABLED = os.getenv("CASCADE_ENABLED", "false").lower() == "true"
+CASCADE_MODEL = os.getenv("CASCADE_MODEL", "gpt-4o")
+# Empty answers are often right ("not in the document"); set false to escalate only invalid ones
+CASCADE_ESCALATE_EMPTY = os.getenv("CASCADE_ESCALATE_EMPTY", "true").lower() == "true"
+
+RESPONSE_JSON_SCHEMA = {
+    "name": "extracted_parameters",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "rows": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "parameter": {"type": "string"},
+                        "value": {"type": "string"},
+                        "line_reference": {"type": "string"}
+                    },
+                    "required": ["parameter", "value", "line_reference"],
+                    "additionalProperties": False
+                }
+            }
+        },
+        "required": ["rows"],
+        "additionalProperties": False
+    }
+}
+STRUCTURED_OUTPUT_INSTRUCTION = (
+    "\n\nReturn the rows as JSON following the provided schema instead of CSV lines: "
+    "one object per parameter with its name, the extracted value and the line reference."
+)
+
+_session: Optional[aiohttp.ClientSession] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+_llm_cache: Optional[Cache] = None
+_models: List[str] = [DEFAULT_MODEL]
+_models_fetched_at: Optional[float] = None
+_models_refresh: Optional[asyncio.Task] = None
+# Provider calls in progress, so shutdown can wait for them
+_in_flight = 0
+_idle: Optional[asyncio.Event] = None
+
+def get_session() -> aiohttp.ClientSession:
+    """Return the shared, long-lived HTTP session used for all LLM calls."""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=LLM_MAX_CONNECTIONS, keepalive_timeout=60)
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=LLM_REQUEST_TIMEOUT),
+        )
+    return _session
+
+def get_semaphore() -> asyncio.Semaphore:
+    """Return the semaphore limiting in-flight LLM requests."""
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return _semaphore
+
+async def close_session():
+    """Close the shared HTTP session (called on application shutdown)."""
+    global _session
+    if _models_refresh is not None and not _models_refresh.done():
+        _models_refresh.cancel()
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+async def fetch_available_models() -> List[str]:
+    """List the provider's models: chat models from OpenAI, everything from a local server."""
+    if USE_LOCAL_LLM:
+        if not LOCAL_LLM_URL:
+            return [DEFAULT_MODEL]
+        url, headers = f"{LOCAL_LLM_URL}/models", {}
+    else:
+        url, headers = OPENAI_MODELS_URL, {"Authorization": f"Bearer {OPENAI_API_KEY}"}
+    
+    timeout = aiohttp.ClientTimeout(total=MODELS_FETCH_TIMEOUT)
+    async with get_session().get(url, headers=headers, timeout=timeout) as response:
+        response.raise_for_status()
+        data = await response.json(content_type=None)
+    
+    models = [model["id"] for model in data.get("data", []) if "id" in model]
+    if not USE_LOCAL_LLM:
+        models = [model for model in models if model.startswith(SUPPORTED_MODEL_PREFIXES)]
+    return sorted(models) or [DEFAULT_MODEL]
+
+def _models_state_key() -> str:
+    return "models:" + ((LOCAL_LLM_URL or "") if USE_LOCAL_LLM else OPENAI_MODELS_URL)
+
+async def refresh_available_models():
+    """Re-fetch the model list, keeping the previous one if the provider is unreachable.
     
+    A list fetched by another worker or replica within MODELS_REFRESH_TTL is
+    taken from the shared state instead.
+    """
+    global _models, _models_fetched_at
     try:
-        url = "https://api.openai.com/v1/models"
-        headers = {"Authorization": f"Bearer {OPENAI_API_KEY}"}
-        response = requests.get(url, headers=headers)
-        
-        if response.status_code == 200:
-            all_models = response.json()["data"]
-            supported_prefixes = ["gpt-4", "gpt-3.5"]
-            models = [model["id"] for model in all_models 
-                     if any(model["id"].startswith(prefix) for prefix in supported_prefixes)]
-            
-            models.sort()
-            return models or ["gpt-4o-mini"]
-        else:
-            return ["gpt-4o-mini"]
+        with span("model_discovery"):
+            shared = await run_blocking(get_state().get_value, _models_state_key())
+            if shared and time.time() - shared["fetched_at"] < MODELS_REFRESH_TTL:
+                _models = shared["models"]
+            else:
+                _models = await fetch_available_models()
+                await run_blocking(get_state().set_value, _models_state_key(), {"models": _models, "fetched_at": time.time()}, MODELS_REFRESH_TTL)
     except Exception as e:
-        print(f"Error fetching models from OpenAI: {str(e)}")
-        return ["gpt-4o-mini"]
+        ERRORS.inc(stage="model_discovery")
+        print(f"Error fetching available models: {type(e).__name__}: {e}")
+    # Failures are retried after the TTL too, instead of on every request
+    _models_fetched_at = time.monotonic()
+
+def models_stale() -> bool:
+    return _models_fetched_at is None or time.monotonic() - _models_fetched_at > MODELS_REFRESH_TTL
+
+def start_model_refresh() -> asyncio.Task:
+    """Start a background refresh unless one is already running."""
+    global _models_refresh
+    if _models_refresh is None or _models_refresh.done():
+        _models_refresh = asyncio.create_task(refresh_available_models())
+    return _models_refresh
+
+async def get_available_models() -> List[str]:
+    """Return the cached model list, refreshing it in the background once it is stale.
+    
+    Only the very first call waits, for at most MODELS_FETCH_TIMEOUT.
+    """
+    if _models_fetched_at is None:
+        await asyncio.shield(start_model_refresh())
+    elif models_stale():
+        start_model_refresh()
+    return _models
+
+def get_default_model(models: List[str]) -> str:
+    """DEFAULT_MODEL, or the first model a local server offers if it does not serve that one."""
+    return DEFAULT_MODEL if DEFAULT_MODEL in models else models[0]
+
+async def resolve_model(model: Optional[str]) -> str:
+    """Return the requested model if the provider offers it, otherwise the default."""
+    models = await get_available_models()
+    return model if model in models else get_default_model(models)
+
+def get_llm_cache() -> Optional[Cache]:
+    """Return the shared completion cache (see app.state), or None if it is disabled."""
+    global _llm_cache
+    if LLM_CACHE_ENABLED and _llm_cache is None:
+        _llm_cache = open_cache("llm", LLM_CACHE_MAX_MB * 1024 * 1024, ttl=LLM_CACHE_TTL_HOURS * 3600)
+    return _llm_cache
 
-AVAILABLE_MODELS = fetch_available_models()
+def llm_cache_key(prompt: str, model: str, structured: bool = False) -> str:
+    """Key a completion by everything that is sent to the provider."""
+    provider = (LOCAL_LLM_URL or "") if USE_LOCAL_LLM else OPENAI_CHAT_URL
+    parts = [LLM_CACHE_VERSION, provider, model, str(LLM_TEMPERATURE), SYSTEM_MESSAGE, prompt, "json" if structured else "csv"]
+    return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()
 
-def check_token_limit(prompt: str, model: str) -> bool:
+def _backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Full-jitter exponential backoff, honouring a Retry-After header if present."""
+    if retry_after:
+        try:
+            return min(float(retry_after), LLM_BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * (2 ** attempt)))
+
+async def acquire_rate_limit():
+    """Wait for a token of the global provider rate limit (LLM_RATE_LIMIT_RPM)."""
+    if LLM_RATE_LIMIT_RPM <= 0:
+        return
+    started = time.perf_counter()
+    while True:
+        wait = await run_blocking(get_state().take_token, "llm_requests", LLM_RATE_LIMIT_RPM / 60, LLM_RATE_LIMIT_BURST)
+        if wait <= 0:
+            break
+        await asyncio.sleep(wait)
+    if time.perf_counter() - started > 0.001:
+        observe_stage("llm_rate_limit_wait", time.perf_counter() - started)
+
+@asynccontextmanager
+async def track_llm_call():
+    """Count a provider call as in flight until the block exits (see drain_llm_calls)."""
+    global _in_flight, _idle
+    if _idle is None:
+        _idle = asyncio.Event()
+    _in_flight += 1
+    _idle.clear()
     try:
-        if "gpt-4" in model:
-            encoding = tiktoken.encoding_for_model("gpt-4")
-        elif "gpt-3.5" in model:
-            encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
-        else:
-            encoding = tiktoken.get_encoding("cl100k_base")
-            
-        token_count = len(encoding.encode(prompt))
-        available_tokens = MAX_CONTEXT_LENGTH * 0.75
+        yield
+    finally:
+        _in_flight -= 1
+        if _in_flight == 0:
+            _idle.set()
+
+async def drain_llm_calls(timeout: float) -> int:
+    """Wait up to timeout seconds for in-flight provider calls; returns how many are left."""
+    if _in_flight and _idle is not None:
+        try:
+            await asyncio.wait_for(_idle.wait(), timeout=max(timeout, 0))
+        except asyncio.TimeoutError:
+            pass
+    return _in_flight
+
+async def post_chat_completion(url: str, payload: dict, headers: dict) -> tuple:
+    """POST a chat completion through the pooled session with retry/backoff.
+
+    Every attempt takes a token of the global rate limit first. Returns a
+    (status, parsed_json) tuple of the last attempt.
+    """
+    async with track_llm_call():
+        return await _post_chat_completion(url, payload, headers)
+
+async def _post_chat_completion(url: str, payload: dict, headers: dict) -> tuple:
+    session = get_session()
+    
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        await acquire_rate_limit()
+        try:
+            async with get_semaphore():
+                started = time.perf_counter()
+                async with session.post(url, json=payload, headers=headers) as response:
+                    try:
+                        result = await response.json(content_type=None)
+                    except (json.JSONDecodeError, aiohttp.ContentTypeError):
+                        result = {"error": await response.text()}
+                    
+                    seconds = time.perf_counter() - started
+                    LLM_REQUEST_DURATION.observe(seconds, model=payload.get("model", ""), status=str(response.status))
+                    observe_stage("llm_request", seconds)
+                    
+                    if response.status not in RETRY_STATUS_CODES or attempt == LLM_MAX_RETRIES:
+                        return response.status, result
+                    
+                    retry_after = response.headers.get("Retry-After")
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if attempt == LLM_MAX_RETRIES:
+                raise
+            retry_after = None
         
-        return token_count <= available_tokens
-    except Exception:
-        estimated_tokens = len(prompt) // 4
-        return estimated_tokens <= (MAX_CONTEXT_LENGTH * 0.75)
+        await asyncio.sleep(_backoff_delay(attempt, retry_after))
+
+def model_encoding(model: str) -> str:
+    return encoding_name(model, USE_LOCAL_LLM)
+
+async def count_cached_tokens(text: str, model: str, cache: TokenCountCache) -> int:
+    """Token count of text, memoized in cache; misses are counted on the CPU executor."""
+    encoding = model_encoding(model)
+    count = cache.get(text, encoding)
+    if count is None:
+        count = await run_cpu(count_tokens, text, encoding)
+        cache.put(text, encoding, count)
+    return count
 
-async def get_llm_response(texts: List[str], model: str = DEFAULT_MODEL, analysis_type: str = "standard") -> str:
-    prompt = create_prompt(texts, analysis_type)
+async def measure_prompt(numbered_text: str, parts: PromptParts, model: str) -> TokenBudget:
+    """Token budget of parts.prefix + numbered_text + parts.suffix.
     
-    if not check_token_limit(prompt, model):
+    The static parts are counted once per prompt file version and the document
+    once per request, instead of encoding every assembled prompt.
+    """
+    with span("token_count"):
+        static_tokens = await count_cached_tokens(parts.prefix + parts.suffix, model, static_counts)
+        document_tokens = await count_cached_tokens(numbered_text, model, document_counts)
+    return TokenBudget(
+        model,
+        effective_encoding(model_encoding(model)),
+        context_length(model, USE_LOCAL_LLM),
+        prompt_budget(model, USE_LOCAL_LLM),
+        static_tokens,
+        document_tokens,
+    )
+
+async def warm_token_counts(model: str = DEFAULT_MODEL):
+    """Load the tokenizer and count the static prompt parts ahead of the first request."""
+    try:
+        for analysis_type in ANALYSIS_TYPES:
+            await section_tokens(analysis_type, model)
+            for shard in prompt_registry.shards(analysis_type) if is_sharded(analysis_type) else []:
+                await measure_prompt("", shard.parts, model)
+    except Exception as e:
+        print(f"Error precomputing prompt token counts: {str(e)}")
+
+async def section_tokens(analysis_type: str, model: str) -> Dict[str, int]:
+    """Static prompt tokens split into template, abbreviations, enums and parameters."""
+    data = prompt_registry.data(analysis_type)
+    sections = {name: await count_cached_tokens(data.get(name, ""), model, static_counts) for name in ("abbreviations", "enums", "parameters")}
+    parts = prompt_registry.prompt_parts(analysis_type)
+    total = await count_cached_tokens(parts.prefix + parts.suffix, model, static_counts)
+    return {"template": max(total - sum(sections.values()), 0), **sections}
+
+async def select_evidence(numbered_text: str, parameters: List[ParameterSpec], model: str, min_tokens: int = RELEVANCE_MIN_TOKENS) -> Selection:
+    """The lines of numbered_text relevant to parameters (see app.relevance).
+    
+    Documents shorter than min_tokens are sent whole.
+    """
+    if not RELEVANCE_ENABLED or await count_cached_tokens(numbered_text, model, document_counts) < min_tokens:
+        return full_text(numbered_text)
+    with span("relevance_select"):
+        return await run_cpu(select_lines, numbered_text, parameters, prompt_registry.abbreviations())
+
+def split_windows(numbered_text: str, window_tokens: int, encoding: str) -> List[str]:
+    """Split numbered text into windows of at most window_tokens.
+
+    Returns an empty list if window_tokens is below MIN_CHUNK_TOKENS.
+    """
+    with span("chunk_split"):
+        if window_tokens < MIN_CHUNK_TOKENS:
+            return []
+        return split_numbered_text(numbered_text, window_tokens, partial(count_tokens, encoding=encoding))
+
+async def apply_rules(numbered_text: str, analysis_type: str) -> Dict[int, ValidatedRecord]:
+    """Parameters resolved without the model (see app.rules), by parameter index.
+    
+    Only values that pass validation are kept; the rest go to the model.
+    """
+    if not RULES_ENABLED:
+        return {}
+    with span("rules"):
+        resolved = await run_cpu(extract_rules, numbered_text, analysis_type)
+    with span("parse_validate"):
+        records = validate_rows(list(resolved.values()), analysis_type, list(resolved))
+    return {index: record for index, record in zip(resolved, records) if record.valid}
+
+def pending_shards(analysis_type: str, indexes: Optional[List[int]] = None) -> List[PromptShard]:
+    """The prompts extracting the parameters at indexes (all of them if None).
+    
+    Sharded analysis types keep their shards, re-rendered when only some of a
+    shard's parameters are left and dropped when none are; other types get one
+    prompt listing just the wanted parameters.
+    """
+    if not is_sharded(analysis_type):
+        if indexes is None:
+            parameters = prompt_registry.parameters(analysis_type)
+            return [PromptShard(list(range(len(parameters))), parameters, prompt_registry.prompt_parts(analysis_type))]
+        return [prompt_registry.subset_shard(analysis_type, indexes)] if indexes else []
+    
+    shards = prompt_registry.shards(analysis_type)
+    if indexes is None:
+        return shards
+    wanted = set(indexes)
+    pending = []
+    for shard in shards:
+        kept = [index for index in shard.indexes if index in wanted]
+        if kept == shard.indexes:
+            pending.append(shard)
+        elif kept:
+            pending.append(prompt_registry.subset_shard(analysis_type, kept))
+    return pending
+
+async def get_llm_response(texts: List[str], model: str = DEFAULT_MODEL, analysis_type: str = "standard", use_cache: bool = True, indexes: Optional[List[int]] = None) -> str:
+    if is_sharded(analysis_type) or indexes is not None:
+        return await get_sharded_llm_response(texts, model, analysis_type, use_cache, indexes)
+    
+    parameters = prompt_registry.parameters(analysis_type)
+    parts = prompt_registry.prompt_parts(analysis_type)
+    document = (await select_evidence(number_lines(texts), parameters, model)).text
+    budget = await measure_prompt(document, parts, model)
+    
+    if not budget.fits:
+        if CHUNKED_EXTRACTION_ENABLED:
+            return await _get_chunked_completion(document, parts, parameters, model, use_cache)
         return "Error: Input text is too large for the model's context window. Please reduce the amount of text or try using fewer documents."
     
-    return await get_local_llm_response(prompt, model) if USE_LOCAL_LLM else get_openai_response(prompt, model)
+    with span("prompt_build"):
+        prompt = render_prompt(document, analysis_type)
+    return await get_completion(prompt, model, use_cache)
+
+def supports_structured_output(model: str) -> bool:
+    if not STRUCTURED_OUTPUT_ENABLED:
+        return False
+    if USE_LOCAL_LLM:
+        return LOCAL_LLM_STRUCTURED_OUTPUT
+    return model.startswith(STRUCTURED_OUTPUT_MODELS)
+
+def structured_to_csv(content: str) -> str:
+    """Convert a JSON schema response to PARAMETER,VALUE,LINE_REFERENCE lines.
+
+    Content that is not valid JSON is returned unchanged for the CSV parser.
+    """
+    try:
+        rows = json.loads(content)["rows"]
+        return format_response_rows([
+            ResponseRow(str(row["parameter"]), str(row.get("value", "")), str(row.get("line_reference", "0")))
+            for row in rows
+        ])
+    except (json.JSONDecodeError, KeyError, TypeError):
+        return content
+
+async def get_completion(prompt: str, model: str = DEFAULT_MODEL, use_cache: bool = True) -> str:
+    """Complete a prompt with the configured provider, going through the completion cache."""
+    structured = supports_structured_output(model)
+    cache = get_llm_cache() if use_cache else None
+    cache_key = llm_cache_key(prompt, model, structured) if cache else None
+    
+    if cache:
+        cached = await run_blocking(cache.get, cache_key)
+        if cached is not None:
+            LLM_COMPLETIONS.inc(model=model, source="cache")
+            return cached
+    
+    if USE_LOCAL_LLM:
+        response = await get_local_llm_response(prompt, model, structured)
+    else:
+        response = await get_openai_response(prompt, model, structured)
+    
+    if response.startswith("Error"):
+        LLM_COMPLETIONS.inc(model=model, source="error")
+        ERRORS.inc(stage="llm")
+    else:
+        LLM_COMPLETIONS.inc(model=model, source="provider")
+        if cache:
+            await run_blocking(cache.set, cache_key, response)
+    return response
+
+async def _get_chunked_completion(numbered_text: str, parts: PromptParts, parameters: List[ParameterSpec], model: str, use_cache: bool) -> str:
+    """Map-reduce extraction for text that does not fit the context window.
+
+    The numbered text is split on line boundaries into windows that fit next
+    to the static prompt, the windows are extracted concurrently and the
+    per-parameter results are merged (see chunking.pick_value).
+    """
+    budget = await measure_prompt(numbered_text, parts, model)
+    windows = await run_cpu(split_windows, numbered_text, budget.available_tokens, model_encoding(model))
+    if not windows:
+        return "Error: The model's context window is too small for the extraction prompt. Please choose a model with a larger context window."
+    
+    responses = await asyncio.gather(*[
+        get_completion(parts.prefix + window + parts.suffix, model, use_cache) for window in windows
+    ])
+    
+    errors = [response for response in responses if response.startswith("Error")]
+    if errors:
+        return errors[0]
+    
+    return format_response_rows(merge_chunk_responses(responses, parameters))
+
+async def _get_shard_response(numbered_text: str, shard: PromptShard, model: str, use_cache: bool, min_tokens: int = RELEVANCE_MIN_TOKENS) -> str:
+    document = (await select_evidence(numbered_text, shard.parameters, model, min_tokens)).text
+    budget = await measure_prompt(document, shard.parts, model)
+    if budget.fits:
+        return await get_completion(shard.parts.prefix + document + shard.parts.suffix, model, use_cache)
+    if CHUNKED_EXTRACTION_ENABLED:
+        return await _get_chunked_completion(document, shard.parts, shard.parameters, model, use_cache)
+    return "Error: Input text is too large for the model's context window. Please reduce the amount of text or try using fewer documents."
+
+async def get_sharded_llm_response(texts: List[str], model: str = DEFAULT_MODEL, analysis_type: str = "standard", use_cache: bool = True, indexes: Optional[List[int]] = None) -> str:
+    """Extract each parameter shard (see prompt.shard_parameters) concurrently.
+    
+    Shard prompts carry only their own parameter rows (and the enums only
+    when a shard needs them); the shard answers are merged back into one
+    response in parameter order. With indexes, only those parameters are
+    asked for (see pending_shards).
+    """
+    numbered_text = number_lines(texts)
+    shards = pending_shards(analysis_type, indexes)
+    responses = await asyncio.gather(*[_get_shard_response(numbered_text, shard, model, use_cache) for shard in shards])
+    
+    errors = [response for response in responses if response.startswith("Error")]
+    if errors:
+        return errors[0]
+    
+    rows: Dict[int, ResponseRow] = {}
+    for shard, response in zip(shards, responses):
+        for index, row in zip(shard.indexes, merge_chunk_responses([response], shard.parameters)):
+            rows[index] = row
+    return format_response_rows([rows[index] for index in sorted(rows)])
 
-def get_openai_response(prompt: str, model: str = DEFAULT_MODEL) -> str:
+def _retry_parts(analysis_type: str, failed: List[ValidatedRecord], indexes: List[int]) -> PromptParts:
+    """Prompt parts asking again for only the parameters that failed validation."""
+    parameters = prompt_registry.parameters(analysis_type)
+    parts = prompt_registry.subset_parts(analysis_type, [parameters[i] for i in indexes])
+    notes = "\n".join(
+        f"- {record.parameter}: {record.value!r} ({record.error})" if record.value else f"- {record.parameter}: ({record.error})"
+        for record in failed
+    )
+    return PromptParts(
+        parts.prefix,
+        parts.suffix
+        + "\n\nYour previous answer for these parameters could not be used:\n"
+        + notes
+        + "\nAnswer again for exactly these parameters, using the required value format and line references."
+    )
+
+async def token_budget_report(numbered_text: str, model: str, analysis_type: str, indexes: Optional[List[int]] = None) -> Dict:
+    """Token accounting of a request for the client: one entry per prompt (shard).
+    
+    Prompt entries count the lines selected for their parameters
+    ("relevance"); the top-level document_tokens is the whole document. With
+    indexes, only the prompts for those parameters are counted and
+    rules_resolved is the number of parameters left out (resolved by app.rules).
+    """
+    shards = pending_shards(analysis_type, indexes)
+    selections = [await select_evidence(numbered_text, shard.parameters, model) for shard in shards]
+    budgets = [await measure_prompt(selection.text, shard.parts, model) for shard, selection in zip(shards, selections)]
+    return {
+        "model": model,
+        "encoding": effective_encoding(model_encoding(model)),
+        "context_length": context_length(model, USE_LOCAL_LLM),
+        "prompt_budget": prompt_budget(model, USE_LOCAL_LLM),
+        "document_tokens": await count_cached_tokens(numbered_text, model, document_counts),
+        "sections": await section_tokens(analysis_type, model),
+        "prompts": [
+            {
+                **{key: value for key, value in budget.report().items() if key in ("static_tokens", "document_tokens", "prompt_tokens", "available_tokens", "fits")},
+                "relevance": selection.report(),
+            }
+            for budget, selection in zip(budgets, selections)
+        ],
+        "chunked": not all(budget.fits for budget in budgets),
+        "rules_resolved": len(prompt_registry.parameters(analysis_type)) - len(indexes) if indexes is not None else 0,
+    }
+
+def escalation_reason(record: ValidatedRecord) -> Optional[str]:
+    """Why a first-pass record is asked again to CASCADE_MODEL, or None if it is kept."""
+    if record.error == "missing from response":
+        return "missing"
+    if record.error == "missing line reference":
+        return "missing_reference"
+    if not record.valid:
+        return "invalid"
+    if record.normalized is None and CASCADE_ESCALATE_EMPTY:
+        return "empty"
+    return None
+
+async def escalate_records(
+    numbered_text: str,
+    analysis_type: str,
+    records: List[ValidatedRecord],
+    candidates: List[int],
+    model: str,
+    cascade_model: str,
+    first_pass_tokens: int,
+    use_cache: bool,
+) -> Dict:
+    """Ask cascade_model again for the uncertain records among candidates and merge its answers into records.
+    
+    The escalation prompts (one per shard with escalated parameters) carry
+    only the evidence lines of their parameters, whatever the document length.
+    Returns the run's stats: escalation rate and reasons, the prompt tokens
+    sent to cascade_model, and the tokens and prompt cost saved compared with
+    sending the first-pass prompts to cascade_model.
+    """
+    reasons = {index: escalation_reason(records[index]) for index in candidates}
+    indexes = [index for index, reason in reasons.items() if reason]
+    shards = pending_shards(analysis_type, indexes)
+    
+    escalation_tokens = 0
+    for shard in shards:
+        selection = await select_evidence(numbered_text, shard.parameters, cascade_model, 0)
+        escalation_tokens += (await measure_prompt(selection.text, shard.parts, cascade_model)).prompt_tokens
+    responses = await asyncio.gather(*[_get_shard_response(numbered_text, shard, cascade_model, use_cache, 0) for shard in shards])
+    
+    names = [spec.name for spec in prompt_registry.parameters(analysis_type)]
+    answered = errors = 0
+    for shard, response in zip(shards, responses):
+        if response.startswith("Error"):
+            errors += 1
+            continue
+        with span("parse_validate"):
+            escalated = validate_rows(parse_response_rows(response, names), analysis_type, shard.indexes)
+        for index, record in zip(shard.indexes, escalated):
+            # Same rule as the validation retries: keep the first answer unless this one is valid
+            if record.valid or records[index].error == "missing from response":
+                records[index] = record
+            answered += record.valid and record.normalized is not None
+    
+    strong_only_cost = estimate_cost(cascade_model, first_pass_tokens, 0, USE_LOCAL_LLM)
+    cascade_cost = estimate_cost(model, first_pass_tokens, 0, USE_LOCAL_LLM) + estimate_cost(cascade_model, escalation_tokens, 0, USE_LOCAL_LLM)
+    return {
+        "model": model,
+        "cascade_model": cascade_model,
+        # Parameters the first-pass model answered (the rules' ones are never escalated)
+        "parameters": len(candidates),
+        "escalated": len(indexes),
+        "escalation_rate": round(len(indexes) / len(candidates), 3) if candidates else 0.0,
+        "reasons": dict(Counter(reason for reason in reasons.values() if reason)),
+        "answered": answered,
+        "errors": errors,
+        "first_pass_prompt_tokens": first_pass_tokens,
+        "escalation_prompt_tokens": escalation_tokens,
+        "tokens_saved": first_pass_tokens - escalation_tokens,
+        "prompt_cost_saved_usd": round(strong_only_cost - cascade_cost, 6),
+    }
+
+def summarize_cascades(runs: List[Optional[Dict]]) -> Optional[Dict]:
+    """Corpus-level cascade stats from the per-document stats of escalate_records."""
+    runs = [run for run in runs if run]
+    if not runs:
+        return None
+    totals = {key: sum(run[key] for run in runs) for key in (
+        "parameters", "escalated", "answered", "errors", "first_pass_prompt_tokens", "escalation_prompt_tokens", "tokens_saved",
+    )}
+    reasons = Counter()
+    for run in runs:
+        reasons.update(run["reasons"])
+    return {
+        "documents": len(runs),
+        **totals,
+        "escalation_rate": round(totals["escalated"] / totals["parameters"], 3) if totals["parameters"] else 0.0,
+        "reasons": dict(reasons),
+        "prompt_cost_saved_usd": round(sum(run["prompt_cost_saved_usd"] for run in runs), 6),
+    }
+
+async def extract_parameters(texts: List[str], model: str = DEFAULT_MODEL, analysis_type: str = "standard", use_cache: bool = True, cascade: Optional[bool] = None) -> Dict:
+    """Extract parameters and validate them against the parameter schema.
+    
+    Parameters the rules (app.rules) resolve with a valid value are not sent
+    to the model; the prompt lists only the remaining ones. Parameters whose
+    value does not match their format (or that are missing) are asked for
+    again, up to VALIDATION_RETRIES times, with a prompt that lists only those
+    parameters. With cascade (default CASCADE_ENABLED), they (and empty ones)
+    are asked to CASCADE_MODEL instead; see escalate_records. Returns the
+    final CSV text ("response"), one validated record per parameter
+    ("records"), the token accounting of the request ("token_budget") and the
+    cascade stats ("cascade", None without cascade).
+    """
+    cascade_model = None
+    if CASCADE_ENABLED if cascade is None else cascade:
+        # Only a model the provider offers, and not the first-pass model itself
+        if CASCADE_MODEL in await get_available_models() and CASCADE_MODEL != model:
+            cascade_model = CASCADE_MODEL
+        else:
+            print(f"Cascade model {CASCADE_MODEL} is not offered or is the request's model ({model}), extracting without escalation")
+    
+    numbered_text = number_lines(texts)
+    names = [spec.name for spec in prompt_registry.parameters(analysis_type)]
+    ruled = await apply_rules(numbered_text, analysis_type)
+    pending = [index for index in range(len(names)) if index not in ruled]
+    
+    token_budget = await token_budget_report(numbered_text, model, analysis_type, pending if ruled else None)
+    records: List[Optional[ValidatedRecord]] = [ruled.get(index) for index in range(len(names))]
+    if pending:
+        response = await get_llm_response(texts, model, analysis_type, use_cache, pending if ruled else None)
+        if response.startswith("Error"):
+            return {"response": response, "records": [], "token_budget": token_budget, "cascade": None}
+        with span("parse_validate"):
+            for index, record in zip(pending, validate_rows(parse_response_rows(response, names), analysis_type, pending)):
+                records[index] = record
+    
+    cascade_stats = None
+    if cascade_model:
+        first_pass_tokens = sum(prompt["prompt_tokens"] for prompt in token_budget["prompts"])
+        with span("cascade"):
+            cascade_stats = await escalate_records(numbered_text, analysis_type, records, pending, model, cascade_model, first_pass_tokens, use_cache)
+    
+    for _ in range(0 if cascade_model else VALIDATION_RETRIES):
+        indexes = [index for index, record in enumerate(records) if not record.valid]
+        if not indexes:
+            break
+        
+        parts = _retry_parts(analysis_type, [records[i] for i in indexes], indexes)
+        parameters = prompt_registry.parameters(analysis_type)
+        document = (await select_evidence(numbered_text, [parameters[i] for i in indexes], model)).text
+        if not (await measure_prompt(document, parts, model)).fits:
+            break
+        retry_response = await get_completion(parts.prefix + document + parts.suffix, model, use_cache)
+        if retry_response.startswith("Error"):
+            break
+        
+        with span("parse_validate"):
+            retried = validate_rows(parse_response_rows(retry_response, names), analysis_type, indexes)
+        for index, record in zip(indexes, retried):
+            # Keep the first answer unless the retry fixed it or the first was missing
+            if record.valid or records[index].error == "missing from response":
+                records[index] = record
+    
+    response = format_response_rows([ResponseRow(r.parameter, r.value, r.line_reference) for r in records])
+    return {"response": response, "records": [record._asdict() for record in records], "token_budget": token_budget, "cascade": cascade_stats}
+
+async def record_usage(model: str, prompt: str, completion: str, usage: Optional[dict]):
+    """Record token usage and cost, counting tokens locally if the provider did not report them."""
+    if usage and "prompt_tokens" in usage:
+        prompt_tokens, completion_tokens = usage["prompt_tokens"], usage.get("completion_tokens", 0)
+    else:
+        encoding = model_encoding(model)
+        prompt_tokens = await run_cpu(count_tokens, SYSTEM_MESSAGE + prompt, encoding)
+        completion_tokens = await run_cpu(count_tokens, completion, encoding)
+    record_llm_usage(model, prompt_tokens, completion_tokens, local=USE_LOCAL_LLM)
+
+async def get_openai_response(prompt: str, model: str = DEFAULT_MODEL, structured: bool = False) -> str:
     if not OPENAI_API_KEY:
         raise ValueError("OpenAI API key is not set in the environment variables")
     
     try:
-        url = "https://api.openai.com/v1/chat/completions"
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {OPENAI_API_KEY}"
@@ -78,23 +767,30 @@ def get_openai_response(prompt: str, model: str = DEFAULT_MODEL) -> str:
         data = {
             "model": model,
             "messages": [
-                {"role": "system", "content": "You are a medical parameter extraction assistant that analyzes medical documents and extracts specified parameters."},
+                {"role": "system", "content": SYSTEM_MESSAGE},
                 {"role": "user", "content": prompt}
-            ]
+            ],
+            "temperature": LLM_TEMPERATURE
         }
+        if structured:
+            data["messages"][1]["content"] += STRUCTURED_OUTPUT_INSTRUCTION
+            data["response_format"] = {"type": "json_schema", "json_schema": RESPONSE_JSON_SCHEMA}
         
-        response = requests.post(url, headers=headers, json=data)
-        response_data = response.json()
+        status, response_data = await post_chat_completion(OPENAI_CHAT_URL, data, headers)
         
-        if response.status_code == 200:
-            return response_data["choices"][0]["message"]["content"]
+        if status == 200:
+            content = response_data["choices"][0]["message"]["content"]
+            await record_usage(model, data["messages"][1]["content"], content, response_data.get("usage"))
+            return structured_to_csv(content) if structured else content
         else:
-            return f"Error from OpenAI API: {response_data.get('error', {}).get('message', 'Unknown error')}"
+            error = response_data.get('error', {})
+            message = error.get('message', 'Unknown error') if isinstance(error, dict) else error
+            return f"Error from OpenAI API: {message}"
     
     except Exception as e:
         return f"Error getting response from OpenAI: {str(e)}"
 
-async def get_local_llm_response(prompt: str, model: str = DEFAULT_MODEL) -> str:
+async def get_local_llm_response(prompt: str, model: str = DEFAULT_MODEL, structured: bool = False) -> str:
     if not LOCAL_LLM_URL:
         raise ValueError("Local LLM URL is not set in the environment variables")
     
@@ -102,23 +798,163 @@ async def get_local_llm_response(prompt: str, model: str = DEFAULT_MODEL) -> str
         payload = {
             "model": model,
             "messages": [
-                {"role": "system", "content": "You are a medical parameter extraction assistant that analyzes medical documents and extracts specified parameters."},
+                {"role": "system", "content": SYSTEM_MESSAGE},
                 {"role": "user", "content": prompt}
-            ]
+            ],
+            "temperature": LLM_TEMPERATURE
         }
+        if structured:
+            payload["messages"][1]["content"] += STRUCTURED_OUTPUT_INSTRUCTION
+            payload["response_format"] = {"type": "json_schema", "json_schema": RESPONSE_JSON_SCHEMA}
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                f"{LOCAL_LLM_URL}/chat/completions",
-                json=payload,
-                headers={"Content-Type": "application/json"}
-            ) as response:
-                result = await response.json()
-                
-                if response.status == 200:
-                    return result["choices"][0]["message"]["content"]
-                else:
-                    return f"Error from local LLM service: {result.get('error', 'Unknown error')}"
+        status, result = await post_chat_completion(
+            f"{LOCAL_LLM_URL}/chat/completions",
+            payload,
+            {"Content-Type": "application/json"}
+        )
+        
+        if status == 200:
+            content = result["choices"][0]["message"]["content"]
+            await record_usage(model, payload["messages"][1]["content"], content, result.get("usage"))
+            return structured_to_csv(content) if structured else content
+        else:
+            return f"Error from local LLM service: {result.get('error', 'Unknown error')}"
     
     except Exception as e:
-        return f"Error getting response from local LLM: {str(e)}"
\ No newline at end of file
+        return f"Error getting response from local LLM: {str(e)}"
+
+
+def _chat_endpoint() -> tuple:
+    """Return (url, headers) of the configured chat completions endpoint."""
+    if USE_LOCAL_LLM:
+        if not LOCAL_LLM_URL:
+            raise ValueError("Local LLM URL is not set in the environment variables")
+        return f"{LOCAL_LLM_URL}/chat/completions", {"Content-Type": "application/json"}
+    
+    return OPENAI_CHAT_URL, {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {OPENAI_API_KEY}"
+    }
+
+def _error_message(body: str) -> str:
+    try:
+        error = json.loads(body).get("error", "Unknown error")
+    except (json.JSONDecodeError, AttributeError):
+        return body or "Unknown error"
+    return error.get("message", "Unknown error") if isinstance(error, dict) else str(error)
+
+async def stream_completion(prompt: str, model: str = DEFAULT_MODEL) -> AsyncIterator[str]:
+    """Yield completion text deltas using the provider's stream mode.
+    
+    Retries on 429/5xx and connection errors happen only before the first
+    delta is received; afterwards errors are raised to the caller.
+    """
+    url, headers = _chat_endpoint()
+    provider = "local LLM service" if USE_LOCAL_LLM else "OpenAI API"
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": SYSTEM_MESSAGE},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": LLM_TEMPERATURE,
+        "stream": True
+    }
+    async with track_llm_call():
+        async for delta in _stream_completion(url, headers, provider, payload):
+            yield delta
+
+async def _stream_completion(url: str, headers: dict, provider: str, payload: dict) -> AsyncIterator[str]:
+    session = get_session()
+    started = False
+    
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        retry_after = None
+        await acquire_rate_limit()
+        try:
+            async with get_semaphore():
+                async with session.post(url, json=payload, headers=headers) as response:
+                    if response.status != 200:
+                        body = await response.text()
+                        if response.status not in RETRY_STATUS_CODES or attempt == LLM_MAX_RETRIES:
+                            raise RuntimeError(f"Error from {provider}: {_error_message(body)}")
+                        retry_after = response.headers.get("Retry-After")
+                    else:
+                        async for raw_line in response.content:
+                            line = raw_line.decode("utf-8").strip()
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[len("data:"):].strip()
+                            if data == "[DONE]":
+                                return
+                            
+                            choices = json.loads(data).get("choices") or []
+                            delta = choices[0].get("delta", {}).get("content") if choices else None
+                            if delta:
+                                started = True
+                                yield delta
+                        return
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if started or attempt == LLM_MAX_RETRIES:
+                raise
+        
+        await asyncio.sleep(_backoff_delay(attempt, retry_after))
+
+async def stream_llm_response(texts: List[str], model: str = DEFAULT_MODEL, analysis_type: str = "standard", use_cache: bool = True, indexes: Optional[List[int]] = None) -> AsyncIterator[str]:
+    """Streaming counterpart of get_llm_response.
+    
+    Cached completions and prompts that need chunked extraction cannot be
+    streamed token by token; they are yielded as a single piece. Sharded
+    analysis types, and requests for a subset of the parameters (indexes),
+    yield each shard's rows as soon as that shard finishes.
+    """
+    if is_sharded(analysis_type) or indexes is not None:
+        numbered_text = number_lines(texts)
+        tasks = [
+            asyncio.ensure_future(_get_shard_response(numbered_text, shard, model, use_cache))
+            for shard in pending_shards(analysis_type, indexes)
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                response = await next_done
+                if response.startswith("Error"):
+                    raise RuntimeError(response)
+                yield response.rstrip("\n") + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+        return
+    
+    numbered_text = number_lines(texts)
+    document = (await select_evidence(numbered_text, prompt_registry.parameters(analysis_type), model)).text
+    if not (await measure_prompt(document, prompt_registry.prompt_parts(analysis_type), model)).fits:
+        yield await get_llm_response(texts, model, analysis_type, use_cache)
+        return
+    
+    with span("prompt_build"):
+        prompt = render_prompt(document, analysis_type)
+    
+    cache = get_llm_cache() if use_cache else None
+    cache_key = llm_cache_key(prompt, model) if cache else None
+    if cache:
+        cached = await run_blocking(cache.get, cache_key)
+        if cached is not None:
+            LLM_COMPLETIONS.inc(model=model, source="cache")
+            yield cached
+            return
+    
+    response = ""
+    started = time.perf_counter()
+    async for delta in stream_completion(prompt, model):
+        response += delta
+        yield delta
+    
+    seconds = time.perf_counter() - started
+    LLM_REQUEST_DURATION.observe(seconds, model=model, status="200")
+    observe_stage("llm_request", seconds)
+    LLM_COMPLETIONS.inc(model=model, source="provider")
+    # Streamed responses carry no usage block; count with the tokenizer
+    await record_usage(model, prompt, response, None)
+    
+    if cache:
+        await run_blocking(cache.set, cache_key, response)
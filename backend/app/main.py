@@ -1,21 +1,47 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+import time
+# Taken before the imports below so the reported startup time includes them
+IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Optional
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from functools import partial
+from typing import AsyncIterator, List, Optional
+import asyncio
+import json
 import os
 
-from app.document_processor import process_documents
-from app.llm_service import get_llm_response, AVAILABLE_MODELS, DEFAULT_MODEL
-from app.prompt import load_parameters_descriptions
+from app.document_processor import is_extraction_error, process_documents, shutdown_ocr_pool, get_extraction_cache
+from app.llm_service import apply_rules, extract_parameters, summarize_cascades, stream_llm_response, close_session, get_llm_cache, drain_llm_calls, get_available_models, get_default_model, models_stale, resolve_model, start_model_refresh, token_budget_report, warm_token_counts, DEFAULT_MODEL
+from app.prompt import load_parameters_descriptions, normalize_analysis_type, number_lines, prompt_registry
+from app.response_parser import ResponseRow, format_response_rows, parse_response_rows
+from app.validation import ValidatedRecord, get_schemas, validate_rows
 from app.anonymizer import Anonymizer
+from app.executor import blocking_executor, cpu_executor, executor_stats, run_blocking, run_cpu, shutdown_executors
+from app.metrics import ERRORS, Gauge, HTTP_REQUEST_DURATION, observe_stage, registry, span, start_snapshots, track_request
+from app.jobs import JobQueue, QueueFullError
+from app.state import open_job_store
+from app.cases import CASE_DB_PATH, CaseDocument, CaseStore, merge_records, text_digest
 
 app = FastAPI(title="Document Processing API")
 
+# Documents processed concurrently by one /api/process/batch request
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
+BATCH_MAX_DOCUMENTS = int(os.getenv("BATCH_MAX_DOCUMENTS", "500"))
+# Seconds shutdown waits for running jobs and in-flight LLM calls before cancelling them
+SHUTDOWN_DRAIN_TIMEOUT = float(os.getenv("SHUTDOWN_DRAIN_TIMEOUT", "30"))
+
 anonymizer = Anonymizer()
 NAMES_FILE_PATH = os.environ.get("NAMES_FILE_PATH", "app/names_to_anonymize.txt")
 
 if os.path.exists(NAMES_FILE_PATH):
     anonymizer.load_names_from_file(NAMES_FILE_PATH)
 
+def anonymize_texts(texts: List[str]) -> List[str]:
+    """Module-level entry point so a process-pool executor can pickle it by reference."""
+    return anonymizer.anonymize_texts(texts)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000", "http://frontend:3000"],
@@ -24,17 +50,73 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_request_duration(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    # Route templates (/api/jobs/{job_id}) keep the label set bounded
+    route = request.scope.get("route")
+    HTTP_REQUEST_DURATION.observe(
+        time.perf_counter() - started,
+        method=request.method,
+        path=route.path if route is not None else "unmatched",
+        status=str(response.status_code),
+    )
+    return response
+
+@app.on_event("startup")
+async def startup():
+    # Workers forked by app.serve inherit the prompts and model list loaded before fork
+    prompt_registry.ensure_loaded()
+    # Model discovery must not hold up startup; /api/models waits for it if needed
+    if models_stale():
+        start_model_refresh()
+    # Load the tokenizer and count the static prompt parts in the background
+    app.state.token_warmup = asyncio.create_task(warm_token_counts(DEFAULT_MODEL))
+    await job_queue.start()
+    start_snapshots()
+    ready_s = time.perf_counter() - IMPORT_STARTED
+    observe_stage("startup", ready_s)
+    print(f"Ready {ready_s:.2f}s after import")
+
+@app.on_event("shutdown")
+async def shutdown():
+    deadline = time.monotonic() + SHUTDOWN_DRAIN_TIMEOUT
+    await job_queue.stop(timeout=SHUTDOWN_DRAIN_TIMEOUT)
+    left = await drain_llm_calls(deadline - time.monotonic())
+    if left:
+        print(f"Shutting down with {left} LLM call(s) still in flight")
+    await close_session()
+    shutdown_ocr_pool()
+    shutdown_executors()
+    registry.write_snapshot()
+
 @app.get("/")
 async def root():
     return {"message": "Document Processing API is running"}
 
 @app.get("/api/models")
 async def get_models():
+    models = await get_available_models()
     return {
-        "models": AVAILABLE_MODELS,
-        "default_model": DEFAULT_MODEL
+        "models": models,
+        "default_model": get_default_model(models)
     }
 
+@app.get("/api/cache-stats")
+async def get_cache_stats():
+    # Hits and misses are summed over the workers, like /metrics
+    extraction_cache = get_extraction_cache()
+    llm_cache = get_llm_cache()
+    return {
+        "extraction": await run_blocking(extraction_cache.stats) if extraction_cache else None,
+        "llm": await run_blocking(llm_cache.stats) if llm_cache else None
+    }
+
+@app.get("/api/executor-stats")
+async def get_executor_stats():
+    return executor_stats()
+
 @app.get("/api/parameter-descriptions")
 async def get_parameter_descriptions():
     try:
@@ -48,43 +130,444 @@ async def get_parameter_descriptions():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error loading parameter descriptions: {str(e)}")
 
+async def run_process_pipeline(
+    files: Optional[List[UploadFile]],
+    text_input: Optional[str],
+    model: str,
+    analysis_type: str,
+    use_cache: bool = True,
+    cascade: Optional[bool] = None
+) -> dict:
+    """Extract, anonymize and analyze the input; shared by /api/process and the job workers.
+
+    The returned "timings" hold the stage totals plus a per-span breakdown
+    with token counts and estimated cost (see app.metrics). When the model
+    call fails, "success" is False and "error" holds the LLM error.
+    """
+    with track_request() as request_metrics:
+        timings = {}
+        started = time.perf_counter()
+        document_texts = []
+        
+        if files:
+            with span("extraction"):
+                document_texts = await process_documents(files)
+        timings["extraction_s"] = time.perf_counter() - started
+        
+        if text_input:
+            document_texts.append(text_input)
+        
+        if not document_texts:
+            raise HTTPException(status_code=400, detail="No input provided. Please upload at least one file or provide text input.")
+        
+        model = await resolve_model(model)
+        
+        stage_started = time.perf_counter()
+        with span("anonymization"):
+            anonymized_texts = await run_cpu(anonymize_texts, document_texts)
+        anonymized_combined_text = "\n\n".join(anonymized_texts)
+        timings["anonymization_s"] = time.perf_counter() - stage_started
+        
+        stage_started = time.perf_counter()
+        with span("llm"):
+            extraction = await extract_parameters(anonymized_texts, model, analysis_type, use_cache, cascade)
+        timings["llm_s"] = time.perf_counter() - stage_started
+        timings["total_s"] = time.perf_counter() - started
+        timings["breakdown"] = request_metrics.breakdown()
+    
+    error = extraction["response"] if extraction["response"].startswith("Error") else None
+    return {
+        "success": error is None,
+        "error": error,
+        "response": extraction["response"],
+        "records": extraction["records"],
+        "token_budget": extraction["token_budget"],
+        "cascade": extraction["cascade"],
+        "analysis_type": analysis_type,
+        "combined_text": anonymized_combined_text,
+        "timings": timings,
+    }
+
+job_queue = JobQueue(open_job_store(), run_process_pipeline)
+
+registry.register(Gauge("rakathon_job_queue_depth", "Jobs waiting for a worker.", lambda: job_queue.depth))
+registry.register(Gauge("rakathon_jobs_running", "Jobs being processed.", lambda: job_queue.running))
+registry.register(Gauge("rakathon_cpu_executor_queue_depth", "Calls waiting for a CPU executor worker.", lambda: cpu_executor.depth))
+registry.register(Gauge("rakathon_blocking_executor_queue_depth", "Calls waiting for a blocking executor worker.", lambda: blocking_executor.depth))
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text exposition of stage latencies, LLM tokens and cost.
+
+    Under app.serve, counters and histograms are summed over the workers
+    (see app.metrics); gauges are those of the worker answering.
+    """
+    # Gauges query the job store and the worker snapshots are files: off the event loop
+    return PlainTextResponse(await run_blocking(registry.render), media_type="text/plain; version=0.0.4")
+
 @app.post("/api/process")
 async def process_data(
     files: Optional[List[UploadFile]] = File(None),
     text_input: Optional[str] = Form(None),
     model: Optional[str] = Form(DEFAULT_MODEL),
-    analysis_type: Optional[str] = Form("standard")
+    analysis_type: Optional[str] = Form("standard"),
+    use_cache: bool = Form(True),
+    include_timings: bool = Form(False),
+    cascade: Optional[bool] = Form(None)
 ):
     try:
-        document_texts = []
+        result = await run_process_pipeline(files, text_input, model, analysis_type, use_cache, cascade)
+        if not result["success"]:
+            raise HTTPException(status_code=502, detail=result["error"])
+        timings = result.pop("timings")
+        if include_timings:
+            result["timings"] = timings
+        return result
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        ERRORS.inc(stage="pipeline")
+        raise HTTPException(status_code=500, detail=str(e))
+
+class BatchDocument(BaseModel):
+    id: str
+    text: str
+
+class BatchRequest(BaseModel):
+    documents: List[BatchDocument]
+    model: str = DEFAULT_MODEL
+    analysis_type: str = "standard"
+    use_cache: bool = True
+    include_timings: bool = False
+    # None: CASCADE_ENABLED
+    cascade: Optional[bool] = None
+
+@app.post("/api/process/batch")
+async def process_batch(batch: BatchRequest):
+    """Process many text documents independently with bounded concurrency.
+
+    Each document gets its own result; a failing document does not fail the
+    batch. With the model cascade, "cascade" sums the escalation stats of all
+    documents.
+    """
+    if not batch.documents:
+        raise HTTPException(status_code=400, detail="No documents provided.")
+    if len(batch.documents) > BATCH_MAX_DOCUMENTS:
+        raise HTTPException(status_code=413, detail=f"Too many documents in one batch (maximum is {BATCH_MAX_DOCUMENTS}).")
+    
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    
+    async def process_one(document: BatchDocument) -> dict:
+        async with semaphore:
+            try:
+                result = await run_process_pipeline(None, document.text, batch.model, batch.analysis_type, batch.use_cache, batch.cascade)
+                item = {"id": document.id, "success": result["success"], "response": result["response"], "records": result["records"], "token_budget": result["token_budget"], "cascade": result["cascade"], "error": result["error"]}
+                if batch.include_timings:
+                    item["timings"] = result["timings"]
+                return item
+            except Exception as e:
+                ERRORS.inc(stage="pipeline")
+                return {"id": document.id, "success": False, "response": None, "records": [], "error": str(e) or e.__class__.__name__}
+    
+    results = await asyncio.gather(*[process_one(document) for document in batch.documents])
+    return {"analysis_type": batch.analysis_type, "results": results, "cascade": summarize_cascades([result.get("cascade") for result in results])}
+
+@app.post("/api/jobs", status_code=202)
+async def create_job(
+    files: Optional[List[UploadFile]] = File(None),
+    text_input: Optional[str] = Form(None),
+    model: Optional[str] = Form(DEFAULT_MODEL),
+    analysis_type: Optional[str] = Form("standard"),
+    use_cache: bool = Form(True),
+    cascade: Optional[bool] = Form(None)
+):
+    """Queue /api/process work and return a job ID to poll."""
+    if not files and not text_input:
+        raise HTTPException(status_code=400, detail="No input provided. Please upload at least one file or provide text input.")
+    
+    try:
+        job_id = await job_queue.submit(files or [], text_input, model, analysis_type, use_cache, cascade)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    
+    return {"job_id": job_id, "status": "queued"}
+
+@app.get("/api/jobs")
+async def get_jobs_stats():
+    return await job_queue.stats()
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "model": job["model"],
+        "analysis_type": job["analysis_type"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "timings": job["timings"],
+        "result": job["result"],
+        "error": job["error"],
+    }
+
+case_store = CaseStore(CASE_DB_PATH)
+
+async def run_case_update(
+    case_id: str,
+    files: Optional[List[UploadFile]],
+    text_input: Optional[str],
+    model: str,
+    analysis_type: str,
+    use_cache: bool = True
+) -> dict:
+    """Add documents to a patient case, extracting only the ones the case does not have yet.
+
+    Each new document is anonymized and extracted on its own, so an update
+    costs what its new documents cost, whatever the size of the case. The
+    records are merged into the case parameters (see app.cases.merge_parameter)
+    and the changes are returned as "diff". "success" is False when a
+    document failed; if the model failed for every new document, the update
+    raises a 502.
+    """
+    analysis_type = normalize_analysis_type(analysis_type)
+    existing_type = await run_blocking(case_store.analysis_type, case_id)
+    if existing_type is not None and existing_type != analysis_type:
+        raise HTTPException(status_code=409, detail=f"Case {case_id} uses the {existing_type} analysis type.")
+    
+    with track_request() as request_metrics:
+        timings = {}
+        started = time.perf_counter()
+        document_texts, names = [], []
         
         if files:
-            document_texts = await process_documents(files)
+            with span("extraction"):
+                document_texts = await process_documents(files)
+            names = [file.filename for file in files]
+        timings["extraction_s"] = time.perf_counter() - started
         
         if text_input:
             document_texts.append(text_input)
+            names.append(None)
         
         if not document_texts:
             raise HTTPException(status_code=400, detail="No input provided. Please upload at least one file or provide text input.")
         
-        if model not in AVAILABLE_MODELS:
-            model = DEFAULT_MODEL
+        model = await resolve_model(model)
+        digests = [text_digest(text) for text in document_texts]
+        known = await run_blocking(case_store.documents, case_id, digests)
+        statuses = []
+        new = []
+        for index, (text, digest) in enumerate(zip(document_texts, digests)):
+            if is_extraction_error(text):
+                statuses.append({"name": names[index], "status": "error", "document": None, "error": text})
+            elif digest in known or digest in digests[:index]:
+                statuses.append({"name": names[index], "status": "duplicate", "document": known.get(digest), "error": None})
+            else:
+                statuses.append({"name": names[index], "status": "added", "document": None, "error": None})
+                new.append(index)
         
-        anonymized_texts = anonymizer.anonymize_texts(document_texts)
-        anonymized_combined_text = "\n\n".join(anonymized_texts)
+        stage_started = time.perf_counter()
+        with span("anonymization"):
+            anonymized_texts = await run_cpu(anonymize_texts, [document_texts[index] for index in new])
+        timings["anonymization_s"] = time.perf_counter() - stage_started
         
-        llm_response = await get_llm_response(anonymized_texts, model, analysis_type)
+        stage_started = time.perf_counter()
+        with span("llm"):
+            extractions = await asyncio.gather(*[
+                extract_parameters([text], model, analysis_type, use_cache) for text in anonymized_texts
+            ])
+        timings["llm_s"] = time.perf_counter() - stage_started
         
-        return {
-            "success": True,
-            "response": llm_response,
-            "analysis_type": analysis_type,
-            "combined_text": anonymized_combined_text,
-        }
+        documents, added = [], []
+        for index, anonymized_text, extraction in zip(new, anonymized_texts, extractions):
+            statuses[index]["token_budget"] = extraction["token_budget"]
+            if extraction["response"].startswith("Error"):
+                statuses[index].update(status="error", error=extraction["response"])
+                continue
+            records = [ValidatedRecord(**record) for record in extraction["records"]]
+            documents.append(CaseDocument(names[index] or "", digests[index], document_texts[index], anonymized_text, records))
+            added.append(index)
+        
+        _, schemas = get_schemas(analysis_type)
+        seqs, diff = await run_blocking(
+            case_store.add_documents, case_id, analysis_type, model, documents, partial(merge_records, schemas=schemas)
+        )
+        for index, seq in zip(added, seqs):
+            # Added meanwhile by a concurrent update of the same case
+            if seq is None:
+                statuses[index]["status"] = "duplicate"
+            statuses[index]["document"] = seq
+        
+        timings["total_s"] = time.perf_counter() - started
+        timings["breakdown"] = request_metrics.breakdown()
+    
+    if new and not added:
+        raise HTTPException(status_code=502, detail=statuses[new[0]]["error"])
+    
+    case = await run_blocking(case_store.get, case_id)
+    return {
+        "success": all(status["status"] != "error" for status in statuses),
+        "case_id": case_id,
+        "analysis_type": analysis_type,
+        "documents": statuses,
+        "diff": diff,
+        "parameters": case["parameters"] if case else [],
+        "timings": timings,
+    }
+
+@app.post("/api/cases/{case_id}/documents")
+async def add_case_documents(
+    case_id: str,
+    files: Optional[List[UploadFile]] = File(None),
+    text_input: Optional[str] = Form(None),
+    model: Optional[str] = Form(DEFAULT_MODEL),
+    analysis_type: Optional[str] = Form("standard"),
+    use_cache: bool = Form(True),
+    include_timings: bool = Form(False)
+):
+    """Add documents to a patient case (created on first use) and return its parameters and the diff."""
+    try:
+        result = await run_case_update(case_id, files, text_input, model, analysis_type, use_cache)
+        timings = result.pop("timings")
+        if include_timings:
+            result["timings"] = timings
+        return result
     
+    except HTTPException:
+        raise
     except Exception as e:
+        ERRORS.inc(stage="pipeline")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/cases/{case_id}")
+async def get_case(case_id: str):
+    case = await run_blocking(case_store.get, case_id)
+    if case is None:
+        raise HTTPException(status_code=404, detail="Case not found")
+    return case
+
+@app.delete("/api/cases/{case_id}")
+async def delete_case(case_id: str):
+    if not await run_blocking(case_store.delete, case_id):
+        raise HTTPException(status_code=404, detail="Case not found")
+    return {"case_id": case_id, "deleted": True}
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def stream_process_events(
+    files: Optional[List[UploadFile]],
+    text_input: Optional[str],
+    model: str,
+    analysis_type: str,
+    use_cache: bool = True
+) -> AsyncIterator[str]:
+    """Run the /api/process pipeline and yield server-sent events as it progresses.
+
+    Events: document, ocr_page, anonymized, token_budget, row (one per
+    parameter resolved by the rules, then one per parsed response line;
+    "source" tells which), done (full response and validated records, without
+    re-asking) and error.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    loop = asyncio.get_running_loop()
+    
+    def emit(event: Optional[str], data: Optional[dict] = None):
+        loop.call_soon_threadsafe(queue.put_nowait, (event, data))
+    
+    async def run():
+        try:
+            document_texts = await process_documents(files, emit) if files else []
+            if text_input:
+                document_texts.append(text_input)
+            
+            anonymized_texts = await run_cpu(anonymize_texts, document_texts)
+            emit("anonymized", {"documents": len(anonymized_texts), "combined_text": "\n\n".join(anonymized_texts)})
+            numbered_text = number_lines(anonymized_texts)
+            parameter_names = [spec.name for spec in prompt_registry.parameters(analysis_type)]
+            
+            # Parameters resolved by the rules are emitted first and not asked of the model
+            ruled = await apply_rules(numbered_text, analysis_type)
+            indexes = [index for index in range(len(parameter_names)) if index not in ruled] if ruled else None
+            emit("token_budget", await token_budget_report(numbered_text, model, analysis_type, indexes))
+            for record in ruled.values():
+                row = ResponseRow(record.parameter, record.value, record.line_reference)
+                emit("row", {**row._asdict(), "line": format_response_rows([row]).strip(), "source": "rules"})
+            
+            response, pending = "", ""
+            if indexes is None or indexes:
+                async for delta in stream_llm_response(anonymized_texts, model, analysis_type, use_cache, indexes):
+                    response += delta
+                    if response.startswith("Error"):
+                        continue
+                    
+                    pending += delta
+                    *complete_lines, pending = pending.split("\n")
+                    for line in complete_lines:
+                        for row in parse_response_rows(line, parameter_names):
+                            emit("row", {**row._asdict(), "line": line.strip(), "source": "llm"})
+            
+            if response.startswith("Error"):
+                emit("error", {"detail": response})
+                return
+            
+            for row in parse_response_rows(pending, parameter_names):
+                emit("row", {**row._asdict(), "line": pending.strip(), "source": "llm"})
+            
+            records = validate_rows(parse_response_rows(response, parameter_names), analysis_type, indexes)
+            if ruled:
+                merged = iter(records)
+                records = [ruled[index] if index in ruled else next(merged) for index in range(len(parameter_names))]
+                response = format_response_rows([ResponseRow(r.parameter, r.value, r.line_reference) for r in records])
+            emit("done", {
+                "success": True,
+                "response": response,
+                "records": [record._asdict() for record in records],
+                "analysis_type": analysis_type,
+            })
+        except Exception as e:
+            ERRORS.inc(stage="pipeline")
+            emit("error", {"detail": str(e)})
+        finally:
+            emit(None)
+    
+    task = asyncio.create_task(run())
+    try:
+        while True:
+            event, data = await queue.get()
+            if event is None:
+                break
+            yield sse_event(event, data)
+    finally:
+        if not task.done():
+            task.cancel()
+
+@app.post("/api/process/stream")
+async def process_data_stream(
+    files: Optional[List[UploadFile]] = File(None),
+    text_input: Optional[str] = Form(None),
+    model: Optional[str] = Form(DEFAULT_MODEL),
+    analysis_type: Optional[str] = Form("standard"),
+    use_cache: bool = Form(True)
+):
+    """Streaming variant of /api/process using server-sent events."""
+    if not files and not text_input:
+        raise HTTPException(status_code=400, detail="No input provided. Please upload at least one file or provide text input.")
+    
+    model = await resolve_model(model)
+    
+    return StreamingResponse(
+        stream_process_events(files, text_input, model, analysis_type, use_cache),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/api/test-anonymizer")
 async def test_anonymizer():
     """Test endpoint to verify anonymizer is working correctly."""
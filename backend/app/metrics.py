@@ -0,0 +1,353 @@
+import os
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+# Seconds; spans range from sub-millisecond parsing to multi-minute LLM calls
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKEN_BUCKETS = (100, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000)
+
+# USD per 1M (prompt, completion) tokens; longest matching model prefix wins.
+# Local models are free. Override with LLM_PRICE_<PREFIX>=prompt,completion
+# (prefix upper-cased, non-alphanumerics replaced by "_", e.g. LLM_PRICE_GPT_4O=2.5,10).
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-4": (30.00, 60.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+}
+
+# Under the prefork server (app.serve) every worker has its own registry. With
+# METRICS_MULTIPROC_DIR set (app.serve sets it), each worker writes its counters
+# and histograms to a file there every METRICS_FLUSH_INTERVAL seconds and
+# /metrics sums the files of all workers, so totals stay monotonic whichever
+# worker answers the scrape. Files of exited workers are kept for that reason.
+# Gauges are read by the worker answering the scrape.
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR", "")
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+
+LabelValues = Tuple[str, ...]
+
+def _price_overrides() -> Dict[str, Tuple[float, float]]:
+    prices = dict(MODEL_PRICES)
+    for prefix in MODEL_PRICES:
+        override = os.getenv("LLM_PRICE_" + "".join(c if c.isalnum() else "_" for c in prefix.upper()))
+        if override:
+            prompt_price, completion_price = (float(part) for part in override.split(","))
+            prices[prefix] = (prompt_price, completion_price)
+    return prices
+
+_prices = _price_overrides()
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, local: bool = False) -> float:
+    if local:
+        return 0.0
+    matches = [prefix for prefix in _prices if model.startswith(prefix)]
+    if not matches:
+        return 0.0
+    prompt_price, completion_price = _prices[max(matches, key=len)]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+def _format_labels(names: LabelValues, values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: LabelValues = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def collect(self) -> Dict[LabelValues, float]:
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def combine(value: float, other) -> float:
+        return value + other
+
+    def render(self, values: Optional[Dict[LabelValues, float]] = None) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted((self.collect() if values is None else values).items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_number(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels: LabelValues = (), buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (bucket counts, sum, count)
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(str(labels.get(label, "")) for label in self.labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def collect(self) -> Dict[LabelValues, Tuple[List[int], float, int]]:
+        with self._lock:
+            return {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+
+    @staticmethod
+    def combine(value: Tuple[List[int], float, int], other) -> Tuple[List[int], float, int]:
+        # Snapshots hold [counts, sum, count] lists
+        counts, total, count = other
+        return [a + b for a, b in zip(value[0], counts)], value[1] + total, value[2] + count
+
+    def render(self, values: Optional[Dict[LabelValues, Tuple[List[int], float, int]]] = None) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in sorted((self.collect() if values is None else values).items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                labels = _format_labels(self.labels, key, f'le="{_format_number(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+            inf_labels = _format_labels(self.labels, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf_labels} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_number(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+class Gauge:
+    """Gauge whose value is read from a callback at scrape time."""
+
+    def __init__(self, name: str, documentation: str, read: Callable[[], float]):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge", f"{self.name} {_format_number(self.read())}"]
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        # (pid, snapshot file name); a new name after fork, and one a respawned
+        # worker cannot share with an exited worker of the same pid
+        self._snapshot: Optional[Tuple[int, str]] = None
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def _collected(self) -> Dict[str, object]:
+        return {name: metric for name, metric in self._metrics.items() if isinstance(metric, (Counter, Histogram))}
+
+    def reset(self):
+        """Drop the counter and histogram values (app.serve, before forking the workers)."""
+        for metric in self._collected().values():
+            with metric._lock:
+                metric._values.clear()
+
+    def _snapshot_name(self) -> str:
+        if self._snapshot is None or self._snapshot[0] != os.getpid():
+            self._snapshot = (os.getpid(), f"{os.getpid()}-{time.time_ns()}.json")
+        return self._snapshot[1]
+
+    def write_snapshot(self):
+        """Write this process's counters and histograms to METRICS_MULTIPROC_DIR."""
+        if not METRICS_MULTIPROC_DIR:
+            return
+        snapshot = {name: [[list(key), value] for key, value in metric.collect().items()] for name, metric in self._collected().items()}
+        path = os.path.join(METRICS_MULTIPROC_DIR, self._snapshot_name())
+        try:
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(snapshot, f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"Error writing metrics snapshot: {str(e)}")
+
+    def collect(self) -> Dict[str, Dict[LabelValues, object]]:
+        """Counter and histogram values, summed over the workers writing to METRICS_MULTIPROC_DIR."""
+        metrics = self._collected()
+        values = {name: metric.collect() for name, metric in metrics.items()}
+        if not METRICS_MULTIPROC_DIR:
+            return values
+        own = self._snapshot_name()
+        try:
+            file_names = [name for name in os.listdir(METRICS_MULTIPROC_DIR) if name.endswith(".json") and name != own]
+        except OSError:
+            file_names = []
+        for file_name in file_names:
+            try:
+                with open(os.path.join(METRICS_MULTIPROC_DIR, file_name), encoding="utf-8") as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, items in snapshot.items():
+                if name not in metrics:
+                    continue
+                merged = values[name]
+                for key, value in items:
+                    key = tuple(key)
+                    merged[key] = metrics[name].combine(merged[key], value) if key in merged else value
+        return values
+
+    def value(self, counter: "Counter", **labels: str) -> float:
+        """A counter's value over all workers."""
+        key = tuple(str(labels.get(label, "")) for label in counter.labels)
+        return self.collect().get(counter.name, {}).get(key, 0.0)
+
+    def render(self) -> str:
+        values = self.collect()
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.extend(metric.render(values[name]) if name in values else metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+def start_snapshots() -> Optional[threading.Thread]:
+    """Write this worker's snapshot every METRICS_FLUSH_INTERVAL seconds (with METRICS_MULTIPROC_DIR)."""
+    if not METRICS_MULTIPROC_DIR:
+        return None
+
+    def flush():
+        while True:
+            registry.write_snapshot()
+            time.sleep(METRICS_FLUSH_INTERVAL)
+
+    thread = threading.Thread(target=flush, name="metrics-snapshot", daemon=True)
+    thread.start()
+    return thread
+
+STAGE_DURATION = registry.register(Histogram(
+    "rakathon_stage_duration_seconds", "Time spent in each processing stage.", ("stage",)))
+HTTP_REQUEST_DURATION = registry.register(Histogram(
+    "rakathon_http_request_duration_seconds", "HTTP request latency.", ("method", "path", "status")))
+LLM_REQUEST_DURATION = registry.register(Histogram(
+    "rakathon_llm_request_duration_seconds", "Provider round trip per completion request.", ("model", "status")))
+LLM_REQUEST_TOKENS = registry.register(Histogram(
+    "rakathon_llm_request_tokens", "Tokens per completion request.", ("model", "kind"), TOKEN_BUCKETS))
+LLM_TOKENS = registry.register(Counter(
+    "rakathon_llm_tokens_total", "Prompt and completion tokens sent to/received from the provider.", ("model", "kind")))
+LLM_COST = registry.register(Counter(
+    "rakathon_llm_cost_usd_total", "Estimated provider cost in USD.", ("model",)))
+LLM_COMPLETIONS = registry.register(Counter(
+    "rakathon_llm_completions_total", "Completions by where the answer came from.", ("model", "source")))
+ERRORS = registry.register(Counter(
+    "rakathon_errors_total", "Errors by stage, including errors returned inside 200 responses.", ("stage",)))
+CACHE_LOOKUPS = registry.register(Counter(
+    "rakathon_cache_lookups_total", "Cache lookups by cache and result (hit, miss).", ("cache", "result")))
+
+class RequestMetrics:
+    """Per-request accumulator of stage times and LLM usage."""
+
+    def __init__(self):
+        self.stages: Dict[str, float] = {}
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = 0.0
+        self.llm_calls = 0
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_usage(self, prompt_tokens: int, completion_tokens: int, cost: float):
+        with self._lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cost_usd += cost
+            self.llm_calls += 1
+
+    def breakdown(self) -> dict:
+        return {
+            "stages": {stage: round(seconds, 6) for stage, seconds in self.stages.items()},
+            "llm_calls": self.llm_calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "estimated_cost_usd": round(self.cost_usd, 6),
+        }
+
+_current: ContextVar[Optional[RequestMetrics]] = ContextVar("request_metrics", default=None)
+
+@contextmanager
+def track_request() -> Iterator[RequestMetrics]:
+    """Collect spans and LLM usage of everything awaited inside the block."""
+    request_metrics = RequestMetrics()
+    token = _current.set(request_metrics)
+    try:
+        yield request_metrics
+    finally:
+        _current.reset(token)
+
+def observe_stage(stage: str, seconds: float):
+    STAGE_DURATION.observe(seconds, stage=stage)
+    request_metrics = _current.get()
+    if request_metrics is not None:
+        request_metrics.add_stage(stage, seconds)
+
+class SpanLog(RequestMetrics):
+    """RequestMetrics that keeps every span, to be replayed in another process."""
+
+    def __init__(self):
+        super().__init__()
+        self.spans: List[Tuple[str, float]] = []
+
+    def add_stage(self, stage: str, seconds: float):
+        super().add_stage(stage, seconds)
+        self.spans.append((stage, seconds))
+
+@contextmanager
+def collect_spans() -> Iterator[List[Tuple[str, float]]]:
+    """Collect the (stage, seconds) spans of the block, e.g. in a worker process (see replay_spans)."""
+    span_log = SpanLog()
+    token = _current.set(span_log)
+    try:
+        yield span_log.spans
+    finally:
+        _current.reset(token)
+
+def replay_spans(spans: List[Tuple[str, float]]):
+    """Record spans collected elsewhere as if they had run here."""
+    for stage, seconds in spans:
+        observe_stage(stage, seconds)
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time a block into the stage histogram and the current request's breakdown."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+def record_llm_usage(model: str, prompt_tokens: int, completion_tokens: int, local: bool = False):
+    cost = estimate_cost(model, prompt_tokens, completion_tokens, local)
+    LLM_TOKENS.inc(prompt_tokens, model=model, kind="prompt")
+    LLM_TOKENS.inc(completion_tokens, model=model, kind="completion")
+    LLM_REQUEST_TOKENS.observe(prompt_tokens, model=model, kind="prompt")
+    LLM_REQUEST_TOKENS.observe(completion_tokens, model=model, kind="completion")
+    LLM_COST.inc(cost, model=model)
+    request_metrics = _current.get()
+    if request_metrics is not None:
+        request_metrics.add_usage(prompt_tokens, completion_tokens, cost)
@@ -1,87 +1,292 @@
 import os
+import csv
 import glob
-from typing import List, Dict
+import threading
+import time
+from typing import List, Dict, NamedTuple, Optional, Tuple
+from app.metrics import span
 
 # Define paths
 PROMPT_DIR = os.path.join(os.path.dirname(__file__), '..', 'prompt')
 PROMPT_TEMPLATE_PATH = os.path.join(PROMPT_DIR, 'prompt_template.txt')
 PROMPT_DATA_DIR = os.path.join(PROMPT_DIR, 'data')
 
+ANALYSIS_TYPES = ("standard", "extended")
+# How often (seconds) the registry checks prompt files for changes
+PROMPT_RELOAD_INTERVAL = float(os.getenv("PROMPT_RELOAD_INTERVAL", "2"))
+
+# Analysis types whose parameters are split by category into concurrent sub-prompts
+SHARDED_ANALYSIS_TYPES = tuple(t.strip() for t in os.getenv("SHARDED_ANALYSIS_TYPES", "extended").split(",") if t.strip())
+# Upper bound on parameters per shard; larger categories are split
+SHARD_MAX_PARAMETERS = int(os.getenv("SHARD_MAX_PARAMETERS", "40"))
+
+_COMBINED_TEXT_MARKER = "\x00COMBINED_TEXT\x00"
+
+class ParameterSpec(NamedTuple):
+    name: str
+    description: str
+    value_format: str
+    # The row as written in the parameters file, used to render parameter subsets
+    source_line: str = ""
+
+class PromptParts(NamedTuple):
+    """Static text of a rendered template before and after the document text."""
+    prefix: str
+    suffix: str
+
+class PromptShard(NamedTuple):
+    """A subset of the parameters with its own pre-rendered prompt."""
+    indexes: List[int]
+    parameters: List[ParameterSpec]
+    parts: PromptParts
+
 def load_template() -> str:
     """Load the main prompt template"""
     with open(PROMPT_TEMPLATE_PATH, 'r', encoding='utf-8') as file:
         return file.read()
 
+def parse_parameters(content: str) -> List[ParameterSpec]:
+    """Parse a parameters file into specs.
+
+    Rows are `name;description;format` (standard) or `name;format` (extended),
+    with double-quoted fields allowed to contain semicolons.
+    """
+    parameters = []
+    lines = content.strip().split('\n')
+    for line, row in zip(lines, csv.reader(lines, delimiter=';')):
+        if len(row) >= 3:
+            parameters.append(ParameterSpec(row[0].strip(), row[1].strip(), row[2].strip(), line))
+        elif len(row) == 2:
+            parameters.append(ParameterSpec(row[0].strip(), "", row[1].strip(), line))
+    return parameters
+
+def parse_enums(content: str) -> Dict[str, str]:
+    """Parse `code,label` rows of the enums file into a code -> label map."""
+    enums = {}
+    for line in content.strip().split('\n'):
+        code, _, label = line.partition(',')
+        if code.strip():
+            enums[code.strip()] = label.strip()
+    return enums
+
+def parse_abbreviations(content: str) -> Tuple[Tuple[str, str], ...]:
+    """Parse `abbreviation;expansion` rows of the abbreviations file."""
+    abbreviations = []
+    for line in content.strip().split('\n'):
+        abbreviation, _, expansion = line.partition(';')
+        if abbreviation.strip() and expansion.strip():
+            abbreviations.append((abbreviation.strip(), expansion.strip()))
+    return tuple(abbreviations)
+
+def normalize_analysis_type(analysis_type: str) -> str:
+    return analysis_type if analysis_type in ANALYSIS_TYPES else "standard"
+
+def parameter_category(spec: ParameterSpec) -> str:
+    """Category prefix of an extended parameter name ("Antropometrické údaje-Výška")."""
+    category, separator, _ = spec.name.partition('-')
+    return category.strip() if separator else ""
+
+def references_enums(spec: ParameterSpec) -> bool:
+    """Whether the parameter needs the MKN code list from enums.txt."""
+    return "mkn" in (spec.name + " " + spec.value_format).lower()
+
+def shard_parameters(parameters: List[ParameterSpec], max_parameters: int = SHARD_MAX_PARAMETERS) -> List[List[int]]:
+    """Group parameter indexes into shards of whole categories.
+
+    Consecutive categories are packed together up to max_parameters; a
+    category larger than that is split into evenly sized pieces.
+    """
+    categories: List[List[int]] = []
+    for index, spec in enumerate(parameters):
+        if categories and parameter_category(parameters[categories[-1][0]]) == parameter_category(spec):
+            categories[-1].append(index)
+        else:
+            categories.append([index])
+
+    shards: List[List[int]] = []
+    for indexes in categories:
+        if len(indexes) > max_parameters:
+            pieces = -(-len(indexes) // max_parameters)
+            size = -(-len(indexes) // pieces)
+            shards.extend(indexes[i:i + size] for i in range(0, len(indexes), size))
+        elif shards and len(shards[-1]) + len(indexes) <= max_parameters:
+            shards[-1].extend(indexes)
+        else:
+            shards.append(list(indexes))
+    return shards
+
+def _render_parts(template: str, data: Dict[str, str]) -> PromptParts:
+    prefix, suffix = template.format(**data, combined_text=_COMBINED_TEXT_MARKER).split(_COMBINED_TEXT_MARKER, 1)
+    return PromptParts(prefix, suffix)
+
+class PromptRegistry:
+    """In-process cache of the prompt template and data files.
+
+    The template is rendered once per analysis type with everything except the
+    document text, so each request only splices in the numbered text. Files are
+    re-read when their mtime changes (checked at most every PROMPT_RELOAD_INTERVAL).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._signature = None
+        self._checked_at = 0.0
+        self._data: Dict[str, Dict[str, str]] = {}
+        self._parts: Dict[str, PromptParts] = {}
+        self._parameters: Dict[str, List[ParameterSpec]] = {}
+        self._shards: Dict[str, List[PromptShard]] = {}
+        self._template = ""
+        self._enums: Dict[str, str] = {}
+        self._abbreviations: Tuple[Tuple[str, str], ...] = ()
+
+    def _file_signature(self) -> Tuple:
+        paths = [PROMPT_TEMPLATE_PATH] + sorted(glob.glob(os.path.join(PROMPT_DATA_DIR, "*.txt")))
+        return tuple((path, os.stat(path).st_mtime_ns) for path in paths)
+
+    def _ensure_loaded(self):
+        now = time.monotonic()
+        if self._signature is not None and now - self._checked_at < PROMPT_RELOAD_INTERVAL:
+            return
+
+        with self._lock:
+            signature = self._file_signature()
+            self._checked_at = now
+            if signature != self._signature:
+                with span("prompt_load"):
+                    self._load()
+                self._signature = signature
+
+    def _load(self):
+        template = load_template()
+        files = {}
+        for file_path in glob.glob(os.path.join(PROMPT_DATA_DIR, "*.txt")):
+            var_name = os.path.splitext(os.path.basename(file_path))[0]
+            with open(file_path, 'r', encoding='utf-8') as file:
+                files[var_name] = file.read()
+
+        data, parts, parameters, shards = {}, {}, {}, {}
+        for analysis_type in ANALYSIS_TYPES:
+            type_data = {name: content for name, content in files.items() if name != "parameters_extended"}
+            if analysis_type == "extended":
+                type_data["parameters"] = files.get("parameters_extended", "")
+
+            data[analysis_type] = type_data
+            parts[analysis_type] = _render_parts(template, type_data)
+            parameters[analysis_type] = parse_parameters(type_data.get("parameters", ""))
+            shards[analysis_type] = [
+                self._render_shard(template, type_data, parameters[analysis_type], indexes)
+                for indexes in shard_parameters(parameters[analysis_type])
+            ]
+
+        self._data, self._parts, self._parameters, self._shards = data, parts, parameters, shards
+        self._template = template
+        self._enums = parse_enums(files.get("enums", ""))
+        self._abbreviations = parse_abbreviations(files.get("abbreviations", ""))
+
+    @staticmethod
+    def _render_shard(template: str, data: Dict[str, str], parameters: List[ParameterSpec], indexes: List[int]) -> PromptShard:
+        specs = [parameters[i] for i in indexes]
+        shard_data = dict(data)
+        shard_data["parameters"] = "\n".join(spec.source_line for spec in specs)
+        # Only shards with MKN parameters need the code list
+        if not any(references_enums(spec) for spec in specs):
+            shard_data["enums"] = ""
+        return PromptShard(indexes, specs, _render_parts(template, shard_data))
+
+    def load(self):
+        """Load (or reload) all prompt files now."""
+        self._signature = None
+        self._ensure_loaded()
+
+    def ensure_loaded(self):
+        """Load the prompt files unless they are already loaded and unchanged (e.g. preloaded before fork)."""
+        self._ensure_loaded()
+
+    def data(self, analysis_type: str = "standard") -> Dict[str, str]:
+        self._ensure_loaded()
+        return dict(self._data[normalize_analysis_type(analysis_type)])
+
+    def prompt_parts(self, analysis_type: str = "standard") -> PromptParts:
+        self._ensure_loaded()
+        return self._parts[normalize_analysis_type(analysis_type)]
+
+    def parameters(self, analysis_type: str = "standard") -> List[ParameterSpec]:
+        self._ensure_loaded()
+        return self._parameters[normalize_analysis_type(analysis_type)]
+
+    def shards(self, analysis_type: str = "standard") -> List[PromptShard]:
+        self._ensure_loaded()
+        return self._shards[normalize_analysis_type(analysis_type)]
+
+    def enums(self) -> Dict[str, str]:
+        self._ensure_loaded()
+        return self._enums
+
+    def abbreviations(self) -> Tuple[Tuple[str, str], ...]:
+        self._ensure_loaded()
+        return self._abbreviations
+
+    def subset_parts(self, analysis_type: str, parameters: List[ParameterSpec], enums: Optional[str] = None) -> PromptParts:
+        """Render the template for only the given parameters (and optionally a reduced enums text)."""
+        self._ensure_loaded()
+        data = dict(self._data[normalize_analysis_type(analysis_type)])
+        data["parameters"] = "\n".join(spec.source_line for spec in parameters)
+        if enums is not None:
+            data["enums"] = enums
+        return _render_parts(self._template, data)
+
+    def subset_shard(self, analysis_type: str, indexes: List[int]) -> PromptShard:
+        """A shard prompt for the given parameter indexes, like the pre-rendered shards."""
+        self._ensure_loaded()
+        analysis_type = normalize_analysis_type(analysis_type)
+        return self._render_shard(self._template, self._data[analysis_type], self._parameters[analysis_type], indexes)
+
+    def render_subset(self, numbered_text: str, analysis_type: str, parameters: List[ParameterSpec], enums: Optional[str] = None) -> str:
+        parts = self.subset_parts(analysis_type, parameters, enums)
+        return parts.prefix + numbered_text + parts.suffix
+
+    def parameter_descriptions(self, analysis_type: str = "standard") -> Dict[str, str]:
+        """Map parameter names to their description (or value format if undescribed)."""
+        return {spec.name: spec.description or spec.value_format for spec in self.parameters(analysis_type)}
+
+prompt_registry = PromptRegistry()
+
 def load_parameters_descriptions(analysis_type: str = "standard") -> Dict[str, str]:
     """Load parameter descriptions from the parameters file."""
-    descriptions = {}
-    
     try:
-        # Only load descriptions for standard parameters
-        if analysis_type == "standard":
-            file_path = os.path.join(PROMPT_DATA_DIR, "parameters.txt")
-                
-            with open(file_path, 'r', encoding='utf-8') as file:
-                content = file.read()
-                lines = content.strip().split('\n')
-                
-                for line in lines:
-                    parts = line.split(';')
-                    if len(parts) >= 2:
-                        param_name = parts[0].strip()
-                        description = parts[1].strip()
-                        descriptions[param_name] = description
-                            
+        return prompt_registry.parameter_descriptions(analysis_type)
     except Exception as e:
         print(f"Error loading parameter descriptions: {str(e)}")
-        
-    return descriptions
+        return {}
 
 def load_all_data(analysis_type: str = "standard") -> Dict[str, str]:
-    """Dynamically load all files from the data directory"""
-    data = {}
+    """Return the contents of all files from the data directory"""
     try:
-        # Find all .txt files in the data directory
-        data_files = glob.glob(os.path.join(PROMPT_DATA_DIR, "*.txt"))
-        
-        for file_path in data_files:
-            # Extract the filename without extension to use as the variable name
-            var_name = os.path.splitext(os.path.basename(file_path))[0]
-            
-            # Skip the extended parameters file if we're using standard analysis
-            if var_name == "parameters_extended" and analysis_type == "standard":
-                continue
-                
-            # Read the file content
-            with open(file_path, 'r', encoding='utf-8') as file:
-                # If this is the parameters file and we're using extended analysis, use the extended version instead
-                if var_name == "parameters" and analysis_type == "extended":
-                    with open(os.path.join(PROMPT_DATA_DIR, "parameters_extended.txt"), 'r', encoding='utf-8') as file:
-                        data[var_name] = file.read()
-                else:
-                    data[var_name] = file.read()
-                
+        return prompt_registry.data(analysis_type)
     except Exception as e:
         print(f"Error loading data files: {str(e)}")
-    
-    return data
+        return {}
+
+def number_lines(texts: List[str]) -> str:
+    """Combine the document texts and prepend 1-based line numbers"""
+    lines = "\n\n".join(texts).split('\n')
+    return '\n'.join(f"{i+1}: {line}" for i, line in enumerate(lines))
+
+def render_prompt(numbered_text: str, analysis_type: str = "standard") -> str:
+    """Splice already numbered text into the pre-rendered template"""
+    parts = prompt_registry.prompt_parts(analysis_type)
+    return parts.prefix + numbered_text + parts.suffix
 
 def create_prompt(texts: List[str], analysis_type: str = "standard") -> str:
     """Create the final prompt by combining the template with all data files"""
-    # Combine the document texts
-    combined_text = "\n\n".join(texts)
-    
-    # Add line numbers to the combined text
-    lines = combined_text.split('\n')
-    numbered_lines = [f"{i+1}: {line}" for i, line in enumerate(lines)]
-    numbered_combined_text = '\n'.join(numbered_lines)
-    
-    # Load the template and all data files
-    template = load_template()
-    data = load_all_data(analysis_type)
-    
-    # Add the numbered combined text to the data
-    data['combined_text'] = numbered_combined_text
-    
-    # Format the template with all variables
-    return template.format(**data)
\ No newline at end of file
+    with span("prompt_build"):
+        return render_prompt(number_lines(texts), analysis_type)
+
+def is_sharded(analysis_type: str) -> bool:
+    return normalize_analysis_type(analysis_type) in SHARDED_ANALYSIS_TYPES
+
+def create_shard_prompts(texts: List[str], analysis_type: str = "standard") -> List[str]:
+    """Create one prompt per parameter shard (see shard_parameters)"""
+    with span("prompt_build"):
+        numbered_text = number_lines(texts)
+        return [shard.parts.prefix + numbered_text + shard.parts.suffix for shard in prompt_registry.shards(analysis_type)]
@@ -0,0 +1,155 @@
+import os
+import re
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Set, Tuple
+from app.prompt import ParameterSpec
+from app.text import fold
+
+# Pre-LLM retrieval: only lines that mention a parameter (plus context) are sent
+RELEVANCE_ENABLED = os.getenv("RELEVANCE_ENABLED", "true").lower() == "true"
+# Shorter documents are sent whole; selection saves little on them
+RELEVANCE_MIN_TOKENS = int(os.getenv("RELEVANCE_MIN_TOKENS", "2000"))
+# Lines kept around every matching line, and always kept at the start (header, demographics)
+RELEVANCE_CONTEXT_LINES = int(os.getenv("RELEVANCE_CONTEXT_LINES", "1"))
+RELEVANCE_HEAD_LINES = int(os.getenv("RELEVANCE_HEAD_LINES", "15"))
+# Recall budget: fall back to the full text when the selection would keep more
+# than this share of the lines (little to save) or when fewer than
+# RELEVANCE_MIN_COVERAGE of the parameters match any line (the index is missing them)
+RELEVANCE_MAX_SHARE = float(os.getenv("RELEVANCE_MAX_SHARE", "0.6"))
+RELEVANCE_MIN_COVERAGE = float(os.getenv("RELEVANCE_MIN_COVERAGE", "0.3"))
+
+# Words are compared by their first STEM_CHARS folded letters, without a final
+# vowel on short words, which absorbs most Czech inflection (výška/výšky,
+# alergie/alergická) while keeping stems apart (převaz/previous)
+STEM_CHARS = 5
+# Replaces each run of omitted lines, so the model sees the text is not contiguous
+GAP_MARKER = "[...]"
+
+# Folded words of parameter names, descriptions and formats that say nothing about the content
+STOPWORDS = frozenset("""
+a i k o s u v z na do od po pro pri se ve ze za je jsou nebo ani jen jako pokud dle
+jiny jina jine jiného jineho komentar specifikace typ datum text cislo ano ne nezname neznamo udaj
+udaje neni dispozici vyber moznost moznosti pridani vlastniho vice ciselnik ciselniku ciselniky
+nespecifikovano pocet hodnota popis upresneni volitelny rok rrrr pacient pacienta pacientka pacients
+the of and or if in to for from with by as on is be it not any this that you don dont try find
+found calculate metric metrics patient patients person question measured first date
+""".split())
+
+_WORD = re.compile(r"[^\W\d_]+")
+
+class Selection(NamedTuple):
+    """Lines of a numbered text chosen for one parameter group."""
+    text: str
+    applied: bool
+    kept_lines: int
+    total_lines: int
+    # Share of the parameters (with index terms) matching at least one line; None if not indexed
+    coverage: Optional[float]
+
+    def report(self) -> Dict[str, object]:
+        return {"applied": self.applied, "kept_lines": self.kept_lines, "total_lines": self.total_lines, "coverage": round(self.coverage, 3) if self.coverage is not None else None}
+
+def stem(word: str) -> str:
+    if 3 < len(word) <= STEM_CHARS and word[-1] in "aeiouy":
+        return word[:-1]
+    return word[:STEM_CHARS]
+
+def stems(text: str, min_length: int = 1) -> Set[str]:
+    return {stem(word) for word in _WORD.findall(fold(text)) if len(word) >= min_length and word not in STOPWORDS}
+
+class Terms(NamedTuple):
+    """Stems that mark a line as evidence for a parameter: any one strong
+    term, or at least two weak ones."""
+    strong: FrozenSet[str]
+    weak: FrozenSet[str]
+
+@lru_cache(maxsize=4096)
+def parameter_terms(spec: ParameterSpec, abbreviations: Tuple[Tuple[str, str], ...]) -> Terms:
+    """Index terms of a parameter.
+
+    Strong: the words of the name (two letters or more: cT, pN, RT) and the
+    abbreviations from abbreviations.txt whose expansion at least half
+    matches the parameter. Weak: the longer words of the description and
+    value format, and the expansions of abbreviations used in the name.
+    """
+    strong = stems(spec.name, 2)
+    weak = stems(spec.description, 5) | stems(spec.value_format, 5)
+    name_words = set(_WORD.findall(fold(spec.name)))
+    for abbreviation, expansion in abbreviations:
+        folded = fold(abbreviation).strip(". ")
+        expansion_stems = stems(expansion, 3)
+        if folded in name_words:
+            weak |= expansion_stems
+        elif expansion_stems and len(folded) >= 2 and 2 * len(expansion_stems & (strong | weak)) >= len(expansion_stems):
+            strong.add(stem(folded))
+    return Terms(frozenset(strong), frozenset(weak - strong))
+
+class LineIndex:
+    """Inverted index of a numbered text: word stem -> indexes of the lines containing it."""
+
+    def __init__(self, numbered_text: str):
+        self.lines = numbered_text.split("\n")
+        self.postings: Dict[str, List[int]] = {}
+        for index, line in enumerate(self.lines):
+            # Skip the "N: " prefix; numbers are not indexed anyway
+            content = line.partition(": ")[2]
+            for stem in stems(content):
+                self.postings.setdefault(stem, []).append(index)
+
+    def matches(self, terms: Terms) -> Set[int]:
+        found: Set[int] = set()
+        for term in terms.strong:
+            found.update(self.postings.get(term, ()))
+        weak_hits = Counter(line for term in terms.weak for line in self.postings.get(term, ()))
+        found.update(line for line, count in weak_hits.items() if count >= 2)
+        return found
+
+@lru_cache(maxsize=8)
+def line_index(numbered_text: str) -> LineIndex:
+    """Built once per document and reused by every shard and retry of the request."""
+    return LineIndex(numbered_text)
+
+def full_text(numbered_text: str) -> Selection:
+    lines = numbered_text.count("\n") + 1
+    return Selection(numbered_text, False, lines, lines, None)
+
+def select_lines(numbered_text: str, parameters: List[ParameterSpec], abbreviations: Tuple[Tuple[str, str], ...]) -> Selection:
+    """Keep the lines matching any of the parameters, with context, in original order.
+
+    Line numbers are kept as they are, so LINE_REFERENCE values stay valid
+    for the full document. Returns the full text (applied=False) when the
+    selection falls outside the recall budget.
+    """
+    index = line_index(numbered_text)
+    total = len(index.lines)
+    hits: Set[int] = set()
+    with_terms = matched = 0
+    for spec in parameters:
+        terms = parameter_terms(spec, abbreviations)
+        if not terms.strong and len(terms.weak) < 2:
+            continue
+        with_terms += 1
+        found = index.matches(terms)
+        if found:
+            matched += 1
+            hits |= found
+    coverage = matched / with_terms if with_terms else 0.0
+
+    keep = set(range(min(RELEVANCE_HEAD_LINES, total)))
+    for hit in hits:
+        keep.update(range(max(hit - RELEVANCE_CONTEXT_LINES, 0), min(hit + RELEVANCE_CONTEXT_LINES + 1, total)))
+
+    if coverage < RELEVANCE_MIN_COVERAGE or len(keep) > total * RELEVANCE_MAX_SHARE:
+        return Selection(numbered_text, False, total, total, coverage)
+
+    selected: List[str] = []
+    previous = -1
+    for line in sorted(keep):
+        if line != previous + 1:
+            selected.append(GAP_MARKER)
+        selected.append(index.lines[line])
+        previous = line
+    if previous != total - 1:
+        selected.append(GAP_MARKER)
+    return Selection("\n".join(selected), True, len(keep), total, coverage)
@@ -0,0 +1,59 @@
+import csv
+import io
+from typing import Iterable, List, NamedTuple, Optional
+
+class ResponseRow(NamedTuple):
+    parameter: str
+    value: str
+    line_reference: str
+
+    @property
+    def found(self) -> bool:
+        return bool(self.value) and self.line_reference not in ("", "0")
+
+def parse_response_rows(response: str, parameter_names: Optional[Iterable[str]] = None) -> List[ResponseRow]:
+    """Parse PARAMETER_NAME,EXTRACTED_VALUE,LINE_REFERENCE rows from a completion.
+
+    Values may be double-quoted to contain commas. If parameter_names is given,
+    names that themselves contain commas are recognised as a line prefix.
+    Markdown code fences and lines without a value column are skipped.
+    """
+    # Longest first so "X, komentář" wins over "X"
+    known_names = sorted(
+        (name for name in (parameter_names or []) if ',' in name),
+        key=len,
+        reverse=True,
+    )
+    rows = []
+
+    for line in response.strip().split('\n'):
+        line = line.strip()
+        if not line or line.startswith('```'):
+            continue
+
+        name = next((known for known in known_names if line.startswith(known + ',')), None)
+        if name is not None:
+            parts = [name] + _split_csv_line(line[len(name) + 1:])
+        else:
+            parts = _split_csv_line(line)
+
+        if len(parts) < 2:
+            continue
+        if len(parts) > 3:
+            # Unquoted commas inside the value: the line reference is the last column
+            parts = [parts[0], ', '.join(parts[1:-1]), parts[-1]]
+        line_reference = parts[2].strip() if len(parts) == 3 else "0"
+        rows.append(ResponseRow(parts[0].strip().strip('"'), parts[1].strip(), line_reference or "0"))
+
+    return rows
+
+def _split_csv_line(line: str) -> List[str]:
+    return next(csv.reader([line], skipinitialspace=True), [])
+
+def format_response_rows(rows: List[ResponseRow]) -> str:
+    """Render rows back into the CSV text format the frontend expects."""
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator='\n')
+    for row in rows:
+        writer.writerow([row.parameter, row.value, row.line_reference])
+    return output.getvalue().rstrip('\n')
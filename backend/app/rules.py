@@ -0,0 +1,267 @@
+import os
+import re
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from app.prompt import ParameterSpec, parameter_category, prompt_registry
+from app.response_parser import ResponseRow
+from app.text import fold, trie_regex
+from app.validation import FieldSchema, get_schemas
+
+# Deterministic extraction of regular parameters before the LLM call; only
+# the parameters the rules leave unresolved are sent to the model
+RULES_ENABLED = os.getenv("RULES_ENABLED", "true").lower() == "true"
+
+# Whitespace within one line; rules never match across line breaks
+_SP = r"[^\S\n]*"
+_NUMBER = r"\d{1,3}(?:[.,]\d+)?"
+_DATE = r"\d{1,2}\.[^\S\n]*\d{1,2}\.[^\S\n]*\d{4}|\d{4}-\d{1,2}-\d{1,2}"
+
+# Patterns over folded text (no diacritics, lower case), one value group each;
+# all of them start at a word boundary (_WORD_START is shared by the alternation)
+_WORD_START = r"(?<![a-z0-9])"
+_HEIGHT = rf"(?:vysk[ay]|vysce|tv){_SP}[:=]?{_SP}(?P<v>{_NUMBER}){_SP}cm(?![a-z])"
+_WEIGHT = rf"(?:hmotnost[i]?|vah[ay]|hm\.|th){_SP}[:=]?{_SP}(?P<v>{_NUMBER}){_SP}kg(?![a-z])"
+_BMI = rf"bmi{_SP}[:=]?{_SP}(?P<v>\d{{1,2}}(?:[.,]\d+)?)(?![\d])"
+_ECOG = rf"ecog(?:{_SP}ps)?{_SP}[:=]?{_SP}(?P<v>[0-5])(?![\d])"
+# The masculine "pacient" is also the generic form ("Pacient/ka poučen/a"), so only
+# an explicit label or a feminine form is a sex signal
+_SEX = rf"(?P<v>pacient(?:ka|ky|ku|kou|ce|ek|kam|kach|kami)|pohlavi{_SP}[:=]?{_SP}(?:muz|zena))(?![a-z])"
+_MKN = r"(?P<v>[a-z]\d{2}(?:\.\d{1,2})?)(?![\d])"
+# TNM components only count in a TNM context, so abbreviations such as PTX
+# (paclitaxel), CTx (chemotherapy) or "CT0 hrudníku" are not read as stages:
+# a prefixed sequence of at least two categories (cT2 N1 M0, pT1cN0, ypT2 ypN0)
+# or any components right after a TNM/stage label ("TNM: pN1")
+_TNM_VALUES = {"t": r"(?:x|is|[0-4][a-d]?)", "n": r"(?:x|[0-3][a-c]?)", "m": r"(?:x|[01][a-d]?)"}
+_TNM_SEP = r"[^\S\n]*,?[^\S\n]*"
+
+def _tnm_component(category: str, prefixed: bool) -> str:
+    return (r"y?[cp]" if prefixed else r"(?:y?[cp])?") + category + _TNM_VALUES[category]
+
+_TNM_SEQUENCE = (
+    _tnm_component("t", True)
+    + rf"(?:{_TNM_SEP}{_tnm_component('n', False)}(?:{_TNM_SEP}{_tnm_component('m', False)})?|{_TNM_SEP}{_tnm_component('m', False)})"
+    + rf"|{_tnm_component('n', True)}{_TNM_SEP}{_tnm_component('m', False)}"
+)
+_TNM_LIST = (
+    rf"(?:{_tnm_component('t', False)}|{_tnm_component('n', False)}|{_tnm_component('m', False)})"
+    rf"(?:{_TNM_SEP}(?:{_tnm_component('t', False)}|{_tnm_component('n', False)}|{_tnm_component('m', False)}))*"
+)
+_TNM_LABELS = ("tnm", "staging", "stadium")
+# The label stays inside the value; _TNM_PART only picks the components out of it
+_TNM = (
+    rf"(?P<v>(?:{'|'.join(_TNM_LABELS)})(?:{_SP}klasifikace)?{_SP}[:=]?{_SP}{_TNM_LIST}"
+    rf"|{_TNM_SEQUENCE})(?![a-z0-9])"
+)
+_TNM_PART = re.compile(r"(y?[cp])?([tnm])(x|is|[0-4][a-d]?)")
+
+_VALUE_PATTERNS = {
+    "date": _DATE,
+    "year": r"\d{4}",
+    "number": r"\d+(?:[.,]\d+)?",
+    "integer": r"\d+",
+    "ecog": r"[0-5]",
+}
+
+class Candidate(NamedTuple):
+    value: str
+    line: int
+
+class Rule(NamedTuple):
+    """A pattern and how its matches become (parameter index, value) pairs."""
+    pattern: str
+    # Folded match of the value group -> [(parameter index, value)]
+    convert: Callable[[str], List[Tuple[int, str]]]
+    # Literal starts of the pattern; the pattern is only tried where one occurs
+    triggers: Tuple[str, ...]
+    # "first" takes the first match (first measured height, weight, ECOG);
+    # "unique" resolves only when every match agrees
+    policy: str = "unique"
+
+def _field(spec: ParameterSpec) -> str:
+    """Folded field name without the category prefix of extended parameters."""
+    name = spec.name
+    category = parameter_category(spec)
+    if category:
+        name = name.split('-', 1)[1]
+    return " ".join(fold(name).strip(" :").split())
+
+def _number(value: str) -> str:
+    return value.replace(",", ".")
+
+class RuleEngine:
+    """All rules of one parameter list compiled into a single alternation.
+
+    The folded numbered text is scanned once; each match is routed to its
+    rule by the name of the group that matched.
+    """
+
+    def __init__(self, parameters: List[ParameterSpec], schemas: List[FieldSchema], enums: Dict[str, str]):
+        fields = [_field(spec) for spec in parameters]
+        # Parameters whose field name repeats ("Specifikace", "Datum zahájení") are left to the model
+        unique = {field: index for index, field in enumerate(fields) if fields.count(field) == 1}
+        self.enums = enums
+        self.rules: List[Rule] = []
+        self.bmi_index = unique.get("bmi")
+        self.height_index = unique.get("vyska")
+        self.weight_index = unique.get("hmotnost")
+        handled = set()
+
+        def single(index: Optional[int], transform: Callable[[str], str] = lambda value: value):
+            return lambda match: [(index, transform(match))]
+
+        for index, pattern, triggers in (
+            (self.height_index, _HEIGHT, ("vysk", "vysc", "tv")),
+            (self.weight_index, _WEIGHT, ("hmot", "vah", "hm.", "th")),
+            (self.bmi_index, _BMI, ("bmi",)),
+        ):
+            if index is not None:
+                self.rules.append(Rule(pattern, single(index, _number), triggers, "first"))
+                handled.add(index)
+
+        sex_index = unique.get("pohlavi")
+        if sex_index is not None and schemas[sex_index].type == "choice":
+            options = {fold(option): option for option in schemas[sex_index].options}
+            male, female = options.get("muz"), options.get("zena")
+            if male and female:
+                self.rules.append(Rule(
+                    _SEX, single(sex_index, lambda match: male if match.endswith("muz") else female), ("pacient", "pohlavi"),
+                ))
+                handled.add(sex_index)
+
+        ecog_index = next((index for field, index in unique.items() if "ecog" in field and schemas[index].type == "ecog"), None)
+        if ecog_index is not None:
+            self.rules.append(Rule(_ECOG, single(ecog_index), ("ecog",), "first"))
+            handled.add(ecog_index)
+
+        mkn_index = next((index for field, index in unique.items() if re.fullmatch(r"(?:.*- )?kod mkn(?:-10)?", field)), None)
+        if mkn_index is not None and enums:
+            self.rules.append(Rule(_MKN, self._mkn(mkn_index), tuple(sorted({code[0].lower() for code in enums}))))
+            handled.add(mkn_index)
+
+        tnm_indexes = {field: index for field, index in unique.items() if field in ("ct", "cn", "cm", "pt", "pn", "pm")}
+        if tnm_indexes:
+            self.rules.append(Rule(_TNM, self._tnm(tnm_indexes), ("c", "p", "y") + _TNM_LABELS))
+            handled.update(tnm_indexes.values())
+
+        # Generic "<parameter name>: <value>" labels, typed by the format column
+        for field, index in unique.items():
+            if index in handled or len(field) < 4:
+                continue
+            value = self._value_pattern(schemas[index])
+            if value is None:
+                continue
+            words = field.split()
+            label = r"\s+".join(re.escape(word) for word in words)
+            self.rules.append(Rule(rf"{label}{_SP}[:=]?{_SP}(?P<v>{value})(?![a-z0-9])", self._labelled(index, schemas[index]), (words[0],)))
+
+        self.pattern = self.trigger = None
+        if self.rules:
+            self.pattern = re.compile(_WORD_START + "(?:" + "|".join(
+                f"(?P<r{number}>{rule.pattern.replace('(?P<v>', f'(?P<r{number}v>')})" for number, rule in enumerate(self.rules)
+            ) + ")")
+            # The alternation is only tried at word starts beginning with a trigger,
+            # found by one trie-shaped scan, instead of at every position of the text
+            self.trigger = re.compile(_WORD_START + trie_regex(trigger for rule in self.rules for trigger in rule.triggers))
+
+    @staticmethod
+    def _value_pattern(schema: FieldSchema) -> Optional[str]:
+        if schema.type == "choice" and not schema.multiple:
+            labels = {fold(option.split("(")[0]).strip() for option in schema.options} | {fold(option) for option in schema.options}
+            return "|".join(re.escape(label) for label in sorted(labels, key=len, reverse=True) if label)
+        return _VALUE_PATTERNS.get(schema.type)
+
+    @staticmethod
+    def _labelled(index: int, schema: FieldSchema) -> Callable[[str], List[Tuple[int, str]]]:
+        if schema.type != "choice":
+            return lambda match: [(index, " ".join(match.split()))]
+        options = {}
+        for option in schema.options:
+            options[fold(option)] = option
+            options.setdefault(fold(option.split("(")[0]).strip(), option)
+        return lambda match: [(index, options[match])]
+
+    def _mkn(self, index: int) -> Callable[[str], List[Tuple[int, str]]]:
+        def convert(match: str) -> List[Tuple[int, str]]:
+            code = match.upper()
+            # Only codes from the oncology code list; other diagnoses (I10, E11) are ignored
+            return [(index, code)] if code[:3] in self.enums else []
+        return convert
+
+    @staticmethod
+    def _tnm(indexes: Dict[str, int]) -> Callable[[str], List[Tuple[int, str]]]:
+        def convert(match: str) -> List[Tuple[int, str]]:
+            values, prefix = [], ""
+            for part_prefix, category, value in _TNM_PART.findall(match):
+                prefix = part_prefix or prefix
+                field = prefix[-1:] + category
+                if field in indexes:
+                    values.append((indexes[field], "X" if value == "x" else value))
+            return values
+        return convert
+
+    def extract(self, numbered_text: str) -> Dict[int, ResponseRow]:
+        """Resolved parameters by index, with the line number of their evidence."""
+        if self.pattern is None:
+            return {}
+        folded = fold(numbered_text)
+        candidates: Dict[int, List[Candidate]] = {}
+        policies: Dict[int, str] = {}
+        position = 0
+        while True:
+            hit = self.trigger.search(folded, position)
+            if hit is None:
+                break
+            match = self.pattern.match(folded, hit.start())
+            if match is None:
+                position = hit.start() + 1
+                continue
+            position = max(match.end(), hit.start() + 1)
+            rule_number = int(match.lastgroup[1:])
+            rule = self.rules[rule_number]
+            line_start = folded.rfind("\n", 0, match.start()) + 1
+            line = folded[line_start:folded.find(":", line_start)]
+            if not line.isdigit():
+                continue
+            for index, value in rule.convert(match.group(f"r{rule_number}v")):
+                candidates.setdefault(index, []).append(Candidate(value, int(line)))
+                policies[index] = rule.policy
+
+        resolved: Dict[int, ResponseRow] = {}
+        for index, found in candidates.items():
+            if policies[index] == "unique" and len({candidate.value for candidate in found}) > 1:
+                continue
+            resolved[index] = ResponseRow("", found[0].value, str(found[0].line))
+
+        self._compute_bmi(resolved)
+        return resolved
+
+    def _compute_bmi(self, resolved: Dict[int, ResponseRow]):
+        """BMI from height and weight when the text does not state it."""
+        if self.bmi_index is None or self.bmi_index in resolved:
+            return
+        height, weight = resolved.get(self.height_index), resolved.get(self.weight_index)
+        if height is None or weight is None:
+            return
+        meters = float(height.value) / 100
+        if meters <= 0:
+            return
+        lines = sorted({int(height.line_reference), int(weight.line_reference)})
+        resolved[self.bmi_index] = ResponseRow("", f"{float(weight.value) / meters ** 2:.1f}", ", ".join(map(str, lines)))
+
+_engines: Dict[str, Tuple[List[ParameterSpec], RuleEngine]] = {}
+
+def get_rule_engine(analysis_type: str) -> RuleEngine:
+    """Compiled once per analysis type, rebuilt when the prompt registry reloads."""
+    parameters, schemas = get_schemas(analysis_type)
+    cached = _engines.get(analysis_type)
+    if cached is None or cached[0] is not parameters:
+        cached = (parameters, RuleEngine(parameters, schemas, prompt_registry.enums()))
+        _engines[analysis_type] = cached
+    return cached[1]
+
+def extract_rules(numbered_text: str, analysis_type: str = "standard") -> Dict[int, ResponseRow]:
+    """Parameters resolved by the rules, by parameter index, with their names filled in."""
+    parameters = prompt_registry.parameters(analysis_type)
+    return {
+        index: row._replace(parameter=parameters[index].name)
+        for index, row in sorted(get_rule_engine(analysis_type).extract(numbered_text).items())
+    }
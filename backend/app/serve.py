@@ -0,0 +1,176 @@
+"""Prefork process manager: several uvicorn workers on one listening socket.
+
+The master imports the app once (names automaton, prompt registry, model
+list, static token counts) and forks the workers, which share that memory
+copy-on-write instead of each reloading the names file and re-fetching
+models. Crashed workers are replaced. SIGTERM/SIGINT are forwarded to the
+workers, which stop accepting connections, finish running requests, jobs
+and LLM calls within SHUTDOWN_DRAIN_TIMEOUT and exit.
+
+Caches, jobs, the model list and the provider rate limit are shared through
+app.state (SQLite on one host, Redis across hosts). Counters and histograms
+are summed over the workers through snapshot files in METRICS_MULTIPROC_DIR
+(a temporary directory unless set), so /metrics and /api/cache-stats report
+the same totals whichever worker answers.
+
+Usage (from backend/):
+    python -m app.serve --workers 4 --host 0.0.0.0 --port 8000
+"""
+import argparse
+import asyncio
+import gc
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import time
+from typing import Dict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", str(os.cpu_count() or 1)))
+# Workers failing faster than this are not respawned in a tight loop
+RESPAWN_MIN_INTERVAL = 1.0
+
+def _divide_pools(workers: int):
+    """Split the CPU and OCR pools between workers unless they are configured explicitly."""
+    share = str(max((os.cpu_count() or 1) // workers, 1))
+    os.environ.setdefault("CPU_WORKERS", share)
+    os.environ.setdefault("OCR_WORKERS", share)
+
+async def _preload():
+    from app.llm_service import DEFAULT_MODEL, close_session, refresh_available_models, warm_token_counts
+    await refresh_available_models()
+    await warm_token_counts(DEFAULT_MODEL)
+    await close_session()
+
+def _metrics_dir() -> bool:
+    """Point the workers at a metrics snapshot directory; True if it is a temporary one."""
+    path = os.environ.get("METRICS_MULTIPROC_DIR")
+    if not path:
+        os.environ["METRICS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="rakathon-metrics-")
+        return True
+    # Totals restart with the server: snapshots of a previous run must not be added in
+    os.makedirs(path, exist_ok=True)
+    for name in os.listdir(path):
+        if name.endswith((".json", ".tmp")):
+            os.remove(os.path.join(path, name))
+    return False
+
+def _bind(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+def _run_worker(sock: socket.socket, log_level: str):
+    import uvicorn
+    from app.main import SHUTDOWN_DRAIN_TIMEOUT, app
+
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+        signal.signal(signum, signal.SIG_DFL)
+    config = uvicorn.Config(app, log_level=log_level, timeout_graceful_shutdown=SHUTDOWN_DRAIN_TIMEOUT)
+    uvicorn.Server(config).run(sockets=[sock])
+
+def _spawn(sock: socket.socket, log_level: str) -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            _run_worker(sock, log_level)
+        except BaseException as e:
+            print(f"Error in worker {os.getpid()}: {str(e)}")
+            code = 1
+        finally:
+            sys.stdout.flush()
+            os._exit(code)
+    return pid
+
+def serve(host: str, port: int, workers: int, log_level: str = "info"):
+    _divide_pools(workers)
+    # Before app.metrics is imported, which reads it
+    temporary_metrics_dir = _metrics_dir()
+    started = time.perf_counter()
+
+    # Built once here and inherited by every worker
+    from app import main
+    main.prompt_registry.load()
+    asyncio.run(_preload())
+    # Thread and process pools must not cross fork(); workers create their own
+    main.shutdown_ocr_pool()
+    main.shutdown_executors()
+    # Workers would each inherit (and report) the values recorded while preloading
+    main.registry.reset()
+    # Keep the preloaded objects out of the collector so refcount-free scans don't copy their pages
+    gc.freeze()
+
+    sock = _bind(host, port)
+    print(f"Preloaded in {time.perf_counter() - started:.2f}s, starting {workers} workers on {host}:{port}")
+
+    children: Dict[int, float] = {}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(workers):
+        children[_spawn(sock, log_level)] = time.monotonic()
+
+    # Uvicorn waits for connections and the app's shutdown hook drains jobs and
+    # LLM calls, each up to SHUTDOWN_DRAIN_TIMEOUT; after that workers are killed
+    grace = 2 * main.SHUTDOWN_DRAIN_TIMEOUT + 5
+    deadline = None
+    while children:
+        if stopping and deadline is None:
+            deadline = time.monotonic() + grace
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            if deadline is not None and time.monotonic() > deadline:
+                for pid in children:
+                    print(f"Worker {pid} did not stop within {grace:.0f}s, killing it")
+                    os.kill(pid, signal.SIGKILL)
+                deadline = float("inf")
+            time.sleep(0.2)
+            continue
+
+        spawned_at = children.pop(pid, None)
+        if spawned_at is None or stopping:
+            continue
+        print(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, starting a new one")
+        if time.monotonic() - spawned_at < RESPAWN_MIN_INTERVAL:
+            time.sleep(RESPAWN_MIN_INTERVAL)
+        children[_spawn(sock, log_level)] = time.monotonic()
+
+    sock.close()
+    if temporary_metrics_dir:
+        shutil.rmtree(os.environ["METRICS_MULTIPROC_DIR"], ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    serve(args.host, args.port, max(args.workers, 1), args.log_level)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+import os
+import json
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from app.cache import CACHE_DIR, DiskCache, RedisCache
+from app.jobs import JOBS_DIR, JobStore, RedisJobStore
+
+# Where state shared between worker processes lives: "sqlite" (files under
+# CACHE_DIR, one host) or "redis" (any Redis-compatible server, several hosts)
+STATE_BACKEND = os.getenv("STATE_BACKEND", "sqlite").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Namespace of every key, so deployments can share a server
+REDIS_PREFIX = os.getenv("REDIS_PREFIX", "rakathon")
+STATE_DB_PATH = os.path.join(CACHE_DIR, "state.sqlite3")
+
+# Takes a token from a bucket refilled at ARGV[1] tokens/s up to ARGV[2];
+# returns the seconds to wait (0 when a token was taken)
+_REDIS_TOKEN_BUCKET_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local rate, capacity = tonumber(ARGV[1]), tonumber(ARGV[2])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(now - updated, 0) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return tostring(wait)
+"""
+
+class SqliteState:
+    """Small shared values and rate-limit buckets in a SQLite file, shared by the processes of one host."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS vals (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+
+    def get_value(self, key: str):
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires FROM vals WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    def set_value(self, key: str, value, ttl: Optional[float] = None):
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO vals (key, value, expires) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires),
+            )
+
+    def take_token(self, key: str, rate: float, capacity: float) -> float:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self._conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens, updated = row if row is not None else (capacity, now)
+                tokens = min(capacity, tokens + max(now - updated, 0) * rate)
+                wait = 0.0
+                if tokens >= 1:
+                    tokens -= 1
+                else:
+                    wait = (1 - tokens) / rate
+                self._conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return wait
+
+class RedisState:
+    """SqliteState counterpart in a Redis-compatible server, shared by replicas on several hosts."""
+
+    def __init__(self, client, prefix: str):
+        self.client = client
+        self.prefix = prefix
+        self._take_token = client.register_script(_REDIS_TOKEN_BUCKET_SCRIPT)
+
+    def get_value(self, key: str):
+        value = self.client.get(f"{self.prefix}:vals:{key}")
+        return json.loads(value) if value is not None else None
+
+    def set_value(self, key: str, value, ttl: Optional[float] = None):
+        self.client.set(f"{self.prefix}:vals:{key}", json.dumps(value, ensure_ascii=False), px=int(ttl * 1000) if ttl else None)
+
+    def take_token(self, key: str, rate: float, capacity: float) -> float:
+        return float(self._take_token(keys=[f"{self.prefix}:buckets:{key}"], args=[rate, capacity]))
+
+_redis = None
+_state = None
+# Connections are not shared across fork(); objects created by another process are replaced
+_pid: Optional[int] = None
+
+def _reset_after_fork():
+    global _redis, _state, _pid
+    if _pid != os.getpid():
+        _redis, _state, _pid = None, None, os.getpid()
+
+def uses_redis() -> bool:
+    return STATE_BACKEND == "redis"
+
+def get_redis():
+    """Return the shared Redis client (redis-py is only needed for STATE_BACKEND=redis)."""
+    global _redis
+    _reset_after_fork()
+    if _redis is None:
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("STATE_BACKEND=redis requires the redis package (pip install redis)")
+        _redis = redis.Redis.from_url(REDIS_URL)
+    return _redis
+
+def get_state():
+    """Return the shared value and rate-limit store of the configured backend."""
+    global _state
+    _reset_after_fork()
+    if _state is None:
+        _state = RedisState(get_redis(), REDIS_PREFIX) if uses_redis() else SqliteState(STATE_DB_PATH)
+    return _state
+
+def open_cache(name: str, max_bytes: int, ttl: Optional[float] = None):
+    """A DiskCache under CACHE_DIR, or a RedisCache namespace, named name."""
+    if uses_redis():
+        return RedisCache(get_redis(), f"{REDIS_PREFIX}:cache:{name}", max_bytes, ttl)
+    return DiskCache(os.path.join(CACHE_DIR, f"{name}.sqlite3"), max_bytes, ttl=ttl)
+
+def open_job_store():
+    if uses_redis():
+        return RedisJobStore(get_redis(), REDIS_PREFIX)
+    return JobStore(os.path.join(JOBS_DIR, "jobs.sqlite3"))
@@ -0,0 +1,45 @@
+import re
+import unicodedata
+from typing import Dict, Iterable
+
+def fold(text: str, collapse_whitespace: bool = False) -> str:
+    """Case- and diacritic-insensitive form of text, for matching.
+
+    Whitespace is kept as is (line breaks matter to the rules), unless
+    collapse_whitespace: then runs of it become single spaces and the ends
+    are stripped, for comparing whole values.
+    """
+    folded = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c)).casefold()
+    return " ".join(folded.split()) if collapse_whitespace else folded
+
+def trie_regex(words: Iterable[str]) -> str:
+    """Regex matching any of words, shaped as a character trie.
+
+    The trie shape keeps the alternation linear to scan and makes the longest
+    word win at every position.
+    """
+    trie: Dict = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    return _trie_to_regex(trie)
+
+def _trie_to_regex(node: Dict) -> str:
+    """Render a character trie as a regex preferring the longest alternative."""
+    is_terminal = '' in node
+    branches = [re.escape(char) + _trie_to_regex(child)
+                for char, child in sorted(node.items()) if char]
+
+    if not branches:
+        return ''
+
+    if len(branches) == 1:
+        body = branches[0]
+        if is_terminal:
+            return f"(?:{body})?" if len(body) > 1 else f"{body}?"
+        return body
+
+    body = f"(?:{'|'.join(branches)})"
+    return f"{body}?" if is_terminal else body
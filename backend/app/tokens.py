@@ -0,0 +1,170 @@
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import TYPE_CHECKING, Dict, NamedTuple, Optional, Tuple
+
+if TYPE_CHECKING:
+    import tiktoken
+
+# Tokenizer per model family, matched by longest prefix
+MODEL_ENCODINGS = {
+    "gpt-3.5-turbo": "cl100k_base",
+    "gpt-4": "cl100k_base",
+    "gpt-4o": "o200k_base",
+    "gpt-4.1": "o200k_base",
+    "gpt-4.5": "o200k_base",
+    "o1": "o200k_base",
+    "o3": "o200k_base",
+    "o4": "o200k_base",
+}
+DEFAULT_ENCODING = "cl100k_base"
+# Local models use their own tokenizers; this one is only an estimate for them
+LOCAL_LLM_ENCODING = os.getenv("LOCAL_LLM_ENCODING", DEFAULT_ENCODING)
+
+MAX_CONTEXT_LENGTH = 128000
+# Context window per model, matched by longest prefix; unknown models use MAX_CONTEXT_LENGTH
+MODEL_CONTEXT_LENGTHS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-3.5-turbo-instruct": 4096,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-turbo": 128000,
+    "gpt-4-1106": 128000,
+    "gpt-4-0125": 128000,
+    "gpt-4-vision": 128000,
+    "gpt-4o": 128000,
+    "gpt-4.1": 1047576,
+    "gpt-4.5": 128000,
+    "o1": 200000,
+    "o3": 200000,
+    "o4": 200000,
+}
+LOCAL_LLM_CONTEXT_LENGTH = int(os.getenv("LOCAL_LLM_CONTEXT_LENGTH", str(MAX_CONTEXT_LENGTH)))
+# Share of the context window available for the prompt; the rest is left for the completion
+PROMPT_CONTEXT_RATIO = 0.75
+# Tokens can merge across the seam where the document is spliced into the template
+SPLICE_MARGIN_TOKENS = 8
+
+# Memoized counts: static prompt parts (few, reused by every request) and
+# recent documents (counted once per request, reused by shards and retries)
+STATIC_COUNT_CACHE_SIZE = 256
+DOCUMENT_COUNT_CACHE_SIZE = int(os.getenv("DOCUMENT_COUNT_CACHE_SIZE", "32"))
+
+def _longest_prefix(table: Dict[str, object], model: str) -> Optional[str]:
+    matches = [prefix for prefix in table if model.startswith(prefix)]
+    return max(matches, key=len) if matches else None
+
+def encoding_name(model: str, local: bool = False) -> str:
+    if local:
+        return LOCAL_LLM_ENCODING
+    prefix = _longest_prefix(MODEL_ENCODINGS, model)
+    return MODEL_ENCODINGS[prefix] if prefix else DEFAULT_ENCODING
+
+def context_length(model: str, local: bool = False) -> int:
+    if local:
+        return LOCAL_LLM_CONTEXT_LENGTH
+    prefix = _longest_prefix(MODEL_CONTEXT_LENGTHS, model)
+    return MODEL_CONTEXT_LENGTHS[prefix] if prefix else MAX_CONTEXT_LENGTH
+
+def prompt_budget(model: str, local: bool = False) -> int:
+    return int(context_length(model, local) * PROMPT_CONTEXT_RATIO)
+
+@lru_cache(maxsize=None)
+def get_encoder(name: str) -> Optional["tiktoken.Encoding"]:
+    """Return the tokenizer of an encoding (or of a model), or None if none can be loaded.
+
+    Loaded once per encoding per process. A tiktoken release without the
+    encoding (o200k_base needs tiktoken>=0.7) falls back to cl100k_base with a
+    warning, since counts for the model are then off.
+    """
+    if _longest_prefix(MODEL_ENCODINGS, name):
+        name = encoding_name(name)
+    try:
+        # Imported on first use; loading tiktoken and its BPE files is slow
+        import tiktoken
+    except ImportError:
+        print(f"Warning: tiktoken is not installed, token counts for {name} are estimated")
+        return None
+    if name not in tiktoken.list_encoding_names():
+        print(f"Warning: tiktoken {tiktoken.__version__} has no {name} encoding, counting with {DEFAULT_ENCODING} instead")
+        name = DEFAULT_ENCODING
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        print(f"Warning: could not load the {name} encoding ({str(e)[:200]}), token counts are estimated")
+        return None
+
+def effective_encoding(name: str) -> str:
+    """The encoding actually used for counting, or "estimate" (characters / 4)."""
+    encoder = get_encoder(name)
+    return encoder.name if encoder is not None else "estimate"
+
+def count_tokens(text: str, encoding: str) -> int:
+    encoder = get_encoder(encoding)
+    if encoder is None:
+        return len(text) // 4
+    # Special-token text inside documents must be counted, not rejected
+    return len(encoder.encode(text, disallowed_special=()))
+
+class TokenCountCache:
+    """Thread-safe LRU of token counts keyed by (encoding, text)."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._counts: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, text: str, encoding: str) -> Optional[int]:
+        with self._lock:
+            count = self._counts.get((encoding, text))
+            if count is not None:
+                self._counts.move_to_end((encoding, text))
+            return count
+
+    def put(self, text: str, encoding: str, count: int):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._counts[(encoding, text)] = count
+            self._counts.move_to_end((encoding, text))
+            while len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+
+static_counts = TokenCountCache(STATIC_COUNT_CACHE_SIZE)
+document_counts = TokenCountCache(DOCUMENT_COUNT_CACHE_SIZE)
+
+class TokenBudget(NamedTuple):
+    """Token accounting of one prompt: static template parts plus the document text."""
+    model: str
+    encoding: str
+    context_length: int
+    prompt_budget: int
+    static_tokens: int
+    document_tokens: int
+
+    @property
+    def prompt_tokens(self) -> int:
+        return self.static_tokens + self.document_tokens
+
+    @property
+    def available_tokens(self) -> int:
+        """Room left for document text next to the static parts."""
+        return self.prompt_budget - self.static_tokens - SPLICE_MARGIN_TOKENS
+
+    @property
+    def fits(self) -> bool:
+        return self.document_tokens <= self.available_tokens
+
+    def report(self) -> Dict[str, object]:
+        return {
+            "model": self.model,
+            "encoding": self.encoding,
+            "context_length": self.context_length,
+            "prompt_budget": self.prompt_budget,
+            "static_tokens": self.static_tokens,
+            "document_tokens": self.document_tokens,
+            "prompt_tokens": self.prompt_tokens,
+            "available_tokens": self.available_tokens,
+            "fits": self.fits,
+        }
@@ -0,0 +1,212 @@
+import re
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from app.chunking import CONFLICT_SEPARATOR, group_rows_by_parameter
+from app.prompt import ParameterSpec, prompt_registry
+from app.response_parser import ResponseRow
+from app.text import fold
+
+# Values the model uses to say "not found"; they are valid for every type
+EMPTY_VALUES = {"", "-", "n/a", "na", "none", "null", "nezjisteno", "neuvedeno"}
+
+_NUMBER = re.compile(r'^([<>~]?\s*-?\d+(?:[.,]\d+)?)\s*([^\d\s].*)?$')
+_DATE = re.compile(r'^(\d{1,2})\.\s*(\d{1,2})\.\s*(\d{4})$|^(\d{4})-(\d{1,2})-(\d{1,2})$|^(\d{1,2})[/.](\d{4})$|^(\d{4})$')
+_YEAR = re.compile(r'^(\d{4})$')
+_MKN_CODE = re.compile(r'^([A-Z]\d{2})(\.\d{1,2})?$')
+_UNIT = re.compile(r'\[([^\]]+)\]')
+_OPTION_LIST = re.compile(r'[{(\[]\s*([^{}()\[\]]*(?:\([^()]*\)[^{}()\[\]]*)*)[})\]]')
+_MULTI_MARKERS = ("více možností", "vícenásobný", "multivýběr")
+
+class FieldSchema(NamedTuple):
+    """Expected value type of one parameter, derived from its format column."""
+    type: str                      # text, number, integer, date, year, choice, mkn, ecog
+    options: Tuple[str, ...] = ()
+    unit: Optional[str] = None
+    multiple: bool = False
+
+class ValidatedRecord(NamedTuple):
+    parameter: str
+    value: str
+    normalized: object
+    line_reference: str
+    type: str
+    valid: bool
+    error: Optional[str] = None
+
+def _split_options(options_text: str) -> Tuple[str, ...]:
+    """Split an option list on commas (or slashes), ignoring separators inside parentheses."""
+    separator = '/' if '/' in options_text and ',' not in options_text else ','
+    options, current, depth = [], [], 0
+    for char in options_text:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth = max(depth - 1, 0)
+        if char == separator and depth == 0:
+            options.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+    options.append(''.join(current))
+    return tuple(option.strip() for option in options if option.strip())
+
+def derive_schema(spec: ParameterSpec) -> FieldSchema:
+    """Derive a FieldSchema from a parameter's value format (third or second column)."""
+    value_format = spec.value_format.strip()
+    lowered = value_format.lower()
+    multiple = any(marker in lowered for marker in _MULTI_MARKERS)
+
+    if lowered.startswith("datum (rrrr)"):
+        return FieldSchema("year")
+    if lowered.startswith("datum"):
+        return FieldSchema("date")
+    if lowered.startswith("integer"):
+        return FieldSchema("integer")
+    if lowered.startswith("číslo"):
+        unit = _UNIT.search(value_format)
+        return FieldSchema("number", unit=unit.group(1).strip() if unit else None)
+    if "{číselník mkn}" in lowered or "(cxx.x)" in lowered or "mkn-10" in spec.name.lower():
+        return FieldSchema("mkn", multiple=multiple)
+    if lowered.startswith("výběr z číselníku (0 -"):
+        return FieldSchema("ecog", options=tuple(re.findall(r'(?:^|[(;,]\s*)(\d)\s*-', value_format)))
+    if re.match(r'^[^\s{}()\[\],]+(/[^/{}()\[\]]+)+$', value_format):
+        # ANO/NE/údaj není k dispozici, Muž/Žena/nespecifikováno
+        return FieldSchema("choice", options=_split_options(value_format))
+
+    if lowered.startswith(("výběr", "číselník")) and "dle číselníku" not in lowered and "{číselník" not in lowered:
+        match = _OPTION_LIST.search(value_format)
+        if match:
+            options = _split_options(match.group(1))
+            # A range like {0-100} or a single option is not a closed list
+            if len(options) > 1:
+                return FieldSchema("choice", options=options, multiple=multiple)
+
+    return FieldSchema("text")
+
+def _parse_number(value: str) -> Optional[float]:
+    match = _NUMBER.match(value.strip())
+    if not match:
+        return None
+    return float(match.group(1).lstrip('<>~ ').replace(',', '.'))
+
+def _parse_date(value: str) -> Optional[str]:
+    match = _DATE.match(value.strip())
+    if not match:
+        return None
+    groups = match.groups()
+    if groups[0]:
+        day, month, year = int(groups[0]), int(groups[1]), int(groups[2])
+    elif groups[3]:
+        year, month, day = int(groups[3]), int(groups[4]), int(groups[5])
+    elif groups[6]:
+        return f"{int(groups[7]):04d}-{int(groups[6]):02d}" if 1 <= int(groups[6]) <= 12 else None
+    else:
+        return groups[8]
+
+    if not (1 <= month <= 12 and 1 <= day <= 31):
+        return None
+    return f"{year:04d}-{month:02d}-{day:02d}"
+
+def _match_option(value: str, options: Tuple[str, ...]) -> Optional[str]:
+    folded = fold(value, collapse_whitespace=True)
+    for option in options:
+        folded_option = fold(option, collapse_whitespace=True)
+        # Allow "Progrese" for "Progrese(PD)", "CR" for "Kompletní remise (CR)"
+        # and "matka" for "První linie (děti, matka, otec, vlastní sourozenci)"
+        label, _, details = folded_option.partition('(')
+        if folded in (folded_option, label.strip()) or folded in (item.strip() for item in details.rstrip(')').split(',')):
+            return option
+    return None
+
+def _validate_mkn(value: str, enums: Dict[str, str]) -> Tuple[bool, Optional[str], Optional[str]]:
+    code = value.strip().split()[0].rstrip(',;').upper() if value.strip() else ""
+    match = _MKN_CODE.match(code)
+    if not match:
+        return False, None, "expected an MKN code such as C50.4"
+    if enums and match.group(1) not in enums:
+        return False, None, f"unknown MKN code {match.group(1)}"
+    return True, code, None
+
+def validate_value(schema: FieldSchema, value: str, enums: Dict[str, str]) -> Tuple[bool, object, Optional[str]]:
+    """Check a value against its schema. Returns (valid, normalized value, error)."""
+    if fold(value, collapse_whitespace=True) in EMPTY_VALUES:
+        return True, None, None
+
+    if schema.type in ("number", "integer", "ecog") and CONFLICT_SEPARATOR in value:
+        return False, None, "conflicting values in different parts of the text"
+
+    if schema.type in ("number", "integer"):
+        number = _parse_number(value)
+        if number is None:
+            return False, None, f"expected a number{' in ' + schema.unit if schema.unit else ''}"
+        if schema.type == "integer":
+            if not number.is_integer():
+                return False, None, "expected a whole number"
+            return True, int(number), None
+        return True, number, None
+
+    if schema.type == "date":
+        date = _parse_date(value)
+        return (True, date, None) if date else (False, None, "expected a date (DD.MM.YYYY)")
+
+    if schema.type == "year":
+        match = _YEAR.match(value.strip()) or re.search(r'\b(\d{4})\b', value)
+        return (True, int(match.group(1)), None) if match else (False, None, "expected a year (YYYY)")
+
+    if schema.type == "mkn":
+        if not schema.multiple:
+            return _validate_mkn(value, enums)
+        results = [_validate_mkn(part, enums) for part in re.split(r'[,;]', value) if part.strip()]
+        errors = [error for valid, _, error in results if not valid]
+        return (False, None, errors[0]) if errors else (True, [code for _, code, _ in results], None)
+
+    if schema.type == "ecog":
+        digit = value.strip()[:1]
+        return (True, int(digit), None) if digit in schema.options else (False, None, "expected an ECOG grade 0-5")
+
+    if schema.type == "choice":
+        parts = [part for part in re.split(r'[,;]', value) if part.strip()] if schema.multiple else [value]
+        matched = [_match_option(part, schema.options) for part in parts]
+        if None in matched:
+            return False, None, f"expected one of: {', '.join(schema.options)}"
+        return True, matched if schema.multiple else matched[0], None
+
+    return True, value.strip(), None
+
+_schema_cache: Dict[str, Tuple[List[ParameterSpec], List[FieldSchema]]] = {}
+
+def get_schemas(analysis_type: str) -> Tuple[List[ParameterSpec], List[FieldSchema]]:
+    """Parameter specs and their schemas, rebuilt when the registry reloads."""
+    parameters = prompt_registry.parameters(analysis_type)
+    cached = _schema_cache.get(analysis_type)
+    if cached is None or cached[0] is not parameters:
+        cached = (parameters, [derive_schema(spec) for spec in parameters])
+        _schema_cache[analysis_type] = cached
+    return cached
+
+def validate_rows(rows: List[ResponseRow], analysis_type: str = "standard", indexes: Optional[List[int]] = None) -> List[ValidatedRecord]:
+    """Validate parsed rows against the parameter schema.
+
+    Returns one record per parameter (or per parameter index in `indexes`, for
+    a response to a parameter subset), in parameter order. Parameters missing
+    from the response are reported as invalid so they can be asked again.
+    """
+    parameters, schemas = get_schemas(analysis_type)
+    if indexes is not None:
+        parameters, schemas = [parameters[i] for i in indexes], [schemas[i] for i in indexes]
+    enums = prompt_registry.enums()
+    grouped = group_rows_by_parameter(rows, parameters)
+    records = []
+
+    for index, (spec, schema) in enumerate(zip(parameters, schemas)):
+        candidates = grouped.get(index)
+        if not candidates:
+            records.append(ValidatedRecord(spec.name, "", None, "0", schema.type, False, "missing from response"))
+            continue
+
+        row = candidates[0]
+        valid, normalized, error = validate_value(schema, row.value, enums)
+        if valid and normalized is not None and row.line_reference in ("", "0"):
+            valid, error = False, "missing line reference"
+        records.append(ValidatedRecord(spec.name, row.value, normalized, row.line_reference, schema.type, valid, error))
+
+    return records
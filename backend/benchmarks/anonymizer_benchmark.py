@@ -0,0 +1,92 @@
+"""Benchmark Anonymizer.anonymize_text against the size of the names list.
+
+Usage (from backend/):
+    python -m benchmarks.anonymizer_benchmark --sizes 100 1000 10000 50000
+"""
+import argparse
+import json
+import os
+import random
+import re
+import tempfile
+import time
+
+from app.anonymizer import Anonymizer
+
+SYLLABLES = ["no", "vá", "ko", "bar", "toš", "ad", "amí", "ro", "vá", "čip", "ča", "la",
+             "bra", "blí", "ko", "ře", "zá", "hu", "ber", "ský", "ně", "mec", "dvo", "řák"]
+FILLER = ("Pacient {name} přijat k plánované operaci. Výška 178 cm, hmotnost 82 kg. "
+          "Dg. C50.4, cT2 cN1 cM0, ECOG 1. Kontrola u MUDr. {name} za 3 týdny.\n")
+
+def make_names(count: int, seed: int = 0):
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < count:
+        names.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).upper())
+    return sorted(names)
+
+def make_document(names, lines: int, seed: int = 1) -> str:
+    rng = random.Random(seed)
+    return ''.join(FILLER.format(name=rng.choice(names).capitalize()) for _ in range(lines))
+
+def legacy_anonymize(names, text: str) -> str:
+    """The previous implementation: one regex compile and scan per name."""
+    for i, name in enumerate(names):
+        text = re.compile(re.escape(name), re.IGNORECASE).sub(f"[PERSON_{i+1}]", text)
+    return text
+
+def time_call(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 50000])
+    parser.add_argument('--lines', type=int, default=500, help='Lines per synthetic document')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--legacy-max', type=int, default=10000,
+                        help='Skip the legacy implementation above this names-list size')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        names = make_names(size)
+        document = make_document(names, args.lines)
+
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False, encoding='utf-8') as names_file:
+            names_file.write('\n'.join(names))
+        try:
+            start = time.perf_counter()
+            anonymizer = Anonymizer(names_file.name)
+            build_seconds = time.perf_counter() - start
+        finally:
+            os.unlink(names_file.name)
+
+        row = {
+            "names": size,
+            "document_chars": len(document),
+            "build_s": round(build_seconds, 4),
+            "anonymize_s": round(time_call(lambda: anonymizer.anonymize_text(document), args.repeat), 4),
+            "legacy_anonymize_s": None,
+        }
+        if size <= args.legacy_max:
+            row["legacy_anonymize_s"] = round(time_call(lambda: legacy_anonymize(names, document), 1), 4)
+        results.append(row)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'names':>8} {'doc chars':>10} {'build s':>9} {'per doc s':>10} {'legacy s':>9}")
+    for row in results:
+        legacy = "-" if row["legacy_anonymize_s"] is None else f"{row['legacy_anonymize_s']:.4f}"
+        print(f"{row['names']:>8} {row['document_chars']:>10} {row['build_s']:>9.4f} "
+              f"{row['anonymize_s']:>10.4f} {legacy:>9}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""End-to-end benchmark against a mock OpenAI-compatible LLM server.
+
+Generates synthetic Czech oncology inputs (text, scanned PDF, DOCX, XLSX),
+starts benchmarks.mock_llm_server, points LOCAL_LLM_URL at it and runs each
+scenario at several concurrency levels, reporting throughput, p50/p95/p99
+latency and peak RSS of this process.
+
+Usage (from backend/):
+    python -m benchmarks.e2e_benchmark --concurrency 1 4 16 --output results.json
+    python -m benchmarks.e2e_benchmark --baseline results.json
+    python -m benchmarks.e2e_benchmark --diff old.json new.json
+
+Scanned-PDF OCR needs tesseract and poppler; without them the extract_pdf
+scenario reports every request as an error instead of being skipped.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from datetime import datetime, timezone
+
+from benchmarks import synthetic
+
+SCENARIOS = ["extract_txt", "extract_docx", "extract_xlsx", "extract_pdf", "anonymize", "create_prompt",
+             "api_process", "api_process_files", "api_process_stream"]
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_mock_server(args) -> subprocess.Popen:
+    command = [sys.executable, "-m", "benchmarks.mock_llm_server", "--port", str(args.port),
+               "--latency", str(args.llm_latency), "--per-token-latency", str(args.llm_per_token_latency),
+               "--jitter", str(args.llm_jitter)]
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{args.port}/v1/models", timeout=1)
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("Mock LLM server did not start")
+
+def current_rss_mb() -> float:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+class RssSampler:
+    """Sample RSS from a thread, so CPU-bound stages cannot starve it."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss_mb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = current_rss_mb()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_mb())
+
+def percentile(values, fraction: float) -> float:
+    """Nearest-rank percentile."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(int(fraction * len(ordered) + 0.5) - 1, 0))]
+
+async def run_level(call, requests: int, concurrency: int) -> dict:
+    latencies, errors, first_errors = [], 0, []
+    next_index = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for index in next_index:
+            started = time.perf_counter()
+            try:
+                error = await call(index)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            latencies.append(time.perf_counter() - started)
+            if error:
+                errors += 1
+                if len(first_errors) < 3:
+                    first_errors.append(str(error)[:200])
+
+    with RssSampler() as sampler:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "wall_s": round(wall, 4),
+        "throughput_rps": round(requests / wall, 3) if wall else 0.0,
+        "latency_ms": {
+            "mean": round(1000 * sum(latencies) / len(latencies), 2) if latencies else 0.0,
+            "p50": round(1000 * percentile(latencies, 0.50), 2),
+            "p95": round(1000 * percentile(latencies, 0.95), 2),
+            "p99": round(1000 * percentile(latencies, 0.99), 2),
+            "max": round(1000 * max(latencies, default=0.0), 2),
+        },
+        "peak_rss_mb": round(sampler.peak, 1),
+        "sample_errors": first_errors,
+    }
+
+def build_inputs(args, workdir: str) -> dict:
+    paths = {
+        "txt": os.path.join(workdir, "report.txt"),
+        "docx": os.path.join(workdir, "report.docx"),
+        "xlsx": os.path.join(workdir, "laboratory.xlsx"),
+        "pdf": os.path.join(workdir, "scan.pdf"),
+    }
+    synthetic.write_text(paths["txt"], paragraphs=args.paragraphs)
+    synthetic.write_docx(paths["docx"], paragraphs=args.paragraphs)
+    synthetic.write_xlsx(paths["xlsx"], rows=args.xlsx_rows)
+    synthetic.write_scanned_pdf(paths["pdf"], pages=args.pdf_pages)
+    names_path = os.path.join(workdir, "names.txt")
+    with open(names_path, "w", encoding="utf-8") as file:
+        file.write("\n".join(synthetic.make_names(args.names)))
+    return {"paths": paths, "names_path": names_path}
+
+def configure_environment(args, workdir: str, names_path: str):
+    """Must run before app modules are imported; they read settings at import time."""
+    os.environ["LOCAL_LLM_URL"] = f"http://127.0.0.1:{args.port}/v1"
+    os.environ["OPENAI_API_KEY"] = ""
+    os.environ["CACHE_DIR"] = os.path.join(workdir, "cache")
+    os.environ["NAMES_FILE_PATH"] = names_path
+    if not args.with_cache:
+        os.environ["EXTRACTION_CACHE_ENABLED"] = "false"
+        os.environ["LLM_CACHE_ENABLED"] = "false"
+
+def make_scenarios(args, inputs: dict, client) -> dict:
+    from starlette.datastructures import UploadFile
+
+    from app import main
+    from app.document_processor import is_extraction_error, process_documents
+    from app.executor import run_cpu
+    from app.prompt import create_prompt
+
+    paths = inputs["paths"]
+    blobs = {fmt: open(path, "rb").read() for fmt, path in paths.items()}
+    report = blobs["txt"].decode("utf-8")
+    # A different seed per request keeps the anonymizer and prompt inputs from being identical
+    reports = [synthetic.make_report(seed, args.paragraphs) for seed in range(16)]
+    form = {"model": main.DEFAULT_MODEL, "analysis_type": args.analysis_type, "use_cache": str(args.with_cache).lower()}
+
+    def extract(fmt):
+        async def call(index):
+            upload = UploadFile(file=io.BytesIO(blobs[fmt]), filename=f"doc{index}.{fmt}")
+            texts = await process_documents([upload])
+            return texts[0] if is_extraction_error(texts[0]) else None
+        return call
+
+    async def anonymize(index):
+        await run_cpu(main.anonymize_texts, [reports[index % len(reports)]])
+
+    async def prompt(index):
+        await run_cpu(create_prompt, [reports[index % len(reports)]], args.analysis_type)
+
+    async def api_process(index):
+        response = await client.post("/api/process", data={**form, "text_input": reports[index % len(reports)]})
+        return None if response.status_code == 200 else f"HTTP {response.status_code}: {response.text}"
+
+    async def api_process_files(index):
+        files = [("files", (f"doc{index}.docx", blobs["docx"])), ("files", (f"lab{index}.xlsx", blobs["xlsx"]))]
+        response = await client.post("/api/process", data=form, files=files)
+        return None if response.status_code == 200 else f"HTTP {response.status_code}: {response.text}"
+
+    async def api_process_stream(index):
+        async with client.stream("POST", "/api/process/stream", data={**form, "text_input": report}) as response:
+            body = (await response.aread()).decode("utf-8")
+        if response.status_code != 200:
+            return f"HTTP {response.status_code}: {body}"
+        return None if "event: done" in body else body[-200:]
+
+    return {
+        "extract_txt": extract("txt"),
+        "extract_docx": extract("docx"),
+        "extract_xlsx": extract("xlsx"),
+        "extract_pdf": extract("pdf"),
+        "anonymize": anonymize,
+        "create_prompt": prompt,
+        "api_process": api_process,
+        "api_process_files": api_process_files,
+        "api_process_stream": api_process_stream,
+    }
+
+async def run_benchmark(args, inputs: dict) -> list:
+    import httpx
+
+    from app import main
+
+    await main.startup()
+    results = []
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+            scenarios = make_scenarios(args, inputs, client)
+            for name in args.scenarios:
+                call = scenarios[name]
+                # One untimed call loads lazy state (prompt files, pools, sessions)
+                await call(-1)
+                for concurrency in args.concurrency:
+                    requests = max(args.requests, concurrency)
+                    result = await run_level(call, requests, concurrency)
+                    results.append({"scenario": name, **result})
+                    if not args.json:
+                        print_row(results[-1])
+    finally:
+        await main.shutdown()
+    return results
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+HEADER = f"{'scenario':<20} {'conc':>5} {'reqs':>5} {'errors':>6} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'peak MB':>8}"
+
+def print_row(result: dict):
+    latency = result["latency_ms"]
+    print(f"{result['scenario']:<20} {result['concurrency']:>5} {result['requests']:>5} {result['errors']:>6} "
+          f"{result['throughput_rps']:>9.2f} {latency['p50']:>9.1f} {latency['p95']:>9.1f} {latency['p99']:>9.1f} "
+          f"{result['peak_rss_mb']:>8.1f}")
+    for error in result["sample_errors"][:1]:
+        print(f"{'':<20} e.g. {error[:100]}")
+
+def _change(old: float, new: float) -> str:
+    return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+def print_diff(old: dict, new: dict):
+    """Relative change per (scenario, concurrency) present in both runs."""
+    baseline = {(r["scenario"], r["concurrency"]): r for r in old["results"]}
+    print(f"old: {old['meta'].get('git_commit') or '?'} {old['meta'].get('timestamp', '')}")
+    print(f"new: {new['meta'].get('git_commit') or '?'} {new['meta'].get('timestamp', '')}")
+    print(f"{'scenario':<20} {'conc':>5} {'rps':>10} {'p50':>10} {'p95':>10} {'p99':>10} {'peak MB':>10} {'errors':>9}")
+    for result in new["results"]:
+        previous = baseline.get((result["scenario"], result["concurrency"]))
+        if previous is None:
+            continue
+        print(f"{result['scenario']:<20} {result['concurrency']:>5} "
+              f"{_change(previous['throughput_rps'], result['throughput_rps']):>10} "
+              + " ".join(f"{_change(previous['latency_ms'][key], result['latency_ms'][key]):>10}" for key in ("p50", "p95", "p99"))
+              + f" {_change(previous['peak_rss_mb'], result['peak_rss_mb']):>10}"
+              + f" {previous['errors']:>4}->{result['errors']:<4}")
+
+def load_results(path: str) -> dict:
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=32, help="Requests per concurrency level (at least the level)")
+    parser.add_argument("--analysis-type", default="standard", choices=["standard", "extended"])
+    parser.add_argument("--paragraphs", type=int, default=60, help="Lines per synthetic report")
+    parser.add_argument("--pdf-pages", type=int, default=3)
+    parser.add_argument("--xlsx-rows", type=int, default=5000)
+    parser.add_argument("--names", type=int, default=200, help="Names in the anonymizer list")
+    parser.add_argument("--port", type=int, default=0, help="Mock LLM server port (default: a free one)")
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--llm-per-token-latency", type=float, default=0.0005)
+    parser.add_argument("--llm-jitter", type=float, default=0.0)
+    parser.add_argument("--with-cache", action="store_true", help="Keep the extraction and LLM caches enabled")
+    parser.add_argument("--output", help="Write machine-readable results to this file")
+    parser.add_argument("--baseline", help="Print the relative change against an earlier --output file")
+    parser.add_argument("--diff", nargs=2, metavar=("OLD", "NEW"), help="Compare two result files and exit")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    if args.diff:
+        print_diff(load_results(args.diff[0]), load_results(args.diff[1]))
+        return
+
+    args.port = args.port or free_port()
+    with tempfile.TemporaryDirectory() as workdir:
+        inputs = build_inputs(args, workdir)
+        configure_environment(args, workdir, inputs["names_path"])
+        server = start_mock_server(args)
+        try:
+            if not args.json:
+                print(HEADER)
+            results = asyncio.run(run_benchmark(args, inputs))
+        finally:
+            server.terminate()
+            server.wait()
+
+    report = {
+        "meta": {
+            "git_commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "diff", "json")},
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2, ensure_ascii=False)
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.baseline:
+        print_diff(load_results(args.baseline), report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Measure peak RSS of XLSX/DOCX extraction against the previous full-load extractors.
+
+Each extraction runs in a fresh process so ru_maxrss reflects only that run.
+
+Usage (from backend/):
+    python -m benchmarks.extraction_memory_benchmark --rows 10000 100000 300000
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+
+import docx
+import openpyxl
+
+from app import document_processor
+
+def make_xlsx(path: str, rows: int, seed: int = 0):
+    rng = random.Random(seed)
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Laboratoř")
+    sheet.append(["Datum", "Vyšetření", "Hodnota", "Jednotka", "Poznámka"])
+    for i in range(rows):
+        sheet.append([f"{1 + i % 28}.{1 + i % 12}.2024", rng.choice(["CEA", "CA 15-3", "Hb", "Leu"]),
+                      round(rng.uniform(0, 200), 2), "µg/l", "kontrola" if i % 7 else ""])
+    workbook.save(path)
+
+def make_docx(path: str, rows: int):
+    document = docx.Document()
+    document.add_paragraph("Histopatologický nález")
+    table = document.add_table(rows=rows, cols=3)
+    for i, row in enumerate(table.rows):
+        row.cells[0].text, row.cells[1].text, row.cells[2].text = f"Vzorek {i}", "pT2 pN1 G2", "okraje negativní"
+    document.add_paragraph("Závěr: invazivní karcinom NST")
+    document.save(path)
+
+def legacy_xlsx(file_path: str) -> str:
+    """The previous extractor: full (non read-only) workbook load."""
+    workbook = openpyxl.load_workbook(file_path, data_only=True)
+    text_content = []
+    for sheet_name in workbook.sheetnames:
+        sheet_text = [f"Sheet: {sheet_name}"]
+        for row in workbook[sheet_name].iter_rows(values_only=True):
+            sheet_text.append(",".join(str(cell) if cell is not None else "" for cell in row))
+        text_content.append("\n".join(sheet_text))
+    return "\n\n".join(text_content)
+
+EXTRACTORS = {
+    "xlsx": document_processor.extract_text_from_xlsx,
+    "xlsx_legacy": legacy_xlsx,
+    "docx": document_processor.extract_text_from_docx,
+}
+
+def current_rss_kb() -> int:
+    """Resident set size right now (Linux), falling back to the peak so far."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def reset_peak_rss():
+    """Restart the peak RSS from the current RSS (Linux), so imports do not count."""
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+
+def peak_rss_kb() -> int:
+    """Peak RSS since reset_peak_rss (Linux), falling back to the peak of the process."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def _measure(name: str, path: str, max_rows: int, queue):
+    document_processor.XLSX_MAX_ROWS = max_rows
+    document_processor.XLSX_MAX_CELLS = max_rows * 10
+    reset_peak_rss()
+    baseline = current_rss_kb()
+    start = time.perf_counter()
+    text = EXTRACTORS[name](path)
+    seconds = time.perf_counter() - start
+    peak = peak_rss_kb()
+    queue.put({
+        "seconds": round(seconds, 3),
+        "peak_rss_mb": round(peak / 1024, 1),
+        "extraction_rss_mb": round(max(peak - baseline, 0) / 1024, 1),
+        "characters": len(text),
+        "truncated": document_processor.TRUNCATION_MARKER in text,
+    })
+
+def measure(name: str, path: str, max_rows: int) -> dict:
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_measure, args=(name, path, max_rows, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--max-rows', type=int, default=document_processor.XLSX_MAX_ROWS,
+                        help='XLSX_MAX_ROWS used by the streaming extractor')
+    parser.add_argument('--legacy-max', type=int, default=100000,
+                        help='Skip the legacy XLSX extractor above this many rows')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in args.rows:
+            xlsx_path = os.path.join(directory, f"{rows}.xlsx")
+            docx_path = os.path.join(directory, f"{rows}.docx")
+            make_xlsx(xlsx_path, rows)
+            make_docx(docx_path, min(rows, 5000))
+
+            for name, path in (("xlsx", xlsx_path), ("xlsx_legacy", xlsx_path), ("docx", docx_path)):
+                if name == "xlsx_legacy" and rows > args.legacy_max:
+                    continue
+                row = {"extractor": name, "rows": rows if name != "docx" else min(rows, 5000),
+                       "file_mb": round(os.path.getsize(path) / 1024 / 1024, 2)}
+                row.update(measure(name, path, args.max_rows))
+                results.append(row)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'extractor':>12} {'rows':>8} {'file MB':>8} {'seconds':>8} {'peak MB':>8} {'delta MB':>9} {'trunc':>6}")
+    for row in results:
+        print(f"{row['extractor']:>12} {row['rows']:>8} {row['file_mb']:>8} {row['seconds']:>8} "
+              f"{row['peak_rss_mb']:>8} {row['extraction_rss_mb']:>9} {str(row['truncated']):>6}")
+
+if __name__ == "__main__":
+    main()
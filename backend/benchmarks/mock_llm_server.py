@@ -0,0 +1,117 @@
+"""Mock OpenAI-compatible chat completion server for benchmarks.
+
+It answers every parameter listed in the prompt with an empty value, in
+the CSV format the app parses, supports stream mode and reports usage.
+Latency is
+    --latency + --per-token-latency * completion tokens (+/- --jitter).
+
+Usage (from backend/):
+    python -m benchmarks.mock_llm_server --port 8099 --latency 0.5
+    LOCAL_LLM_URL=http://127.0.0.1:8099/v1 uvicorn app.main:app
+"""
+import argparse
+import asyncio
+import csv
+import json
+import random
+import time
+
+from aiohttp import web
+
+PARAMETERS_HEADER = "PARAMETERS TO EXTRACT:\n"
+TEXT_HEADER = "\n\nMEDICAL TEXT"
+
+def parameter_names(prompt: str):
+    if PARAMETERS_HEADER not in prompt:
+        return []
+    section = prompt.split(PARAMETERS_HEADER, 1)[1].split(TEXT_HEADER, 1)[0]
+    return [row[0].strip() for row in csv.reader(section.split("\n"), delimiter=";") if row and row[0].strip()]
+
+def answer(prompt: str) -> str:
+    rows = []
+    for name in parameter_names(prompt):
+        quoted = '"' + name.replace('"', '""') + '"' if "," in name else name
+        rows.append(f"{quoted},,0")
+    return "\n".join(rows)
+
+class MockServer:
+    def __init__(self, latency: float, per_token_latency: float, jitter: float, chunk_tokens: int, error_rate: float,
+                 models_latency: float = 0.0, models=("mock-model",)):
+        self.latency = latency
+        self.per_token_latency = per_token_latency
+        self.jitter = jitter
+        self.chunk_tokens = chunk_tokens
+        self.error_rate = error_rate
+        self.models_latency = models_latency
+        self.model_ids = list(models)
+        self.requests = 0
+        self.random = random.Random(0)
+
+    def delay(self, tokens: int) -> float:
+        base = self.latency + self.per_token_latency * tokens
+        return max(0.0, base + self.random.uniform(-self.jitter, self.jitter))
+
+    async def models(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.models_latency)
+        return web.json_response({"object": "list", "data": [{"id": model, "object": "model"} for model in self.model_ids]})
+
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.requests += 1
+        if self.error_rate and self.random.random() < self.error_rate:
+            return web.json_response({"error": {"message": "mock overload"}}, status=503)
+
+        prompt = "".join(message.get("content", "") for message in body.get("messages", []))
+        content = answer(prompt)
+        # Rough token counts, close enough for latency modelling
+        prompt_tokens, completion_tokens = len(prompt) // 4, max(len(content) // 4, 1)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        model = body.get("model", "mock-model")
+
+        if not body.get("stream"):
+            await asyncio.sleep(self.delay(completion_tokens))
+            return web.json_response({
+                "id": f"mock-{self.requests}", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await asyncio.sleep(self.latency)
+        step = self.chunk_tokens * 4
+        for start in range(0, len(content), step):
+            piece = content[start:start + step]
+            await asyncio.sleep(self.per_token_latency * self.chunk_tokens)
+            chunk = {"choices": [{"index": 0, "delta": {"content": piece}}], "model": model}
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+def create_app(server: MockServer) -> web.Application:
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_get("/v1/models", server.models)
+    app.router.add_post("/v1/chat/completions", server.chat)
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before the first token")
+    parser.add_argument("--per-token-latency", type=float, default=0.0005, help="Seconds per completion token")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform +/- jitter in seconds")
+    parser.add_argument("--chunk-tokens", type=int, default=8, help="Tokens per streamed chunk")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--models-latency", type=float, default=0.0, help="Seconds before /v1/models answers")
+    parser.add_argument("--models", nargs="+", default=["mock-model"], help="Model IDs listed by /v1/models (e.g. a cascade model)")
+    args = parser.parse_args()
+
+    server = MockServer(args.latency, args.per_token_latency, args.jitter, args.chunk_tokens, args.error_rate,
+                        args.models_latency, args.models)
+    web.run_app(create_app(server), host=args.host, port=args.port, print=None)
+
+if __name__ == "__main__":
+    main()
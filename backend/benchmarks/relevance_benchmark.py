@@ -0,0 +1,81 @@
+"""Benchmark the line-level relevance selection (app.relevance) on long reports.
+
+For hospitalization reports of growing length (benchmarks.synthetic) it
+reports, per analysis type, the document tokens sent to the model with and
+without selection, the reduction factor, the share of prompts that fell
+back to the full text, the recall of the evidence lines (the clinical
+summary at the top of every synthetic report) and the selection time.
+
+Usage (from backend/):
+    python -m benchmarks.relevance_benchmark --days 10 30 100 --runs 5
+"""
+import argparse
+import json
+import statistics
+import time
+
+from app.prompt import ANALYSIS_TYPES, is_sharded, number_lines, prompt_registry
+from app.relevance import line_index, select_lines
+from app.tokens import DEFAULT_ENCODING, count_tokens, effective_encoding
+from benchmarks.synthetic import PARAGRAPHS, make_hospitalization_report
+
+def parameter_groups(analysis_type: str):
+    if is_sharded(analysis_type):
+        return [shard.parameters for shard in prompt_registry.shards(analysis_type)]
+    return [prompt_registry.parameters(analysis_type)]
+
+def evidence_recall(selected: str) -> float:
+    """Share of the summary lines (numbered 1..len(PARAGRAPHS)) that were kept."""
+    kept = {line.partition(": ")[0] for line in selected.split("\n")}
+    return sum(str(number) in kept for number in range(1, len(PARAGRAPHS) + 1)) / len(PARAGRAPHS)
+
+def run(analysis_type: str, days: int, runs: int, encoding: str) -> dict:
+    abbreviations = prompt_registry.abbreviations()
+    groups = parameter_groups(analysis_type)
+    numbered_text = number_lines([make_hospitalization_report(days, days)])
+    full_tokens = count_tokens(numbered_text, encoding)
+
+    timings = []
+    for _ in range(runs):
+        line_index.cache_clear()
+        started = time.perf_counter()
+        selections = [select_lines(numbered_text, parameters, abbreviations) for parameters in groups]
+        timings.append(time.perf_counter() - started)
+
+    sent = sum(count_tokens(selection.text, encoding) for selection in selections)
+    return {
+        "analysis_type": analysis_type,
+        "days": days,
+        "lines": selections[0].total_lines,
+        "prompts": len(groups),
+        "full_tokens": full_tokens * len(groups),
+        "selected_tokens": sent,
+        "reduction": round(full_tokens * len(groups) / max(sent, 1), 2),
+        "fallback_share": round(sum(not selection.applied for selection in selections) / len(selections), 3),
+        "evidence_recall": round(min(evidence_recall(selection.text) for selection in selections), 3),
+        "select_ms": round(statistics.median(timings) * 1000, 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, nargs="+", default=[10, 30, 100], help="Hospitalization days (6 lines each)")
+    parser.add_argument("--analysis-types", nargs="+", choices=ANALYSIS_TYPES, default=list(ANALYSIS_TYPES))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    encoding = effective_encoding(DEFAULT_ENCODING)
+    results = [run(analysis_type, days, args.runs, DEFAULT_ENCODING) for analysis_type in args.analysis_types for days in args.days]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'analysis':<10} {'days':>5} {'lines':>6} {'prompts':>8} {'full tok':>9} {'sent tok':>9} {'x less':>7} "
+          f"{'fallback':>9} {'recall':>7} {'select ms':>10}  ({encoding} tokens, summed over prompts)")
+    for result in results:
+        print(f"{result['analysis_type']:<10} {result['days']:>5} {result['lines']:>6} {result['prompts']:>8} "
+              f"{result['full_tokens']:>9} {result['selected_tokens']:>9} {result['reduction']:>7.2f} "
+              f"{result['fallback_share']:>9.2f} {result['evidence_recall']:>7.2f} {result['select_ms']:>10.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Benchmark the deterministic fast path (app.rules) ahead of the LLM call.
+
+For synthetic reports (benchmarks.synthetic) it reports, per analysis type,
+how many parameters the rules resolve with a valid value, the static prompt
+tokens (template, enums, parameter rows) left to send for the remaining
+parameters, the number of prompts and the time of the single scan over the
+document.
+
+Usage (from backend/):
+    python -m benchmarks.rules_benchmark --paragraphs 9 --days 0 100 --runs 5
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from app.llm_service import DEFAULT_MODEL, apply_rules, measure_prompt, pending_shards
+from app.prompt import ANALYSIS_TYPES, number_lines, prompt_registry
+from app.rules import get_rule_engine
+from app.tokens import DEFAULT_ENCODING, effective_encoding
+from benchmarks.synthetic import make_hospitalization_report, make_report
+
+async def static_tokens(analysis_type: str, indexes) -> int:
+    return sum([(await measure_prompt("", shard.parts, DEFAULT_MODEL)).static_tokens for shard in pending_shards(analysis_type, indexes)])
+
+async def run(analysis_type: str, paragraphs: int, days: int, runs: int) -> dict:
+    text = make_hospitalization_report(paragraphs, days) if days else make_report(paragraphs, paragraphs)
+    numbered_text = number_lines([text])
+    parameters = prompt_registry.parameters(analysis_type)
+    engine = get_rule_engine(analysis_type)
+
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        engine.extract(numbered_text)
+        timings.append(time.perf_counter() - started)
+
+    ruled = await apply_rules(numbered_text, analysis_type)
+    pending = [index for index in range(len(parameters)) if index not in ruled]
+    return {
+        "analysis_type": analysis_type,
+        "days": days,
+        "lines": numbered_text.count("\n") + 1,
+        "parameters": len(parameters),
+        "resolved": len(ruled),
+        "prompts_before": len(pending_shards(analysis_type)),
+        "prompts_after": len(pending_shards(analysis_type, pending)),
+        "static_tokens_before": await static_tokens(analysis_type, None),
+        "static_tokens_after": await static_tokens(analysis_type, pending),
+        "scan_ms": round(statistics.median(timings) * 1000, 3),
+    }
+
+async def run_all(args) -> list:
+    return [
+        await run(analysis_type, args.paragraphs, days, args.runs)
+        for analysis_type in args.analysis_types for days in args.days
+    ]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--paragraphs", type=int, default=9, help="Summary paragraphs (and seed) of the report")
+    parser.add_argument("--days", type=int, nargs="+", default=[0, 100], help="Hospitalization days appended (0: summary only)")
+    parser.add_argument("--analysis-types", nargs="+", choices=ANALYSIS_TYPES, default=list(ANALYSIS_TYPES))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_all(args))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'analysis':<10} {'days':>5} {'lines':>6} {'params':>7} {'resolved':>9} {'prompts':>9} "
+          f"{'static tok':>17} {'scan ms':>8}  ({effective_encoding(DEFAULT_ENCODING)} tokens)")
+    for result in results:
+        prompts = f"{result['prompts_before']}->{result['prompts_after']}"
+        static = f"{result['static_tokens_before']}->{result['static_tokens_after']}"
+        print(f"{result['analysis_type']:<10} {result['days']:>5} {result['lines']:>6} {result['parameters']:>7} "
+              f"{result['resolved']:>9} {prompts:>9} {static:>17} {result['scan_ms']:>8.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Benchmark import-to-ready time of the API and the first /api/models call.
+
+Each run is a fresh interpreter that imports app.main, runs the startup
+hook and then asks for the model list, against one of three providers:
+    none         no LOCAL_LLM_URL and no API key (offline deployment)
+    mock         benchmarks.mock_llm_server, /v1/models delayed by --models-latency
+    unreachable  a non-routable LOCAL_LLM_URL (discovery runs into its timeout)
+
+Usage (from backend/):
+    python -m benchmarks.startup_benchmark --runs 5 --providers none mock unreachable
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+from benchmarks.e2e_benchmark import free_port
+
+CHILD = """
+import asyncio, json, time
+started = time.perf_counter()
+from app import main
+imported = time.perf_counter()
+
+async def run():
+    await main.startup()
+    ready = time.perf_counter()
+    print("BENCHMARK_READY", flush=True)
+    models = await main.get_models()
+    listed = time.perf_counter()
+    await main.shutdown()
+    print("BENCHMARK_RESULT " + json.dumps({"import_s": imported - started, "startup_s": ready - imported,
+                      "models_s": listed - ready, "models": models["models"]}), flush=True)
+
+asyncio.run(run())
+"""
+
+UNREACHABLE_URL = "http://10.255.255.1/v1"
+
+def _read_until(child: subprocess.Popen, prefix: str) -> str:
+    """Skip the app's own log lines."""
+    for line in child.stdout:
+        if line.startswith(prefix):
+            return line[len(prefix):].strip()
+    raise RuntimeError(f"Child process exited before printing {prefix}")
+
+def run_once(env: dict) -> dict:
+    started = time.perf_counter()
+    child = subprocess.Popen([sys.executable, "-c", CHILD], env=env, stdout=subprocess.PIPE, text=True)
+    try:
+        _read_until(child, "BENCHMARK_READY")
+        # Interpreter start plus import plus startup hook, as seen from outside
+        ready_s = time.perf_counter() - started
+        result = json.loads(_read_until(child, "BENCHMARK_RESULT "))
+    finally:
+        child.wait()
+    return {**result, "process_ready_s": ready_s}
+
+def provider_env(provider: str, port: int) -> dict:
+    env = {key: value for key, value in os.environ.items() if key not in ("OPENAI_API_KEY", "LOCAL_LLM_URL")}
+    if provider == "mock":
+        env["LOCAL_LLM_URL"] = f"http://127.0.0.1:{port}/v1"
+    elif provider == "unreachable":
+        env["LOCAL_LLM_URL"] = UNREACHABLE_URL
+    return env
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--providers", nargs="+", choices=["none", "mock", "unreachable"], default=["none", "mock", "unreachable"])
+    parser.add_argument("--models-latency", type=float, default=0.5, help="Delay of the mock /v1/models endpoint")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    port = free_port()
+    server = subprocess.Popen([sys.executable, "-m", "benchmarks.mock_llm_server", "--port", str(port),
+                               "--models-latency", str(args.models_latency)], stdout=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 15
+        while True:
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/v1/models", timeout=5)
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+        results = []
+        for provider in args.providers:
+            runs = [run_once(provider_env(provider, port)) for _ in range(args.runs)]
+            results.append({
+                "provider": provider,
+                "runs": args.runs,
+                "models": runs[-1]["models"],
+                **{key: round(statistics.median(run[key] for run in runs), 4)
+                   for key in ("import_s", "startup_s", "process_ready_s", "models_s")},
+            })
+    finally:
+        server.terminate()
+        server.wait()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'provider':<12} {'import s':>9} {'startup s':>10} {'ready s':>8} {'/api/models s':>14}  models (median of {args.runs})")
+    for result in results:
+        print(f"{result['provider']:<12} {result['import_s']:>9.3f} {result['startup_s']:>10.3f} "
+              f"{result['process_ready_s']:>8.3f} {result['models_s']:>14.3f}  {', '.join(result['models'])}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""Deterministic synthetic Czech oncology documents for the benchmarks.
+
+Everything here is generated from a seed; no real patient data is used.
+"""
+import os
+import random
+from typing import List
+
+import docx
+import openpyxl
+from PIL import Image, ImageDraw, ImageFont
+
+FIRST_NAMES = ["Jiří", "Jan", "Petr", "Josef", "Pavel", "Marie", "Jana", "Eva", "Hana", "Věra",
+               "Tomáš", "Lucie", "Kateřina", "Zdeněk", "Růžena", "Ondřej", "Šárka", "Lenka"]
+SURNAMES = ["Novák", "Svoboda", "Novotný", "Dvořák", "Černý", "Procházka", "Kučera", "Veselý",
+            "Horák", "Němec", "Pokorný", "Marková", "Hájková", "Králová", "Růžičková", "Šťastný"]
+DIAGNOSES = [("C50.4", "Zhoubný novotvar prsu, horní zevní kvadrant"), ("C18.7", "Zhoubný novotvar esovité kličky"),
+             ("C34.1", "Zhoubný novotvar horního laloku plíce"), ("C61", "Zhoubný novotvar předstojné žlázy"),
+             ("C20", "Zhoubný novotvar konečníku")]
+PARAGRAPHS = [
+    "Pacient{a} {name}, nar. {birth}, přichází k onkologické kontrole.",
+    "Výška {height} cm, hmotnost {weight} kg, BMI {bmi}. Celkový stav dobrý, ECOG {ecog}.",
+    "Dg.: {code} – {diagnosis}, stanovena {diagnosed}. Lateralita: {side}.",
+    "Histologie: invazivní karcinom NST, G{grade}. TNM: cT{t} cN{n} cM0, pT{t} pN{n} (2/14).",
+    "Alergie: {allergy}. Kouření: bývalý kuřák, 20 let, 10 cigaret denně.",
+    "Léčba zahájena {started}: neoadjuvantní chemoterapie 4x AC, následně paklitaxel.",
+    "Zevní radioterapie fotonová 50 Gy/25 fr. ukončena {rt_end}, bez závažné toxicity.",
+    "Kontrolní CT {control}: parciální remise (PR), bez známek diseminace.",
+    "Doporučení: kontrola u MUDr. {doctor} za 3 měsíce, laboratoř (KO, biochemie, CEA, CA 15-3).",
+]
+
+def make_names(count: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    names = {f"{rng.choice(FIRST_NAMES)} {rng.choice(SURNAMES)}" for _ in range(count * 3)}
+    return sorted(names)[:count]
+
+def _date(rng: random.Random, year: int) -> str:
+    return f"{rng.randint(1, 28)}.{rng.randint(1, 12)}.{year}"
+
+def make_report(seed: int = 0, paragraphs: int = 30) -> str:
+    """A discharge-style report of roughly paragraphs * 90 characters."""
+    rng = random.Random(seed)
+    code, diagnosis = rng.choice(DIAGNOSES)
+    female = code == "C50.4" or rng.random() < 0.5
+    height = rng.randint(155, 195)
+    weight = rng.randint(50, 110)
+    values = {
+        "a": "ka" if female else "",
+        "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(SURNAMES)}",
+        "doctor": rng.choice(SURNAMES),
+        "birth": _date(rng, rng.randint(1940, 1985)),
+        "height": height, "weight": weight, "bmi": round(weight / (height / 100) ** 2, 1),
+        "ecog": rng.randint(0, 2), "code": code, "diagnosis": diagnosis,
+        "diagnosed": _date(rng, 2023), "side": rng.choice(["vpravo", "vlevo", "odpadá"]),
+        "grade": rng.randint(1, 3), "t": rng.randint(1, 4), "n": rng.randint(0, 2),
+        "allergy": rng.choice(["neudává", "PNC – exantém", "jodové kontrastní látky"]),
+        "started": _date(rng, 2023), "rt_end": _date(rng, 2024), "control": _date(rng, 2024),
+    }
+    lines = []
+    for index in range(paragraphs):
+        lines.append(PARAGRAPHS[index % len(PARAGRAPHS)].format(**values))
+    return "\n".join(lines)
+
+# Day-to-day lines of a hospitalization report that carry none of the extracted parameters
+HOSPITAL_DAY = [
+    "{day}. den hospitalizace: TK {systolic}/{diastolic}, P {pulse}/min, TT {temperature} °C, SpO2 {saturation} %.",
+    "Medikace: Helicid 20 mg 1-0-1, Furon 40 mg 1-0-0, Clexane 0,4 ml s.c. 0-0-1, Novalgin 500 mg dle potřeby.",
+    "Ošetřovatelský záznam: noc klidná, příjem tekutin {fluids} ml, vyprázdnění bez obtíží.",
+    "Převaz operační rány, rána klidná, bez sekrece, stehy in situ.",
+    "Laboratoř: Hb {hemoglobin} g/l, Leu 6,2, Tr 245, CRP {crp} mg/l, kreatinin 76 µmol/l.",
+    "Vizita: bez nových obtíží, mobilizace na lůžku, pokračujeme v nastavené medikaci.",
+]
+
+def make_hospitalization_report(seed: int = 0, days: int = 30) -> str:
+    """A long hospitalization report: the clinical summary of make_report
+    followed by days of vitals, medication lists and nursing notes.
+
+    The first len(PARAGRAPHS) lines are the only ones carrying parameters.
+    """
+    rng = random.Random(seed)
+    lines = make_report(seed, len(PARAGRAPHS)).split("\n")
+    for day in range(1, days + 1):
+        values = {
+            "day": day, "systolic": rng.randint(110, 150), "diastolic": rng.randint(60, 95),
+            "pulse": rng.randint(60, 100), "temperature": round(rng.uniform(36.2, 37.8), 1),
+            "saturation": rng.randint(93, 99), "fluids": rng.randrange(1200, 2600, 100),
+            "hemoglobin": rng.randint(105, 150), "crp": rng.randint(1, 60),
+        }
+        lines.extend(template.format(**values) for template in HOSPITAL_DAY)
+    return "\n".join(lines)
+
+def write_text(path: str, seed: int = 0, paragraphs: int = 30):
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(make_report(seed, paragraphs))
+
+def write_docx(path: str, seed: int = 0, paragraphs: int = 30, table_rows: int = 20):
+    document = docx.Document()
+    for line in make_report(seed, paragraphs).split("\n"):
+        document.add_paragraph(line)
+    rng = random.Random(seed)
+    table = document.add_table(rows=table_rows + 1, cols=3)
+    table.cell(0, 0).text, table.cell(0, 1).text, table.cell(0, 2).text = "Vzorek", "TNM", "Okraje"
+    for row in range(1, table_rows + 1):
+        table.cell(row, 0).text = f"Vzorek č. {row}"
+        table.cell(row, 1).text = f"pT{rng.randint(1, 4)} pN{rng.randint(0, 2)} G{rng.randint(1, 3)}"
+        table.cell(row, 2).text = rng.choice(["negativní", "pozitivní – ventrální okraj"])
+    document.save(path)
+
+def write_xlsx(path: str, rows: int, seed: int = 0):
+    rng = random.Random(seed)
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = "Laboratoř"
+    sheet.append(["Datum", "Vyšetření", "Hodnota", "Jednotka", "Poznámka"])
+    for index in range(rows):
+        sheet.append([_date(rng, 2024), rng.choice(["CEA", "CA 15-3", "Hemoglobin", "Leukocyty", "Kreatinin"]),
+                      round(rng.uniform(0, 200), 2), rng.choice(["µg/l", "g/l", "10^9/l", "µmol/l"]),
+                      "zvýšená hodnota" if index % 9 == 0 else ""])
+    workbook.save(path)
+
+def _font(size: int):
+    for name in (os.getenv("BENCH_FONT", ""), "DejaVuSans.ttf", "LiberationSans-Regular.ttf", "Arial.ttf"):
+        if not name:
+            continue
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+def write_scanned_pdf(path: str, pages: int, seed: int = 0, dpi: int = 150):
+    """Image-only PDF (no text layer), so every page goes through OCR."""
+    width, height = int(8.27 * dpi), int(11.69 * dpi)
+    font = _font(dpi // 6)
+    lines = make_report(seed, paragraphs=pages * 25).split("\n")
+    images = []
+    for page in range(pages):
+        image = Image.new("L", (width, height), 255)
+        draw = ImageDraw.Draw(image)
+        y = dpi // 2
+        for line in lines[page * 25:(page + 1) * 25]:
+            draw.text((dpi // 2, y), line[:90], fill=0, font=font)
+            y += dpi // 3
+        images.append(image)
+    images[0].save(path, "PDF", resolution=dpi, save_all=True, append_images=images[1:])
@@ -0,0 +1,54 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Tuple
+
+# How long every call of a Blocking proxy holds its thread
+BLOCKING_DELAY = 0.2
+
+class Blocking:
+    """Proxy whose method calls block their thread for delay seconds first, like a slow disk or server."""
+
+    def __init__(self, target, delay: float = BLOCKING_DELAY):
+        self._target = target
+        self._delay = delay
+
+    def __getattr__(self, name):
+        attribute = getattr(self._target, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            time.sleep(self._delay)
+            return attribute(*args, **kwargs)
+        return call
+
+class MemoryCache:
+    """In-memory stand-in for DiskCache / RedisCache."""
+
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value):
+        self.values[key] = value
+
+async def with_loop_lag(awaitable: Awaitable) -> Tuple[Any, float]:
+    """Await awaitable and return its result with the longest stall of the event loop meanwhile."""
+    lag, done = 0.0, False
+
+    async def tick():
+        nonlocal lag
+        last = time.perf_counter()
+        while not done:
+            await asyncio.sleep(0.005)
+            now = time.perf_counter()
+            lag, last = max(lag, now - last), now
+
+    ticker = asyncio.create_task(tick())
+    try:
+        return await awaitable, lag
+    finally:
+        done = True
+        await ticker
@@ -0,0 +1,31 @@
+import pytest
+
+from app.anonymizer import Anonymizer
+
+@pytest.fixture
+def anonymizer(tmp_path):
+    names = tmp_path / "names.txt"
+    names.write_text("Novák\nJana\n", encoding="utf-8")
+    return Anonymizer(str(names))
+
+@pytest.mark.parametrize("text, folded, offsets", [
+    ("NOVÁK", "novak", [0, 1, 2, 3, 4]),
+    # Decomposed "á": the combining mark folds to nothing
+    ("Nova\u0301k", "novak", [0, 1, 2, 3, 5]),
+    # "ß" folds to two chars, both mapped to it
+    ("Preuß J.", "preuss j.", [0, 1, 2, 3, 4, 4, 5, 6, 7]),
+])
+def test_fold_with_offsets(anonymizer, text, folded, offsets):
+    assert anonymizer._fold_with_offsets(text) == (folded, offsets)
+
+def test_names_are_masked_at_their_original_spans(anonymizer):
+    text = "Novák, novak a NOVÁK; Jana Nova\u0301k."
+    spans = anonymizer.find_names(text)
+    assert [(text[start:end], replacement) for start, end, replacement in spans] == [
+        ("Novák", "[PERSON_1]"),
+        ("novak", "[PERSON_1]"),
+        ("NOVÁK", "[PERSON_1]"),
+        ("Jana", "[PERSON_2]"),
+        ("Nova\u0301k", "[PERSON_1]"),
+    ]
+    assert anonymizer.anonymize_text(text) == "[PERSON_1], [PERSON_1] a [PERSON_1]; [PERSON_2] [PERSON_1]."
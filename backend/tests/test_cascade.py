@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from app import llm_service
+from app.prompt import prompt_registry
+from app.response_parser import ResponseRow, format_response_rows
+
+TEXT = "Pacientka 54 let.\nLéková alergie: PNC - exantém."
+ALLERGY = "Léková alergie"
+
+@pytest.fixture
+def completions(monkeypatch):
+    """Stubbed provider: the small model is unsure about the allergy, the cascade model is not."""
+    monkeypatch.setattr(llm_service, "RULES_ENABLED", False)
+    monkeypatch.setattr(llm_service, "CASCADE_ESCALATE_EMPTY", False)
+    calls = []
+
+    async def get_available_models():
+        return ["small", llm_service.CASCADE_MODEL]
+
+    async def get_completion(prompt, model, use_cache=True):
+        calls.append(model)
+        if model == llm_service.CASCADE_MODEL:
+            return format_response_rows([ResponseRow(ALLERGY, "ANO", "2")])
+        names = [spec.name for spec in prompt_registry.parameters("standard")]
+        return format_response_rows([ResponseRow(name, "možná" if name == ALLERGY else "NA", "2" if name == ALLERGY else "0") for name in names])
+
+    monkeypatch.setattr(llm_service, "get_available_models", get_available_models)
+    monkeypatch.setattr(llm_service, "get_completion", get_completion)
+    return calls
+
+def test_cascade_escalates_only_uncertain_records(completions):
+    result = asyncio.run(llm_service.extract_parameters([TEXT], "small", "standard", cascade=True))
+    records = {record["parameter"]: record for record in result["records"]}
+    assert records[ALLERGY]["value"] == "ANO" and records[ALLERGY]["valid"]
+    assert all(record["valid"] for record in result["records"])
+
+    stats = result["cascade"]
+    assert (stats["model"], stats["cascade_model"]) == ("small", llm_service.CASCADE_MODEL)
+    assert (stats["escalated"], stats["answered"], stats["errors"]) == (1, 1, 0)
+    assert stats["reasons"] == {"invalid": 1}
+    assert completions.count(llm_service.CASCADE_MODEL) == 1
+    # The escalation prompt carries one parameter and its evidence, not the whole first-pass prompt
+    assert stats["first_pass_prompt_tokens"] == sum(prompt["prompt_tokens"] for prompt in result["token_budget"]["prompts"])
+    assert 0 < stats["escalation_prompt_tokens"] < stats["first_pass_prompt_tokens"]
+    assert stats["tokens_saved"] == stats["first_pass_prompt_tokens"] - stats["escalation_prompt_tokens"]
+
+def test_cascade_off_uses_validation_retries(completions, monkeypatch):
+    monkeypatch.setattr(llm_service, "VALIDATION_RETRIES", 1)
+    result = asyncio.run(llm_service.extract_parameters([TEXT], "small", "standard", cascade=False))
+    assert result["cascade"] is None
+    assert llm_service.CASCADE_MODEL not in completions
+    assert completions == ["small", "small"]
+    records = {record["parameter"]: record for record in result["records"]}
+    assert not records[ALLERGY]["valid"]
+
+def test_summarize_cascades_sums_documents():
+    run = {
+        "parameters": 10, "escalated": 2, "answered": 2, "errors": 0, "first_pass_prompt_tokens": 1000,
+        "escalation_prompt_tokens": 300, "tokens_saved": 700, "reasons": {"invalid": 2}, "prompt_cost_saved_usd": 0.01,
+    }
+    summary = llm_service.summarize_cascades([run, None, run])
+    assert summary["documents"] == 2
+    assert (summary["escalated"], summary["tokens_saved"], summary["escalation_rate"]) == (4, 1400, 0.2)
+    assert summary["reasons"] == {"invalid": 4}
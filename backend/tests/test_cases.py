@@ -0,0 +1,101 @@
+from functools import partial
+
+import pytest
+
+from app.cases import (
+    MERGE_EARLIEST, MERGE_LATEST, MERGE_REPLACE, MERGE_UNION, CaseDocument, CaseStore,
+    merge_parameter, merge_policy, merge_records, text_digest,
+)
+from app.validation import FieldSchema, ValidatedRecord
+
+def record(parameter: str, value: str, normalized, line: str = "1", type: str = "text", valid: bool = True) -> ValidatedRecord:
+    return ValidatedRecord(parameter, value, normalized, line, type, valid, None if valid else "invalid")
+
+def test_merge_policy_by_parameter():
+    date = FieldSchema("date")
+    assert merge_policy("Datum stanovení definitivní diagnózy", date) == MERGE_EARLIEST
+    assert merge_policy("Datum zahájení", date) == MERGE_EARLIEST
+    assert merge_policy("Datum operace", date) == MERGE_EARLIEST
+    assert merge_policy("Datum ukončení", date) == MERGE_LATEST
+    assert merge_policy("Datum ukončení série", date) == MERGE_LATEST
+    assert merge_policy("Datum hodnocení léčebné odpovědi", date) == MERGE_LATEST
+    assert merge_policy("Metastázy", FieldSchema("choice", ("játra", "plíce"), multiple=True)) == MERGE_UNION
+    assert merge_policy("ECOG", FieldSchema("ecog")) == MERGE_REPLACE
+
+def test_merge_replace():
+    current, _ = merge_parameter(None, record("ECOG", "1", 1, type="ecog"), 1, MERGE_REPLACE)
+    merged, change = merge_parameter(current, record("ECOG", "2", 2, "9", type="ecog"), 2, MERGE_REPLACE)
+    assert change == "updated"
+    assert merged.normalized == 2 and merged.sources == [{"document": 2, "line_reference": "9"}]
+
+def test_merge_earliest_keeps_first_date():
+    current, change = merge_parameter(None, record("Datum zahájení", "01.02.2024", "2024-02-01", type="date"), 1, MERGE_EARLIEST)
+    assert change == "added"
+    later, change = merge_parameter(current, record("Datum zahájení", "01.05.2024", "2024-05-01", type="date"), 2, MERGE_EARLIEST)
+    assert (later, change) == (current, "conflict")
+    earlier, change = merge_parameter(current, record("Datum zahájení", "15.01.2024", "2024-01-15", type="date"), 3, MERGE_EARLIEST)
+    assert change == "updated" and earlier.normalized == "2024-01-15"
+
+def test_merge_latest_replaces_end_date():
+    current, _ = merge_parameter(None, record("Datum ukončení", "01.02.2024", "2024-02-01", type="date"), 1, MERGE_LATEST)
+    later, change = merge_parameter(current, record("Datum ukončení", "01.05.2024", "2024-05-01", type="date"), 2, MERGE_LATEST)
+    assert change == "updated" and later.normalized == "2024-05-01"
+    earlier, change = merge_parameter(later, record("Datum ukončení", "01.01.2024", "2024-01-01", type="date"), 3, MERGE_LATEST)
+    assert (earlier, change) == (later, "conflict")
+
+def test_merge_union():
+    current, _ = merge_parameter(None, record("Metastázy", "játra", ["játra"], type="choice"), 1, MERGE_UNION)
+    merged, change = merge_parameter(current, record("Metastázy", "játra, plíce", ["játra", "plíce"], "4"), 2, MERGE_UNION)
+    assert change == "updated"
+    assert merged.normalized == ["játra", "plíce"] and merged.value == "játra, plíce"
+    assert [source["document"] for source in merged.sources] == [1, 2]
+    assert merge_parameter(merged, record("Metastázy", "plíce", ["plíce"]), 3, MERGE_UNION) == (merged, None)
+
+def test_empty_and_invalid_values_do_not_overwrite():
+    current, _ = merge_parameter(None, record("ECOG", "1", 1, type="ecog"), 1, MERGE_REPLACE)
+    assert merge_parameter(current, record("ECOG", "NA", None, type="ecog"), 2, MERGE_REPLACE) == (current, None)
+    assert merge_parameter(current, record("ECOG", "7", None, type="ecog", valid=False), 2, MERGE_REPLACE) == (current, None)
+
+SCHEMAS = [FieldSchema("date"), FieldSchema("date"), FieldSchema("ecog")]
+MERGE = partial(merge_records, schemas=SCHEMAS)
+
+def document(name: str, start: str, end: str, ecog: int) -> CaseDocument:
+    text = f"{name}: {start} {end} {ecog}"
+    return CaseDocument(name, text_digest(text), text, text, [
+        record("Datum zahájení", start, start, "1", "date"),
+        record("Datum ukončení", end, end, "2", "date"),
+        record("ECOG", str(ecog), ecog, "3", "ecog"),
+    ])
+
+@pytest.fixture
+def store(tmp_path):
+    return CaseStore(str(tmp_path / "cases.sqlite3"))
+
+def test_add_documents_merges_in_order(store):
+    seqs, diff = store.add_documents("case-1", "standard", "mock", [
+        document("first", "2024-02-01", "2024-03-01", 1),
+        document("second", "2024-04-01", "2024-06-01", 2),
+    ], MERGE)
+    assert seqs == [1, 2]
+    assert [(change["parameter"], change["change"], change["document"]) for change in diff] == [
+        ("Datum zahájení", "added", 1), ("Datum ukončení", "added", 1), ("ECOG", "added", 1),
+        ("Datum zahájení", "conflict", 2), ("Datum ukončení", "updated", 2), ("ECOG", "updated", 2),
+    ]
+    case = store.get("case-1")
+    assert [parameter["normalized"] for parameter in case["parameters"]] == ["2024-02-01", "2024-06-01", 2]
+    assert [item["name"] for item in case["documents"]] == ["first", "second"]
+
+def test_add_documents_skips_known_digest(store):
+    first = document("first", "2024-02-01", "2024-03-01", 1)
+    store.add_documents("case-1", "standard", "mock", [first], MERGE)
+    seqs, diff = store.add_documents("case-1", "standard", "mock", [first, document("third", "2024-02-01", "2024-03-01", 3)], MERGE)
+    assert seqs == [None, 2]
+    assert [(change["parameter"], change["change"]) for change in diff] == [("ECOG", "updated")]
+    assert store.documents("case-1", [first.digest]) == {first.digest: 1}
+
+def test_add_documents_rejects_other_analysis_type(store):
+    store.add_documents("case-1", "standard", "mock", [document("first", "2024-02-01", "2024-03-01", 1)], MERGE)
+    with pytest.raises(ValueError):
+        store.add_documents("case-1", "extended", "mock", [document("second", "2024-04-01", "2024-06-01", 2)], MERGE)
+    assert store.analysis_type("case-1") == "standard"
+    assert len(store.get("case-1")["documents"]) == 1
@@ -0,0 +1,91 @@
+import pytest
+
+from app.chunking import DATE_EARLIEST, DATE_LATEST, date_order, merge_chunk_responses, pick_value, split_numbered_text
+from app.prompt import ParameterSpec
+from app.response_parser import ResponseRow
+from app.validation import derive_schema, validate_value
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+PARAMETERS = [
+    ParameterSpec("Datum zahájení", "Chemotherapy start", "Datum (DD.MM.YYYY)"),
+    ParameterSpec("Datum ukončení", "Chemotherapy end", "Datum (DD.MM.YYYY)"),
+    ParameterSpec("Specifikace", "First specification", "text"),
+    ParameterSpec("Specifikace", "Second specification", "text"),
+    ParameterSpec("Histologie", "Histology", "text"),
+]
+
+def test_split_keeps_line_numbers_and_budget():
+    numbered_text = "\n".join(f"{number}: slovo slovo slovo" for number in range(1, 11))
+    windows = split_numbered_text(numbered_text, 10, count_words)
+    assert len(windows) > 1
+    assert all(count_words(window) + window.count("\n") + 1 <= 10 for window in windows)
+    assert "\n".join(windows) == numbered_text
+
+def test_split_long_line_repeats_its_number():
+    numbered_text = "1: krátký\n2: " + " ".join(["dlouhý"] * 50) + "\n3: konec"
+    windows = split_numbered_text(numbered_text, 10, count_words)
+    pieces = [line for window in windows for line in window.split("\n") if line.startswith("2: ")]
+    assert len(pieces) > 1
+    assert windows[0].startswith("1: ") and windows[-1].endswith("3: konec")
+
+@pytest.mark.parametrize("name, order", [
+    ("Datum stanovení definitivní diagnózy", DATE_EARLIEST),
+    ("Datum zahájení léčby", DATE_EARLIEST),
+    ("Chirurgická léčba-Datum operace", DATE_EARLIEST),
+    ("Pacient zařazený do intervenční klinické studie-Datum zařazení", DATE_EARLIEST),
+    ("Datum ukončení série", DATE_LATEST),
+    ("Datum hodnocení léčebné odpovědi", DATE_LATEST),
+    ("Stav nemoci Přešetření-Datum relapsu/progrese", DATE_LATEST),
+    ("Pacient zařazený do intervenční klinické studie-Datum vyřazení", DATE_LATEST),
+])
+def test_date_order(name, order):
+    assert date_order(name) == order
+
+def test_merge_picks_earliest_start_and_latest_end():
+    responses = [
+        "Datum zahájení,03.02.2024,5\nDatum ukončení,10.03.2024,6",
+        "Datum zahájení,01.06.2024,40\nDatum ukončení,20.07.2024,41",
+    ]
+    merged = merge_chunk_responses(responses, PARAMETERS)
+    assert merged[0] == ResponseRow("Datum zahájení", "03.02.2024", "5")
+    assert merged[1] == ResponseRow("Datum ukončení", "20.07.2024", "41")
+
+def test_merge_maps_repeated_names_in_order_and_prefers_longest_value():
+    responses = [
+        "Specifikace,levý prs,3\nSpecifikace,HER2+,4\nHistologie,NST,7",
+        "Specifikace,NA,0\nHistologie,invazivní karcinom NST,52",
+    ]
+    merged = merge_chunk_responses(responses, PARAMETERS)
+    assert merged[2] == ResponseRow("Specifikace", "levý prs", "3")
+    assert merged[3] == ResponseRow("Specifikace", "HER2+", "4")
+    assert merged[4] == ResponseRow("Histologie", "invazivní karcinom NST", "52")
+
+def test_merge_fills_missing_parameters():
+    merged = merge_chunk_responses(["Histologie,NST,2"], PARAMETERS)
+    assert [row.parameter for row in merged] == [spec.name for spec in PARAMETERS]
+    assert merged[0] == ResponseRow("Datum zahájení", "", "0")
+
+ALLERGY = ParameterSpec("Léková alergie", "Drug allergy", "ANO/NE/údaj není k dispozici")
+DOSE = ParameterSpec("Dávka", "Dose", "číslo [Gy]")
+
+def test_pick_choice_prefers_the_first_listed_option():
+    candidates = [
+        ResponseRow(ALLERGY.name, "údaj není k dispozici", "2"),
+        ResponseRow(ALLERGY.name, "ne", "5"),
+        ResponseRow(ALLERGY.name, "alergie na PNC", "7"),
+        ResponseRow(ALLERGY.name, "ANO", "40"),
+    ]
+    assert pick_value(ALLERGY, candidates) == ResponseRow(ALLERGY.name, "ANO", "40")
+    assert pick_value(ALLERGY, candidates[:3]) == ResponseRow(ALLERGY.name, "ne", "5")
+
+def test_pick_number_keeps_agreeing_values():
+    candidates = [ResponseRow(DOSE.name, "50 Gy", "12"), ResponseRow(DOSE.name, "50,0", "3")]
+    assert pick_value(DOSE, candidates) == ResponseRow(DOSE.name, "50,0", "3")
+
+def test_pick_number_flags_conflicting_values():
+    candidates = [ResponseRow(DOSE.name, "60 Gy", "40"), ResponseRow(DOSE.name, "50 Gy", "12"), ResponseRow(DOSE.name, "50", "41")]
+    row = pick_value(DOSE, candidates)
+    assert row == ResponseRow(DOSE.name, "50 Gy | 60 Gy", "12, 40")
+    assert validate_value(derive_schema(DOSE), row.value, {}) == (False, None, "conflicting values in different parts of the text")
@@ -0,0 +1,32 @@
+import asyncio
+import io
+
+import docx
+from fastapi import UploadFile
+
+from app import document_processor
+from app.document_processor import process_documents
+from conftest import BLOCKING_DELAY, Blocking, MemoryCache, with_loop_lag
+
+def docx_upload() -> UploadFile:
+    document = docx.Document()
+    document.add_paragraph("Diagnóza C50.4")
+    data = io.BytesIO()
+    document.save(data)
+    data.seek(0)
+    return UploadFile(filename="zprava.docx", file=data)
+
+def test_extraction_cache_does_not_block_the_event_loop(monkeypatch):
+    cache = MemoryCache()
+    monkeypatch.setattr(document_processor, "get_extraction_cache", lambda: Blocking(cache))
+    events = []
+
+    async def run():
+        progress = lambda kind, data: events.append(data)
+        return [await with_loop_lag(process_documents([docx_upload()], progress)) for _ in range(2)]
+
+    (first, first_lag), (second, second_lag) = asyncio.run(run())
+    assert first == second and "Diagnóza C50.4" in first[0]
+    assert list(cache.values.values()) == first
+    assert [event["cached"] for event in events] == [False, True]
+    assert max(first_lag, second_lag) < BLOCKING_DELAY / 2
@@ -0,0 +1,36 @@
+import asyncio
+import time
+
+import pytest
+
+from app.executor import StageExecutor
+from app.metrics import STAGE_DURATION, span, track_request
+
+def parse(text: str) -> str:
+    with span("test_parse"):
+        time.sleep(0.01)
+        with span("test_tokenize"):
+            return text.upper()
+
+def parse_count() -> int:
+    return STAGE_DURATION.collect().get(("test_parse",), ([], 0.0, 0))[2]
+
+@pytest.mark.parametrize("kind", ["thread", "process"])
+def test_spans_of_workers_reach_the_request(kind):
+    executor = StageExecutor("test", kind, 1)
+    parsed_before = parse_count()
+
+    async def run():
+        with track_request() as request_metrics:
+            result = await executor.run(parse, "zpráva")
+        return result, request_metrics.breakdown()
+
+    try:
+        result, breakdown = asyncio.run(run())
+    finally:
+        executor.shutdown()
+    assert result == "ZPRÁVA"
+    assert set(breakdown["stages"]) == {"test_parse", "test_tokenize"}
+    assert breakdown["stages"]["test_parse"] >= 0.01
+    # Observed once in this process's histogram, also for a worker process
+    assert parse_count() == parsed_before + 1
@@ -0,0 +1,76 @@
+"""XLSX/DOCX extraction of large files, each run in a fresh process whose peak RSS is reset after the imports."""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from app.document_processor import TRUNCATION_MARKER
+from benchmarks.extraction_memory_benchmark import make_docx, make_xlsx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+XLSX_ROWS = 40000
+DOCX_ROWS = 5000
+# Peak RSS above the baseline: streaming the workbook takes about 10 MB where a
+# full load takes about 95 MB; the DOCX table (python-docx loads the whole
+# document) about 27 MB
+MAX_XLSX_RSS_MB = 32
+MAX_DOCX_RSS_MB = 64
+
+CHILD = """
+import json, sys
+import docx, openpyxl
+from app import document_processor
+from benchmarks.extraction_memory_benchmark import current_rss_kb, peak_rss_kb, reset_peak_rss
+
+extract = {"xlsx": document_processor.extract_text_from_xlsx, "docx": document_processor.extract_text_from_docx}[sys.argv[1]]
+reset_peak_rss()
+baseline = current_rss_kb()
+text = extract(sys.argv[2])
+peak = peak_rss_kb()
+json.dump({"text": text, "extraction_rss_mb": max(peak - baseline, 0) / 1024}, sys.stdout)
+"""
+
+@pytest.fixture(scope="module")
+def files(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("extraction")
+    xlsx_path, docx_path = str(directory / "large.xlsx"), str(directory / "large.docx")
+    make_xlsx(xlsx_path, XLSX_ROWS)
+    make_docx(docx_path, DOCX_ROWS)
+    return {"xlsx": xlsx_path, "docx": docx_path}
+
+def extract(kind: str, path: str, max_rows: int = 20000, max_cells: int = 500000) -> dict:
+    env = {**os.environ, "PYTHONPATH": BACKEND_DIR, "XLSX_MAX_ROWS": str(max_rows), "XLSX_MAX_CELLS": str(max_cells)}
+    result = subprocess.run([sys.executable, "-c", CHILD, kind, path], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout)
+
+def data_rows(text: str) -> list:
+    return [line for line in text.split("\n") if line and not line.startswith(("Sheet: ", TRUNCATION_MARKER))]
+
+def test_xlsx_peak_rss_and_row_cap(files):
+    result = extract("xlsx", files["xlsx"], max_rows=20000)
+    assert result["extraction_rss_mb"] < MAX_XLSX_RSS_MB
+    assert TRUNCATION_MARKER in result["text"]
+    assert len(data_rows(result["text"])) == 20000
+
+def test_xlsx_cell_cap(files):
+    result = extract("xlsx", files["xlsx"], max_rows=10 ** 6, max_cells=2000)
+    assert TRUNCATION_MARKER in result["text"]
+    cells = sum(len(row.split(",")) for row in data_rows(result["text"]))
+    # The row that would pass the cap (at most 5 cells) is left out whole
+    assert 2000 - 5 < cells <= 2000
+
+def test_xlsx_below_caps_is_complete(files):
+    result = extract("xlsx", files["xlsx"], max_rows=10 ** 6, max_cells=10 ** 7)
+    assert result["extraction_rss_mb"] < MAX_XLSX_RSS_MB
+    assert TRUNCATION_MARKER not in result["text"]
+    assert len(data_rows(result["text"])) == XLSX_ROWS + 1
+
+def test_docx_peak_rss(files):
+    result = extract("docx", files["docx"])
+    assert result["extraction_rss_mb"] < MAX_DOCX_RSS_MB
+    lines = result["text"].split("\n")
+    assert len(lines) == DOCX_ROWS + 2
+    assert lines[-1] == "Závěr: invazivní karcinom NST"
@@ -0,0 +1,94 @@
+import asyncio
+import io
+
+from fastapi import UploadFile
+
+from app import jobs
+from app.jobs import JobQueue, JobStore
+from conftest import BLOCKING_DELAY, Blocking, with_loop_lag
+
+def test_jobs_do_not_block_the_event_loop(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOBS_DIR", str(tmp_path / "jobs"))
+    monkeypatch.setattr(jobs, "JOB_POLL_INTERVAL", 0.05)
+    store = Blocking(JobStore(str(tmp_path / "jobs.sqlite3")))
+
+    async def handler(files, text_input, model, analysis_type, use_cache, cascade):
+        return {"content": [file.file.read().decode() for file in files], "text": text_input, "cascade": cascade}
+
+    async def run_job(queue):
+        job_id = await queue.submit([UploadFile(filename="report.TXT", file=io.BytesIO(b"obsah"))], "text", "mock", "standard", cascade=True)
+        for _ in range(100):
+            job = await queue.get(job_id)
+            if job["status"] == "completed":
+                return job
+            await asyncio.sleep(0.02)
+
+    async def run():
+        queue = JobQueue(store, handler, workers=1)
+        await queue.start()
+        job, lag = await with_loop_lag(run_job(queue))
+        stats = await queue.stats()
+        await queue.stop()
+        return job, lag, stats
+
+    job, lag, stats = asyncio.run(run())
+    assert job["status"] == "completed"
+    assert job["result"] == {"content": ["obsah"], "text": "text", "cascade": True}
+    assert stats["jobs"] == {"completed": 1}
+    assert not (tmp_path / "jobs" / job["id"]).exists()
+    assert lag < BLOCKING_DELAY / 2
+
+class FlakyStore:
+    """JobStore proxy whose first heartbeat fails."""
+
+    def __init__(self, store):
+        self.store = store
+        self.heartbeats = 0
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def heartbeat(self, job_ids):
+        self.heartbeats += 1
+        if self.heartbeats == 1:
+            raise RuntimeError("database is locked")
+        return self.store.heartbeat(job_ids)
+
+def test_heartbeat_survives_store_errors(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(jobs, "JOB_LEASE_S", 0.06)
+    store = FlakyStore(JobStore(str(tmp_path / "jobs.sqlite3")))
+
+    async def run():
+        queue = JobQueue(store, None, workers=1)
+        await queue.start()
+        await asyncio.sleep(0.2)
+        await queue.stop()
+
+    asyncio.run(run())
+    assert store.heartbeats >= 3
+    assert "Error in job heartbeat: database is locked" in capsys.readouterr().out
+
+def test_handler_errors_fail_the_job(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, "JOBS_DIR", str(tmp_path / "jobs"))
+    monkeypatch.setattr(jobs, "JOB_POLL_INTERVAL", 0.05)
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+
+    async def handler(files, text_input, model, analysis_type, use_cache, cascade):
+        return {"success": False, "error": "Error: LLM provider unavailable", "response": "Error: LLM provider unavailable"}
+
+    async def run():
+        queue = JobQueue(store, handler, workers=1)
+        await queue.start()
+        job_id = await queue.submit([], "text", "mock", "standard")
+        for _ in range(100):
+            job = await queue.get(job_id)
+            if job["status"] not in ("queued", "running"):
+                break
+            await asyncio.sleep(0.02)
+        await queue.stop()
+        return job
+
+    job = asyncio.run(run())
+    assert job["status"] == "failed"
+    assert job["error"] == "Error: LLM provider unavailable"
+    assert job["result"]["success"] is False
@@ -0,0 +1,48 @@
+import asyncio
+
+from app import llm_service
+from conftest import BLOCKING_DELAY, Blocking, MemoryCache, with_loop_lag
+
+def test_completion_cache_does_not_block_the_event_loop(monkeypatch):
+    cache = MemoryCache()
+    calls = []
+
+    async def provider(prompt, model, structured):
+        calls.append(prompt)
+        return "Pohlaví,Žena,1"
+
+    monkeypatch.setattr(llm_service, "get_llm_cache", lambda: Blocking(cache))
+    monkeypatch.setattr(llm_service, "get_local_llm_response", provider)
+    monkeypatch.setattr(llm_service, "get_openai_response", provider)
+
+    async def run():
+        return [await with_loop_lag(llm_service.get_completion("prompt", "mock-model")) for _ in range(2)]
+
+    (miss, miss_lag), (hit, hit_lag) = asyncio.run(run())
+    assert miss == hit == "Pohlaví,Žena,1"
+    # The second answer came from the cache
+    assert calls == ["prompt"] and list(cache.values.values()) == ["Pohlaví,Žena,1"]
+    assert max(miss_lag, hit_lag) < BLOCKING_DELAY / 2
+
+def test_streamed_completion_cache_does_not_block_the_event_loop(monkeypatch):
+    cache = MemoryCache()
+    streams = []
+
+    async def stream(prompt, model):
+        streams.append(prompt)
+        for delta in ("Pohlaví,", "Žena,1"):
+            yield delta
+
+    monkeypatch.setattr(llm_service, "get_llm_cache", lambda: Blocking(cache))
+    monkeypatch.setattr(llm_service, "stream_completion", stream)
+
+    async def collect():
+        return "".join([delta async for delta in llm_service.stream_llm_response(["Pacientka"], "mock-model")])
+
+    async def run():
+        return [await with_loop_lag(collect()) for _ in range(2)]
+
+    (miss, miss_lag), (hit, hit_lag) = asyncio.run(run())
+    assert miss == hit == "Pohlaví,Žena,1"
+    assert len(streams) == 1
+    assert max(miss_lag, hit_lag) < BLOCKING_DELAY / 2
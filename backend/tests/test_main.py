@@ -0,0 +1,35 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app import main
+
+ERROR = "Error: LLM provider unavailable"
+
+@pytest.fixture
+def failing_llm(monkeypatch):
+    async def resolve_model(model):
+        return model
+
+    async def extract_parameters(texts, model, analysis_type, use_cache=True, cascade=None):
+        return {"response": ERROR, "records": [], "token_budget": None, "cascade": None}
+
+    monkeypatch.setattr(main, "resolve_model", resolve_model)
+    monkeypatch.setattr(main, "extract_parameters", extract_parameters)
+
+def test_pipeline_reports_llm_errors(failing_llm):
+    result = asyncio.run(main.run_process_pipeline(None, "Pacient Jan Novák", "mock", "standard"))
+    assert result["success"] is False
+    assert result["error"] == ERROR
+
+def test_process_fails_on_llm_errors(failing_llm):
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(main.process_data(None, "Pacient Jan Novák", "mock", "standard", True, False, None))
+    assert error.value.status_code == 502
+    assert error.value.detail == ERROR
+
+def test_batch_counts_llm_errors_as_failures(failing_llm):
+    batch = main.BatchRequest(documents=[main.BatchDocument(id="a", text="Pacient Jan Novák")], model="mock")
+    result = asyncio.run(main.process_batch(batch))
+    assert [(item["id"], item["success"], item["error"]) for item in result["results"]] == [("a", False, ERROR)]
@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from app import metrics
+from app.metrics import Counter, Histogram, Registry
+
+@pytest.fixture
+def multiproc_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_MULTIPROC_DIR", str(tmp_path))
+    return tmp_path
+
+def make_registry():
+    registry = Registry()
+    counter = registry.register(Counter("test_requests_total", "Requests.", ("path",)))
+    histogram = registry.register(Histogram("test_duration_seconds", "Duration.", (), (0.1, 1)))
+    return registry, counter, histogram
+
+def run_in_worker(work):
+    """Run work in a forked process, like a worker of app.serve."""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            work()
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+
+def test_values_are_summed_over_workers(multiproc_dir):
+    registry, counter, histogram = make_registry()
+
+    def worker():
+        counter.inc(2, path="/a")
+        histogram.observe(0.5)
+        registry.write_snapshot()
+
+    run_in_worker(worker)
+    run_in_worker(worker)
+    counter.inc(1, path="/a")
+    histogram.observe(0.05)
+
+    assert registry.value(counter, path="/a") == 5
+    rendered = registry.render()
+    assert 'test_requests_total{path="/a"} 5' in rendered
+    assert 'test_duration_seconds_bucket{le="0.1"} 1' in rendered
+    assert 'test_duration_seconds_bucket{le="1"} 3' in rendered
+    assert "test_duration_seconds_count 3" in rendered
+
+def test_own_snapshot_is_not_counted_twice(multiproc_dir):
+    registry, counter, _ = make_registry()
+    counter.inc(3, path="/a")
+    registry.write_snapshot()
+    assert registry.value(counter, path="/a") == 3
+
+def test_without_directory_values_are_per_process(monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_MULTIPROC_DIR", "")
+    registry, counter, _ = make_registry()
+    counter.inc(path="/a")
+    registry.write_snapshot()
+    assert registry.value(counter, path="/a") == 1
@@ -0,0 +1,39 @@
+import pytest
+
+from app.prompt import number_lines
+from app.rules import extract_rules
+
+def resolved(text: str, analysis_type: str = "standard") -> dict:
+    return {row.parameter: row.value for row in extract_rules(number_lines([text]), analysis_type).values()}
+
+@pytest.mark.parametrize("text", [
+    "Léčba paklitaxelem (PTX)",
+    "Plán: CTx FOLFOX",
+    "CT0 hrudníku",
+    "Nález cN1 v uzlinách",
+    "Stav po pT2",
+])
+def test_tnm_outside_tnm_context_is_ignored(text):
+    assert not {"cT", "cN", "cM", "pT", "pN", "pM"} & resolved(text).keys()
+
+@pytest.mark.parametrize("text, expected", [
+    ("cT2 N1 M0", {"cT": "2", "cN": "1", "cM": "0"}),
+    ("TNM: cT4 cN2 cM0, pT4 pN2", {"cT": "4", "cN": "2", "cM": "0", "pT": "4", "pN": "2"}),
+    ("ypT2 ypN0", {"pT": "2", "pN": "0"}),
+    ("pTx pN1", {"pT": "X", "pN": "1"}),
+    ("TNM: pN1", {"pN": "1"}),
+    ("Stadium: cT3", {"cT": "3"}),
+])
+def test_tnm_in_tnm_context(text, expected):
+    assert {key: value for key, value in resolved(text).items() if key in expected} == expected
+
+@pytest.mark.parametrize("text, expected", [
+    ("Pacient/ka poučen/a o výkonu", None),
+    ("Pacient přichází na kontrolu", None),
+    ("Pacientka přichází na kontrolu", "Žena"),
+    ("Předáno pacientce do vlastních rukou", "Žena"),
+    ("Pohlaví: muž", "Muž"),
+    ("Pohlaví: žena", "Žena"),
+])
+def test_sex_only_from_label_or_feminine_form(text, expected):
+    assert resolved(text).get("Pohlaví") == expected
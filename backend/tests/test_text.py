@@ -0,0 +1,20 @@
+import re
+
+from app.text import fold, trie_regex
+
+def test_trie_regex_prefers_the_longest_word():
+    pattern = re.compile(trie_regex(["nova", "novak", "novakova", "jan"]))
+    assert [match.group() for match in pattern.finditer("novakova, novak, nova, jana")] == ["novakova", "novak", "nova", "jan"]
+
+def test_trie_regex_escapes_special_characters():
+    assert re.fullmatch(trie_regex(["c50.4", "t1(m)"]), "t1(m)")
+    assert not re.fullmatch(trie_regex(["c50.4"]), "c5014")
+
+def test_fold_removes_case_and_diacritics():
+    assert fold("Léková ALERGIE") == "lekova alergie"
+    assert fold("Nova\u0301k") == "novak"
+    assert fold("Straße") == "strasse"
+
+def test_fold_keeps_whitespace_unless_collapsed():
+    assert fold(" Údaj  není\nk dispozici ") == " udaj  neni\nk dispozici "
+    assert fold(" Údaj  není\nk dispozici ", collapse_whitespace=True) == "udaj neni k dispozici"
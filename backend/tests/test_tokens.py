@@ -0,0 +1,20 @@
+import pytest
+
+from app.tokens import encoding_name, get_encoder
+
+tiktoken = pytest.importorskip("tiktoken")
+
+def test_gpt4o_family_uses_o200k_base():
+    for model in ("gpt-4o", "gpt-4o-mini", "gpt-4.1", "o3-mini"):
+        assert encoding_name(model) == "o200k_base"
+    assert "o200k_base" in tiktoken.list_encoding_names()
+
+def test_get_encoder_gpt4o():
+    encoder = get_encoder("gpt-4o")
+    if encoder is None:
+        pytest.skip("the o200k_base BPE file cannot be loaded (offline)")
+    assert encoder.name == "o200k_base"
+
+def test_unknown_encoding_is_reported(capsys):
+    get_encoder("no_such_encoding")
+    assert "no no_such_encoding encoding" in capsys.readouterr().out
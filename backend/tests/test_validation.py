@@ -0,0 +1,108 @@
+import pytest
+
+from app.prompt import ParameterSpec, prompt_registry
+from app.response_parser import ResponseRow
+from app.validation import FieldSchema, derive_schema, get_schemas, validate_rows, validate_value
+
+ENUMS = prompt_registry.enums()
+
+def spec(value_format: str, name: str = "Parametr") -> ParameterSpec:
+    return ParameterSpec(name, "", value_format)
+
+@pytest.mark.parametrize("value_format, expected", [
+    ("Datum (DD.MM.RRRR)", FieldSchema("date")),
+    ("Datum (RRRR)", FieldSchema("year")),
+    ("integer", FieldSchema("integer")),
+    ("číslo [cm]", FieldSchema("number", unit="cm")),
+    ("výběr {číselník MKN}", FieldSchema("mkn")),
+    ("ANO/NE/údaj není k dispozici", FieldSchema("choice", ("ANO", "NE", "údaj není k dispozici"))),
+    ("výběr {vpravo, vlevo, oboustranně}", FieldSchema("choice", ("vpravo", "vlevo", "oboustranně"))),
+    ("číselník (mozek, plíce, játra); více možností", FieldSchema("choice", ("mozek", "plíce", "játra"), multiple=True)),
+    ("výběr {0-100}", FieldSchema("text")),
+    ("text", FieldSchema("text")),
+])
+def test_derive_schema(value_format, expected):
+    assert derive_schema(spec(value_format)) == expected
+
+def test_derive_ecog_schema_from_parameters_file():
+    parameters, schemas = get_schemas("standard")
+    schema = schemas[[parameter.name for parameter in parameters].index("Performance status (ECOG)")]
+    assert schema == FieldSchema("ecog", ("0", "1", "2", "3", "4", "5"))
+
+@pytest.mark.parametrize("schema, value, expected", [
+    (FieldSchema("date"), "3. 2. 2024", "2024-02-03"),
+    (FieldSchema("date"), "2024-02-03", "2024-02-03"),
+    (FieldSchema("date"), "02/2024", "2024-02"),
+    (FieldSchema("date"), "2024", "2024"),
+    (FieldSchema("year"), "2019", 2019),
+    (FieldSchema("year"), "rok 2019", 2019),
+    (FieldSchema("integer"), "72", 72),
+    (FieldSchema("number", unit="cm"), "172,5 cm", 172.5),
+    (FieldSchema("number"), "<5", 5.0),
+    (FieldSchema("mkn"), "C50.4 karcinom prsu", "C50.4"),
+    (FieldSchema("mkn", multiple=True), "C50.4; C77.3", ["C50.4", "C77.3"]),
+    (FieldSchema("ecog", ("0", "1", "2", "3", "4", "5")), "1 - omezení fyzicky náročných aktivit", 1),
+    (FieldSchema("choice", ("Muž", "Žena", "nespecifikováno")), "zena", "Žena"),
+    (FieldSchema("choice", ("Kompletní remise (CR)", "Progrese(PD)")), "CR", "Kompletní remise (CR)"),
+    (FieldSchema("choice", ("mozek", "plíce", "játra"), multiple=True), "Játra, plíce", ["játra", "plíce"]),
+    (FieldSchema("text"), " invazivní karcinom ", "invazivní karcinom"),
+])
+def test_valid_values(schema, value, expected):
+    assert validate_value(schema, value, ENUMS) == (True, expected, None)
+
+@pytest.mark.parametrize("schema, value", [
+    (FieldSchema("date"), "31.13.2024"),
+    (FieldSchema("date"), "únor 2024"),
+    (FieldSchema("year"), "loni"),
+    (FieldSchema("integer"), "72,5"),
+    (FieldSchema("number", unit="kg"), "hubený"),
+    (FieldSchema("mkn"), "karcinom prsu"),
+    (FieldSchema("mkn"), "I10"),
+    (FieldSchema("mkn", multiple=True), "C50.4, X99"),
+    (FieldSchema("ecog", ("0", "1", "2", "3", "4", "5")), "dobrý"),
+    (FieldSchema("choice", ("Muž", "Žena", "nespecifikováno")), "jiné"),
+    (FieldSchema("choice", ("mozek", "plíce", "játra"), multiple=True), "játra, kost"),
+])
+def test_invalid_values(schema, value):
+    valid, normalized, error = validate_value(schema, value, ENUMS)
+    assert not valid and normalized is None and error
+
+@pytest.mark.parametrize("value", ["", "NA", "neuvedeno", "Nezjištěno"])
+def test_empty_values_are_valid_for_every_type(value):
+    for schema in (FieldSchema("date"), FieldSchema("mkn"), FieldSchema("choice", ("ANO", "NE"))):
+        assert validate_value(schema, value, ENUMS) == (True, None, None)
+
+def records_by_index(rows, indexes=None):
+    return validate_rows(rows, "standard", indexes)
+
+def test_repeated_names_map_in_order():
+    parameters, _ = get_schemas("standard")
+    names = [parameter.name for parameter in parameters]
+    first, second = [index for index, name in enumerate(names) if name == "Specifikace"]
+    records = records_by_index([
+        ResponseRow("Specifikace", "penicilin", "4"),
+        ResponseRow("Specifikace", "jodová kontrastní látka", "9"),
+    ])
+    assert (records[first].value, records[first].line_reference) == ("penicilin", "4")
+    assert (records[second].value, records[second].line_reference) == ("jodová kontrastní látka", "9")
+
+def test_records_follow_parameter_order_and_report_missing_values():
+    parameters, _ = get_schemas("standard")
+    records = records_by_index([ResponseRow("Pohlaví", "Žena", "0"), ResponseRow("Výška", "165 cm", "2")])
+    assert [record.parameter for record in records] == [parameter.name for parameter in parameters]
+    by_name = {record.parameter: record for record in records}
+    assert by_name["Výška"].valid and by_name["Výška"].normalized == 165.0
+    assert (by_name["Pohlaví"].valid, by_name["Pohlaví"].error) == (False, "missing line reference")
+    assert (by_name["Hmotnost"].valid, by_name["Hmotnost"].error) == (False, "missing from response")
+
+def test_records_for_a_parameter_subset():
+    parameters, _ = get_schemas("standard")
+    indexes = [index for index, parameter in enumerate(parameters) if parameter.name in ("Specifikace", "Lateralita")]
+    records = records_by_index([
+        ResponseRow("Lateralita", "vlevo", "3"),
+        ResponseRow("Specifikace", "penicilin", "4"),
+        ResponseRow("Specifikace", "NA", "0"),
+    ], indexes)
+    assert [(record.parameter, record.normalized, record.valid) for record in records] == [
+        ("Specifikace", "penicilin", True), ("Specifikace", None, True), ("Lateralita", "vlevo", True),
+    ]
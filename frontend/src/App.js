@@ -197,7 +197,8 @@ function App() {
       }
     });
     
-    setExpandedCategories(categories);
+    // Keep categories the user already expanded while rows are streaming in
+    setExpandedCategories(prev => ({ ...categories, ...prev }));
     return parsedLines.filter(item => item.category && item.parameter);
   };
 
@@ -229,24 +230,64 @@ function App() {
     formData.append('model', selectedModel);
     formData.append('analysis_type', analysisType);
 
+    const parseResponse = (responseText) => (
+      analysisType === 'standard'
+        ? parseStandardResponse(responseText)
+        : parseExtendedResponse(responseText)
+    );
+
     try {
-      const result = await axios.post(`${API_URL}/api/process`, formData, {
-        headers: {
-          'Content-Type': 'multipart/form-data'
-        }
+      // Stream progress and parameter rows as server-sent events
+      const result = await fetch(`${API_URL}/api/process/stream`, {
+        method: 'POST',
+        body: formData
       });
 
-      setResponse(result.data.response);
-      setCombinedText(result.data.combined_text);
-      
-      if (analysisType === 'standard') {
-        setParsedData(parseStandardResponse(result.data.response));
-      } else {
-        setParsedData(parseExtendedResponse(result.data.response));
+      if (!result.ok || !result.body) {
+        const errorData = await result.json().catch(() => ({}));
+        throw new Error(errorData.detail || 'Something went wrong. Please try again.');
+      }
+
+      const reader = result.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let streamedText = '';
+
+      const handleEvent = (event, data) => {
+        if (event === 'anonymized') {
+          setCombinedText(data.combined_text);
+        } else if (event === 'row') {
+          streamedText += data.line + '\n';
+          setResponse(streamedText);
+          setParsedData(parseResponse(streamedText));
+        } else if (event === 'done') {
+          setResponse(data.response);
+          setParsedData(parseResponse(data.response));
+        } else if (event === 'error') {
+          throw new Error(data.detail);
+        }
+      };
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const messages = buffer.split('\n\n');
+        buffer = messages.pop();
+
+        messages.forEach(message => {
+          const eventLine = message.split('\n').find(line => line.startsWith('event: '));
+          const dataLine = message.split('\n').find(line => line.startsWith('data: '));
+          if (eventLine && dataLine) {
+            handleEvent(eventLine.slice(7), JSON.parse(dataLine.slice(6)));
+          }
+        });
       }
     } catch (error) {
       console.error("Error processing documents:", error);
-      setResponse(`Error: ${error.response?.data?.detail || 'Something went wrong. Please try again.'}`);
+      setParsedData([]);
+      setResponse(`Error: ${error.message || 'Something went wrong. Please try again.'}`);
     } finally {
       setLoading(false);
     }
@@ -1,127 +1,225 @@
 import os
-import pandas as pd
-import requests
+import asyncio
+import csv
 import glob
-import time
-from tqdm import tqdm
 import argparse
+import importlib.util
+import aiohttp
+import pandas as pd
+from tqdm import tqdm
+
+
+def read_text_file(file_path):
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return f.read()
 
-def process_file(file_path, api_url="http://localhost:8000/api/process"):
+async def process_batch(session, file_paths, api_url, model, analysis_type, use_cache=True, retries=3):
     """
-    Process a single text file using the API and return the response
+    Send a batch of text files to the batch API and return {file_path: result},
+    where result holds the raw response and the validated records
     """
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            text_content = f.read()
-        
-        # Prepare the data for the API request
-        files = {}
-        data = {
-            'text_input': text_content,
-            'model': 'gpt-4o-mini',  # Default model
-            'analysis_type': 'standard'  # Default analysis type
-        }
-        
-        # Make the API request
-        response = requests.post(api_url, data=data, files=files)
-        
-        if response.status_code == 200:
-            return response.json()['response']
-        else:
-            print(f"Error processing file {file_path}: {response.status_code}")
-            print(response.text)
-            return None
-    except Exception as e:
-        print(f"Exception processing file {file_path}: {str(e)}")
-        return None
-
-def extract_values_from_response(response:str) -> dict[str,str]:
+    # Read in threads so slow disks do not stall the other batches' requests
+    texts = await asyncio.gather(*[asyncio.to_thread(read_text_file, file_path) for file_path in file_paths])
+    documents = [{'id': file_path, 'text': text} for file_path, text in zip(file_paths, texts)]
+    payload = {'documents': documents, 'model': model, 'analysis_type': analysis_type, 'use_cache': use_cache}
+
+    for attempt in range(retries + 1):
+        try:
+            async with session.post(api_url, json=payload) as response:
+                if response.status == 200:
+                    data = await response.json()
+                    results = {}
+                    for result in data['results']:
+                        if result['success']:
+                            results[result['id']] = result
+                        else:
+                            tqdm.write(f"Error processing file {result['id']}: {result['error']}")
+                    return results
+
+                if response.status not in (429, 500, 502, 503, 504) or attempt == retries:
+                    tqdm.write(f"Error processing batch starting with {file_paths[0]}: {response.status}")
+                    tqdm.write(await response.text())
+                    return {}
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt == retries:
+                tqdm.write(f"Exception processing batch starting with {file_paths[0]}: {str(e)}")
+                return {}
+
+        await asyncio.sleep(2 ** attempt)
+
+def order_values(pairs, columns) -> list[str]:
     """
-    Extract the second column (values) from the CSV-formatted response
+    Order (parameter, value) pairs like columns; repeated parameter
+    names fill the matching columns in order of appearance.
     """
-    if not response:
-        return {}
-    
-    values = {}
-    lines = response.strip().split('\n')
-    
-    for line in lines:
-        parts = line.split(',')
-        if len(parts) >= 2:
-            param_name = parts[0].strip()
-            param_value = parts[1].strip()
-            values[param_name] = param_value
-    
+    values = [''] * len(columns)
+    positions = {}
+    for index, parameter in enumerate(columns):
+        positions.setdefault(parameter, []).append(index)
+
+    seen = {}
+    for param_name, param_value in pairs:
+        indexes = positions.get(param_name)
+        if not indexes:
+            continue
+        occurrence = seen.get(param_name, 0)
+        seen[param_name] = occurrence + 1
+        if occurrence < len(indexes):
+            values[indexes[occurrence]] = param_value.strip()
+
     return values
 
-def save_row(row:str, output_path='./processed_data.pkl'):
+def extract_pairs_from_response(response: str) -> list[tuple[str, str]]:
     """
-    Appends row to the output file.
+    Extract (parameter, value) pairs from the CSV-formatted response.
+    Quoted values may contain commas.
     """
-    with open(output_path, 'at') as output:
-        print(row,file=output)
-    return
+    if not response:
+        return []
+
+    lines = [line.strip() for line in response.strip().split('\n')]
+    lines = [line for line in lines if line and not line.startswith('```')]
+
+    pairs = []
+    for parts in csv.reader(lines, skipinitialspace=True):
+        if len(parts) < 2:
+            continue
+        # Unquoted commas in the value: the line reference is the last column
+        pairs.append((parts[0].strip(), ', '.join(parts[1:-1]) if len(parts) > 3 else parts[1]))
 
-def get_already_processed_files(csv_path):
+    return pairs
+
+def extract_pairs(result) -> list[tuple[str, str]]:
     """
-    Read the first column (file_path) from the output CSV to skip reprocessing
+    (parameter, value) pairs of one batch result, in parameter order,
+    preferring the server-side validated records
     """
-    if not os.path.exists(csv_path):
-        return set()
+    if result.get('records'):
+        return [(record['parameter'], record['value']) for record in result['records']]
+    return extract_pairs_from_response(result.get('response'))
 
-    processed = set()
-    with open(csv_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            if line.strip():
-                parts = line.strip().split(',')
-                if parts:
-                    if parts[-1] != 'file_path':
-                        processed.add(parts[-1])
-    return processed
+class ResultWriter:
+    """
+    Buffered CSV writer plus an append-only progress file listing finished inputs,
+    so a restart only reads the (small) progress file instead of the output.
 
-def main():
-    parser = argparse.ArgumentParser(description='Process text files using the backend API')
-    parser.add_argument('input_dir', help='Directory containing text files to process')
-    parser.add_argument('--output', default='./processed_data.pkl', help='Output file path (pickle format)')
-    parser.add_argument('--api_url', default='http://localhost:8000/api/process', help='API endpoint URL')
-    args = parser.parse_args()
-    
-    header = 'Předchozí onkologické onemocnění,Výška,Hmotnost,BMI,Pohlaví,Léková alergie,Specifikace,Alergie na jód/kontrastní látky,Specifikace,Performance status (ECOG),Datum stanovení definitivní diagnózy,Diagnóza - kód MKN,Lateralita,Grading (diferenciace nádoru) G,ORPHA kód,cT,četnost,cN,cM,y,r,a,pT,pN,pM,Stádium,Lokalizace metastáz,Výběr diagnostické skupiny,Datum zahájení léčby,Datum operace,Datum zahájení,Datum ukončení,Datum zahájení  série,Datum ukončení série,Zevní radioterapie,Typ zevní RT,Brachyterapie,Datum hodnocení léčebné odpovědi,Hodnocená léčebná odpověď,Progrese'
-    categories = header.split(',')
+    The columns are the parameters of the analysis type, in order, taken from
+    the first result (or from the header of the output being resumed).
+    """
+
+    def __init__(self, output_path, flush_every=50):
+        self.output_path = output_path
+        self.progress_path = output_path + '.progress'
+        self.flush_every = flush_every
+        self.pending = 0
+
+        self.columns = None
+        if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+            with open(output_path, 'r', encoding='utf-8', newline='') as f:
+                self.columns = next(csv.reader(f))[:-1]
+        self.output = open(output_path, 'a', encoding='utf-8', newline='')
+        self.progress = open(self.progress_path, 'a', encoding='utf-8')
+        self.writer = csv.writer(self.output)
+
+    def write(self, file_path, result):
+        pairs = extract_pairs(result)
+        if self.columns is None:
+            self.columns = [parameter for parameter, _ in pairs]
+            self.writer.writerow(self.columns + ['file_path'])
+        elif pairs and not {parameter for parameter, _ in pairs} <= set(self.columns):
+            raise ValueError(f"{self.output_path} has columns of another analysis type; choose another --output")
+        self.writer.writerow(order_values(pairs, self.columns) + [file_path])
+        self.progress.write(file_path + '\n')
+        self.pending += 1
+        if self.pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        # Rows must hit the disk before they are recorded as done
+        self.output.flush()
+        self.progress.flush()
+        self.pending = 0
+
+    def close(self):
+        self.flush()
+        self.output.close()
+        self.progress.close()
 
+def get_already_processed_files(output_path):
+    """
+    Read the progress file written next to the output to skip reprocessing
+    """
+    progress_path = output_path + '.progress'
+    if not os.path.exists(progress_path):
+        return set()
 
-    text_files = glob.glob(os.path.join(args.input_dir, '*.txt'))
+    with open(progress_path, 'r', encoding='utf-8') as f:
+        return {line.rstrip('\n') for line in f if line.strip()}
+
+def convert_to_parquet(csv_path, parquet_path):
+    df = pd.read_csv(csv_path, dtype=str, keep_default_na=False)
+    df.to_parquet(parquet_path, index=False)
+
+async def run(args):
+    text_files = sorted(glob.glob(os.path.join(args.input_dir, '*.txt')))
     print(f"Found {len(text_files)} text files")
 
     processed_files = get_already_processed_files(args.output)
     text_files = [f for f in text_files if f not in processed_files]
     print(f"Skipping {len(processed_files)} already processed files")
-    if len(processed_files) == 0:
-        save_row(header + ',file_path',args.output)
 
-    # Process each file
-    for file_path in tqdm(text_files):
-        try:
-            # Process the file using the API
-            response = process_file(file_path, api_url=args.api_url)
-            
-            # Extract values from the response
-            response_parameters_dict = extract_values_from_response(response)
-            
-            if response_parameters_dict:
-                values = []
-                for parameter in categories:
-                    value = ''
-                    if parameter in response_parameters_dict.keys():
-                        value = response_parameters_dict[parameter]
-                    values.append(value)
-                row = ','.join(values) + ',' + file_path
-                save_row(row, args.output)
-            
-        except Exception as e:
-            print(f"Error processing {file_path}: {str(e)}")
-    
-    print(f"Processing complete. Processed {len(text_files)} files.")
+    batches = [text_files[i:i + args.batch_size] for i in range(0, len(text_files), args.batch_size)]
+    writer = ResultWriter(args.output)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    progress_bar = tqdm(total=len(text_files))
+    succeeded = 0
+
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+
+    async def run_batch(session, batch):
+        nonlocal succeeded
+        async with semaphore:
+            responses = await process_batch(session, batch, args.api_url, args.model, args.analysis_type, not args.no_cache)
+        for file_path in batch:
+            if file_path in responses:
+                writer.write(file_path, responses[file_path])
+                succeeded += 1
+        progress_bar.update(len(batch))
+
+    try:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            await asyncio.gather(*[run_batch(session, batch) for batch in batches])
+    finally:
+        writer.close()
+        progress_bar.close()
+
+    print(f"Processing complete. Processed {succeeded} of {len(text_files)} files.")
+
+    if args.format == 'parquet':
+        parquet_path = os.path.splitext(args.output)[0] + '.parquet'
+        convert_to_parquet(args.output, parquet_path)
+        print(f"Wrote {parquet_path}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Process text files using the backend batch API')
+    parser.add_argument('input_dir', help='Directory containing text files to process')
+    parser.add_argument('--output', default='./processed_data.csv', help='Output CSV file path')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv', help='Also write a Parquet copy of the output when set to parquet (needs pyarrow)')
+    parser.add_argument('--api_url', default='http://localhost:8000/api/process/batch', help='Batch API endpoint URL')
+    parser.add_argument('--model', default='gpt-4o-mini', help='Model to use')
+    parser.add_argument('--analysis_type', default='standard', choices=['standard', 'extended'], help='Analysis type')
+    parser.add_argument('--concurrency', type=int, default=4, help='Number of batch requests in flight')
+    parser.add_argument('--batch_size', type=int, default=8, help='Documents per batch request')
+    parser.add_argument('--no_cache', action='store_true', help='Bypass the server-side LLM response cache')
+    parser.add_argument('--timeout', type=float, default=1800, help='Timeout per batch request in seconds')
+    args = parser.parse_args()
+
+    # Checked up front rather than after the whole input has been processed
+    if args.format == 'parquet' and not any(importlib.util.find_spec(engine) for engine in ('pyarrow', 'fastparquet')):
+        parser.error("--format parquet needs pyarrow (pip install pyarrow)")
+
+    asyncio.run(run(args))
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()